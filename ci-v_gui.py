@@ -1,21 +1,35 @@
-''' CI-V interface monitor '''
-
+''' CI-V interface monitor
+    numpy/matplotlib are imported when the scope graph is built on the first Scope Run,
+    the window is shown without waiting for them
+'''
+
+from datetime import datetime
+from logging import getLogger
+import queue
 import tkinter as tk
 from tkinter import ttk
 import threading
-import time
-import numpy as np
-
-import matplotlib.pyplot as plt
-# from matplotlib import animation
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 import civ
+from civ_connect import ConnectionManager
+from civ_poll import PollScheduler
+
+logger = getLogger(__name__)
+
+# scope redraw interval in ms, about 30 fps
+SCOPE_FRAME_INTERVAL = 33
+# sweeps kept in waterfall, about 10 sec at 30 sweeps/s
+WATERFALL_DEPTH = 300
+# scope amplitude range
+SCOPE_MAX = 160
 
 
 class Application(tk.Frame):
-    ''' GUI Application '''
-    def __init__(self, master) -> None:
+    ''' GUI Application
+        Args:
+            waterfall_depth: number of sweeps in waterfall history
+    '''
+    def __init__(self, master, waterfall_depth=WATERFALL_DEPTH) -> None:
         super().__init__(master)
         self.grid()
 
@@ -25,8 +39,19 @@ class Application(tk.Frame):
         self.center_freq = 0
         self.span = 0
 
+        # sweeps from th_data_update to render_scope on Tk main loop, stale ones are dropped
+        self.sweep_queue = queue.Queue(maxsize=2)
+        self.scope_background = None
+        self.scope_axis = None
+        # waterfall history, civ_scope.SweepRing built in gen_graph() on the first Scope Run
+        self.waterfall_depth = waterfall_depth
+        self.waterfall = None
+
         self.flg_scope_run = False
-        self.rig_info_update_count = 0
+        # set while scope is running, th_data_update waits on it
+        self.scope_event = threading.Event()
+        # civ_record.Recorder while Save is on
+        self.recorder = None
 
         BUTTON_WIDTH_MID = 12
         LABEL_WIDTH_MID = 12
@@ -38,9 +63,9 @@ class Application(tk.Frame):
         self.label_mode.grid(row=0, column=1)
         frame1.grid(pady=5)
 
-        frame2 = tk.Frame(master)
-        self.gen_graph(frame2)
-        frame2.grid(pady=5)
+        # the graph is built in com_scope_run()
+        self.frame_graph = tk.Frame(master)
+        self.frame_graph.grid(pady=5)
 
         frame3 = tk.Frame(master)
         self.button_scope_run = tk.Button(frame3, text='Scope Run',
@@ -54,7 +79,8 @@ class Application(tk.Frame):
                                            command=self.com_scope_stop)
         self.button_scope_stop.grid(row=0, column=1)
         self.button_save = tk.Button(frame3, text='Save', width=BUTTON_WIDTH_MID,
-                                     font=('Calibri', 14, 'bold'))
+                                     font=('Calibri', 14, 'bold'),
+                                     command=self.com_save)
         self.button_save.grid(row=0, column=2)
         frame3.grid(pady=5)
 
@@ -72,11 +98,11 @@ class Application(tk.Frame):
         button_connect = tk.Button(frame4, text='Connect', width=BUTTON_WIDTH_MID,
                                    font=('Calibri', 14, 'bold'),
                                    command=self.com_connect)
-        combobox_com = ttk.Combobox(frame4, values=civ.CIV.serial_port_list(), height=3)
-        combobox_com.set('select com port')
+        self.combobox_com = ttk.Combobox(frame4, values=civ.CIV.serial_port_list(), height=3)
+        self.combobox_com.set('select com port')
 
         self.label_vd.grid(row=0, column=0)
-        combobox_com.grid(row=0, column=1)
+        self.combobox_com.grid(row=0, column=1)
         button_connect.grid(row=0, column=2)
         self.label_temp.grid(row=1, column=0)
         button_rig_on.grid(row=1, column=1)
@@ -90,110 +116,255 @@ class Application(tk.Frame):
         frame5.grid(pady=5)
 
         ##
-        # ci-v instance
-        self.my_rig = civ.CIV('COM5')
-        # is_connected = True
-        time.sleep(1)
-        self.my_rig.stop_scope_readout()
-        self.rig_data_update()
-        time.sleep(1)
-
-        # threading
-        self.thread1 = threading.Thread(target=self.th_info_update, daemon=True)
-        self.thread1.start()
-
-        self.thread2 = threading.Thread(target=self.th_data_update, daemon=True)
-        self.thread2.start()
+        # ci-v instance, port and baudrate are found by probing (cached for next start)
+        # the reader thread owns the port, poller and th_data_update share it,
+        # the same instance is reconnected in background if USB drops
+        # my_rig, poller and thread2 are set up by setup_rig() on the first connection
+        self.my_rig = None
+        self.poller = None
+        self.thread2 = None
+        self.connection = ConnectionManager('IC-7300', on_change=self.on_connection)
+        try:
+            self.connection.connect()
+        except OSError as e:
+            # no rig yet (ConnectionError) or port busy, start without link,
+            # the reconnect thread connects when the rig is found
+            logger.warning(f'rig not connected: {e}')
+            self.label_mode['text'] = 'NO LINK'
+            self.connection.start()
+
+        self.after(SCOPE_FRAME_INTERVAL, self.render_scope)
 
         # frame1a = tk.Frame()
         # self.gen_mpl_graph(frame1a)
         # frame1a.grid()
 
     def com_scope_run(self):
+        if self.waterfall is None:
+            self.gen_graph(self.frame_graph)
         if self.flg_scope_run is False:
             self.flg_scope_run = True
+            self.scope_event.set()
 
     def com_scope_stop(self):
         if self.flg_scope_run is True:
             self.flg_scope_run = False
+            self.scope_event.clear()
+
+    def setup_rig(self):
+        ''' start polling and scope thread, called on Tk main loop at the first connection '''
+        self.my_rig = self.connection.rig
+        self.my_rig.stop_scope_readout()
+
+        # freq, mode, Vd and GPS (if the rig has them) at their own rates,
+        # first read right after start
+        self.poller = PollScheduler(self.my_rig, callback=self.on_poll)
+        self.poller.start()
+
+        # threading
+        self.thread2 = threading.Thread(target=self.th_data_update, daemon=True)
+        self.thread2.start()
 
     def com_save(self):
-        pass
+        ''' start/stop recording scope and rig data to ./Log/scope_*.civrec '''
+        recorder = self.recorder
+        if recorder is None:
+            if self.my_rig is None:
+                return
+            from civ_record import Recorder  # pylint: disable=import-outside-toplevel
+            profile = self.my_rig.profile
+            self.recorder = Recorder(f'./Log/scope_{datetime.now():%Y%m%d_%H%M%S}.civrec',
+                                     profile.name if profile else '', self.my_rig.addr_rig[0],
+                                     profile.scope if profile else None)
+            self.button_save['text'] = 'Stop Save'
+        else:
+            self.recorder = None
+            recorder.close()
+            self.button_save['text'] = 'Save'
 
     def com_connect(self):
-        self.rig_data_update()
+        ''' connect to the port selected, or refresh rig data '''
+        port = self.combobox_com.get()
+        if port in civ.CIV.serial_port_list() and port != self.connection.port:
+            try:
+                self.connection.connect(port)
+            except OSError:
+                self.label_freq['text'] = f'no rig on {port}'
+                return
+        if self.my_rig is not None:
+            self.rig_data_update()
+
+    def on_connection(self, is_connected):
+        ''' called from the civ-connect thread when the link is lost or back '''
+        self.after(0, self.update_connection, is_connected)
+
+    def update_connection(self, is_connected):
+        ''' connection state on Tk main loop, the rig is set up on the first connection '''
+        self.is_connected = is_connected
+        if not is_connected:
+            self.label_freq['text'] = '--- Hz'
+            self.label_mode['text'] = 'NO LINK'
+            return
+        if self.label_mode['text'] == 'NO LINK':
+            self.label_mode['text'] = 'MODE'
+        if self.my_rig is None:
+            self.setup_rig()
 
     def com_rig_on(self):
-        self.my_rig.pwr_on()
+        if self.my_rig is not None:
+            self.my_rig.pwr_on()
 
     def com_rig_off(self):
         ''' shut down rig'''
-        self.my_rig.pwr_off()
+        if self.my_rig is not None:
+            self.my_rig.pwr_off()
 
     def gen_graph(self, master):
         ''' draw pectrum scope '''
-        self.fig, self.ax = plt.subplots()
-        self.fig.set_figwidth(5)
-        self.fig.set_figheight(2)
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        from civ_scope import SweepRing
+
+        # waterfall history, memory bounded to 2 * waterfall_depth sweeps
+        self.waterfall = SweepRing(self.waterfall_depth)
+
+        self.fig = Figure(figsize=(5, 4))
+        self.ax, self.ax_waterfall = self.fig.subplots(
+            2, 1, sharex=True, gridspec_kw={'height_ratios': (1, 2)})
 
         # dummy data for initial plot
         dummy_x = np.linspace(0, 200, 475)
         dummy_y = np.linspace(10, 150, 475)
 
-        (self.graph,) = self.ax.plot(dummy_x, dummy_y, linewidth=1)
+        # animated: line is not in the cached background, drawn by blit
+        (self.graph,) = self.ax.plot(dummy_x, dummy_y, linewidth=1, animated=True)
         # self.ax.set_xlabel('Freqency')
         # ax.set_ylabel('Amplitude')
         # ax.set_title('Spectrum Scope')
         self.ax.grid()
 
+        # waterfall: newest sweep on top, image data is a view of the ring buffer
+        self.waterfall_image = self.ax_waterfall.imshow(
+            self.waterfall.view(), aspect='auto', origin='lower', interpolation='nearest',
+            vmin=0, vmax=SCOPE_MAX, extent=(0, 200, 0, self.waterfall.depth), animated=True)
+        self.ax_waterfall.set_yticks([])
+
         # MatplotlibのFigureをTkinterのCanvasに埋め込む
         canvas = FigureCanvasTkAgg(self.fig, master=master)
         canvas_widget = canvas.get_tk_widget()
         canvas_widget.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
-
-    def redraw_graph(self, event=None):
-        # dummy
-        # dummy_x = np.linspace(0, 200, 475)
-        # dummy_y = np.linspace(30, 120, 475)
-
-        SCOPE_DATA_LENGTH = 475
-
-        if len(self.scope_data_list) == SCOPE_DATA_LENGTH:
-            x = np.linspace(self.center_freq - self.span, self.center_freq + self.span,
-                            SCOPE_DATA_LENGTH)
-            y = self.scope_data_list
-
+        # full redraw (resize, axis change) -> cache new background
+        canvas.mpl_connect('draw_event', self.on_draw)
+        self.canvas = canvas
+
+    def on_draw(self, event=None):
+        ''' cache background without scope line and waterfall, then draw them '''
+        self.scope_background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.graph)
+        self.ax_waterfall.draw_artist(self.waterfall_image)
+
+    def render_scope(self):
+        ''' draw the latest sweep, called on Tk main loop every SCOPE_FRAME_INTERVAL ms '''
+        if self.waterfall is None:
+            # no graph before the first Scope Run
+            self.after(SCOPE_FRAME_INTERVAL, self.render_scope)
+            return
+        sweep = None
+        try:
+            while True:
+                # drop stale sweeps if rendering falls behind
+                sweep = self.sweep_queue.get_nowait()
+                if len(sweep.data) == self.waterfall.points:
+                    # every sweep goes into waterfall, only the latest is drawn
+                    self.waterfall.push(sweep.data)
+        except queue.Empty:
+            pass
+
+        if sweep is not None:
+            self.redraw_graph(sweep)
+
+        self.after(SCOPE_FRAME_INTERVAL, self.render_scope)
+
+    def redraw_graph(self, sweep):
+        ''' update scope line and waterfall by blitting,
+            axes are rebuilt only if center/span changed
+        '''
+        SCOPE_DATA_LENGTH = self.my_rig.scope_points
+
+        if len(sweep.data) != SCOPE_DATA_LENGTH:
+            return
+        self.scope_data_list = sweep.data
+        self.center_freq = sweep.center_freq
+        self.span = sweep.span
+
+        if self.scope_axis != (self.center_freq, self.span):
+            self.scope_axis = (self.center_freq, self.span)
+            from civ_scope import bin_freqs  # pylint: disable=import-outside-toplevel
+            x = bin_freqs(self.center_freq, self.span, SCOPE_DATA_LENGTH)
             self.graph.set_xdata(x)
-            self.graph.set_ydata(y)
-
             self.ax.set_xlim(self.center_freq - self.span, self.center_freq + self.span)
             self.ax.set_xticks(self.span_to_xticks(self.center_freq, self.span))
             self.ax.set_xticklabels(self.span_to_xticklabels(self.span), fontsize=6)
+            self.graph.set_ydata(self.scope_data_list)
+            # history of the old band is meaningless, keep only this sweep
+            self.waterfall.clear()
+            self.waterfall.push(self.scope_data_list)
+            self.waterfall_image.set_extent((self.center_freq - self.span,
+                                             self.center_freq + self.span,
+                                             0, self.waterfall.depth))
+            self.waterfall_image.set_data(self.waterfall.view())
+            # full draw, background is cached in on_draw()
+            self.canvas.draw()
+
+            # freq update
+            if self.center_freq != 0:
+                self.label_freq['text'] = f'{self.center_freq:,} Hz'
+        elif self.scope_background is not None:
+            self.graph.set_ydata(self.scope_data_list)
+            # view moves with the write index, no copy of the history
+            self.waterfall_image.set_data(self.waterfall.view())
+            self.canvas.restore_region(self.scope_background)
+            self.ax.draw_artist(self.graph)
+            self.ax_waterfall.draw_artist(self.waterfall_image)
+            self.canvas.blit(self.fig.bbox)
+
+    def on_poll(self, info):
+        ''' called from the poll thread, labels are updated on Tk main loop '''
+        self.after(0, self.rig_data_update, info)
+
+    def rig_data_update(self, info=None):
+        ''' update labels, info is dict of values polled by self.poller,
+            read freq, mode and Vd in one round trip if None
+        '''
+        if info is None:
+            info = self.my_rig.query_many(['freq', 'opmode', 'vd'])
 
-            self.fig.canvas.draw()
-            self.fig.canvas.flush_events()
-            time.sleep(0.1)
-
-    def rig_data_update(self):
-        # print('hh')
         # freq
-        freq = self.my_rig.read_freq()
+        freq = info.get('freq', 0)
         if freq != 0:
             self.label_freq['text'] = f'{freq:,} Hz'
 
         # mode
-        if self.my_rig.read_opmode() != 'N/A':
-            self.label_mode['text'] = self.my_rig.read_opmode()
+        if info.get('opmode', 'N/A') != 'N/A':
+            self.label_mode['text'] = info['opmode']
 
         # Vd
-        vd = self.my_rig.read_vd()
-        # print(vd)
+        vd = info.get('vd', 0)
         if vd != 0:
             self.label_vd['text'] = f'Vd: {vd:.3g} V'
 
+        recorder = self.recorder
+        if recorder is not None:
+            # the latest of every item, not only the ones just polled
+            recorder.write_telemetry(**{name: self.poller.get(name) for name in
+                                        ('freq', 'opmode', 'vd', 'gps_position')})
+
     def span_to_xticklabels(self, span):
         NUM_XTICKS_LABEL = 11
         span = span / 1000
+        import numpy as np  # pylint: disable=import-outside-toplevel
         xticks_list = np.linspace(start=-span, stop=span, num=NUM_XTICKS_LABEL)
 
         return xticks_list
@@ -203,59 +374,56 @@ class Application(tk.Frame):
         tick_start = center_freq - span
         tick_stop = center_freq + span
 
+        import numpy as np  # pylint: disable=import-outside-toplevel
         xticks_list = np.linspace(start=tick_start, stop=tick_stop,
                                   num=NUM_XTICKS_LABEL)
 
         return xticks_list
 
-    def th_info_update(self):
-        while True:
-            self.rig_data_update()
-            time.sleep(3)
-
     def th_data_update(self):
-        RIG_INFO_INTERVAL = 3000
-
-        # start scope readout
-        self.my_rig.start_scope_readout()
-
         while True:
-            # print(self.rig_info_update_count)
-            if self.flg_scope_run:
-                self.scope_data_list, self.center_freq, self.span\
-                    = self.my_rig.read_spectrum(True)
-
-                # update graph
-                self.redraw_graph()
-                # time.sleep(0.5)
-
-                # freq update
-                if self.center_freq != 0:
-                    self.label_freq['text'] = f'{self.center_freq:,} Hz'
-
-            if self.rig_info_update_count == RIG_INFO_INTERVAL:
-                # stop scope readout
-                self.my_rig.stop_scope_readout()
-                # rig info update
-                self.rig_data_update()
-                # start scope readout
-                self.my_rig.start_scope_readout()
-                self.rig_info_update_count = 0
-            else:
-                self.rig_info_update_count += 1
+            # sleeps until Scope Run
+            self.scope_event.wait()
+            # scope readout is turned on once, sweeps are read at rig's frame rate
+            # drawing is done by render_scope() on Tk main loop
+            self.poller.set_scope(True)
+            sweeps = self.my_rig.iter_spectrum()
+            for sweep in sweeps:
+                recorder = self.recorder
+                if recorder is not None:
+                    recorder.write_sweep(sweep)
+                try:
+                    self.sweep_queue.put_nowait(sweep)
+                except queue.Full:
+                    # drop the oldest
+                    try:
+                        self.sweep_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    self.sweep_queue.put_nowait(sweep)
+
+                if not self.flg_scope_run:
+                    break
+            sweeps.close()
+            self.poller.set_scope(False)
 
     def __del__(self):
         ''' destructor '''
-        self.my_rig.stop_scope_readout()
-        # self.thread1.join()
-        self.thread2.join()
+        if self.poller is not None:
+            self.poller.stop()
+        if self.my_rig is not None:
+            self.my_rig.stop_scope_readout()
+        self.connection.close()
+        if self.thread2 is not None:
+            self.thread2.join()
 
 
 def main():
     ''' main function generating window instance '''
+    civ.setup_logging(log_dir='./Log')
     root = tk.Tk()
     root.title("CI-V Rig Monitor by JS2IIU")
-    root.geometry('550x500')
+    root.geometry('550x650')
     root.grid_anchor(tk.CENTER)
 
     app = Application(master=root)
@@ -1,13 +1,20 @@
-'''basic example for CI-V programming '''
+'''basic example for CI-V programming
+    importing this module has no side effects, logging is configured by the application,
+    ex) setup_logging(), numpy (civ_scope) and the reader thread (civ_dispatch,
+    concurrent.futures) are imported when first used
+'''
 from datetime import datetime
-from logging import getLogger, StreamHandler, FileHandler, Formatter
-from logging import DEBUG
-import re
-import struct
+import logging
+from logging import getLogger, DEBUG
+import os
+import queue
 import time
 
 import serial
-from serial.tools import list_ports
+
+import civ_codec
+import civ_rigs
+from civ_state import RigState
 
 # Const for I-COM rigs
 ICOM_DRIVER_KW = 'CP210x'
@@ -21,7 +28,12 @@ POSA = [0xFD]
 # PC HOST ADDRESS
 ADHOST = [0x00]
 
+# transceive broadcast from rig
+cmd_trx_freq = [0x00]
+cmd_trx_opmode = [0x01]
+
 cmd_read_freq = [0x03]
+cmd_set_freq = [0x05]
 cmd_read_Smeter = [0x15, 0x02]
 cmd_read_spectrum = [0x27, 0x00]
 cmd_scope_on = [0x27, 0x10, 0x01]
@@ -39,43 +51,91 @@ cmd_read_opmode = [0x04]
 
 cmd_read_gps_pos = [0x23, 0x00]
 
+OPMODE_STR = ['LSB', 'USB', 'AM', 'CW', 'RTTY',
+              'FM', 'Reserved', 'CW-R', 'RTTY-R', 'N/A',
+              'N/A', 'N/A', 'N/A', 'N/A', 'N/A',
+              'N/A', 'N/A', 'DV']
+
 # Logger setting
 logger = getLogger(__name__)
-log_fmt = Formatter('%(asctime)s | %(filename)s | %(name)s | %(funcName)s \
-                    | %(levelname)s | %(message)s')
+LOG_FORMAT = '%(asctime)s | %(filename)s | %(name)s | %(funcName)s | %(levelname)s | %(message)s'
 
-shandler = StreamHandler()
-shandler.setLevel(DEBUG)
-shandler.setFormatter(log_fmt)
 
-fhandler = FileHandler(f'./Log/log_{datetime.now():%Y%m%d%H%M%S}.log', encoding='utf-8')
-fhandler.setLevel(DEBUG)
-fhandler.setFormatter(log_fmt)
-
-logger.setLevel(DEBUG)
-logger.addHandler(shandler)
-logger.addHandler(fhandler)
-logger.propagate = False
+def setup_logging(level=logging.INFO, log_dir=None):
+    ''' configure root logger for an application, call once from main
+        Args:
+            level: log level, DEBUG also logs raw frames and scope data
+            log_dir: if given, also log to log_dir/log_<timestamp>.log, created if missing
+    '''
+    fmt = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+        handlers.append(logging.FileHandler(
+            os.path.join(log_dir, f'log_{datetime.now():%Y%m%d%H%M%S}.log'), encoding='utf-8'))
+    root = getLogger()
+    root.setLevel(level)
+    for handler in handlers:
+        handler.setFormatter(fmt)
+        root.addHandler(handler)
 
 
 class CIV():
     ''' class CIV, controls i-com rig via CI-V
         direct serial connection or CI-V intercface is necessary
     '''
-    def __init__(self, com_port, rig_pn='IC-7300') -> None:
+    # query name for query_many(): (command, reply decoder classmethod name)
+    QUERIES = {
+        'freq': (cmd_read_freq, 'parse_freq'),
+        'opmode': (cmd_read_opmode, 'parse_opmode'),
+        'vd': (cmd_vd, 'parse_vd'),
+        'gps_position': (cmd_read_gps_pos, 'parse_gps_position'),
+        'smeter': (cmd_read_Smeter, 'parse_smeter'),
+    }
+    # (cmd, subcmd) of frames from rig -> state cache field name
+    STATE_FRAMES = {
+        (cmd_trx_freq[0], None): 'freq',
+        (cmd_read_freq[0], None): 'freq',
+        (cmd_trx_opmode[0], None): 'opmode',
+        (cmd_read_opmode[0], None): 'opmode',
+        tuple(cmd_vd): 'vd',
+        tuple(cmd_read_gps_pos): 'gps_position',
+    }
+    # decoded value on failure, not stored to state cache
+    INVALID_VALUES = (0, 'N/A', ('', ''))
+
+    def __init__(self, com_port, rig_pn='IC-7300', ser=None) -> None:
         # rig address and baudrate setting
         logger.info(f'dig part name: {rig_pn}')
-        self.addr_rig = self.rig_address(rig_pn)
-        rig_baud = self.rig_baudrate(rig_pn)
-
-        # regex pattern for scope data read out
-        # self.pat_scope =
-        #       re.compile(
-        #           r'fefe([0-9]{2})([\w]{2})270000([0-9]{2})([0-9]{2})00([0-9]{10})([0-9]{12})fd'
-        #           )
-        self.pat_scope = re.compile(
-            r'fefe00(\w{2})270000([0-9]{2})([0-9]{2})(\w{24}|\w{50}|\w{100})fd'
-            )
+        # looked up once, an unknown rig_pn is logged once
+        self.profile = self.rig_profile(rig_pn)
+        if self.profile is not None:
+            self.addr_rig = [self.profile.address]
+            rig_baud = self.profile.baudrate
+        else:
+            self.addr_rig = [0x00]
+            rig_baud = civ_rigs.DEFAULT_BAUDRATE
+        if self.profile is not None and self.profile.scope is not None:
+            self.scope_points = self.profile.scope.points
+        else:
+            self.scope_points = civ_rigs.DEFAULT_SCOPE.points
+
+        # frames not consumed as reply
+        self.parser = civ_codec.FrameParser()
+        # background reader, see start_reader()
+        self.dispatcher = None
+        self.frame_queue = None
+        self.is_reader_owner = False
+        # state cache, see enable_state_cache()
+        self.state = None
+        # civ_metrics.Metrics, see enable_metrics()
+        self.metrics = None
+
+        # ser: already opened serial.Serial compatible object, not closed by this instance
+        self.is_port_owner = ser is None
+        if ser is not None:
+            self.ser = ser
+            return
 
         logger.info(f'open com port: {com_port}')
         try:
@@ -85,12 +145,17 @@ class CIV():
                                      stopbits=serial.STOPBITS_ONE,
                                      timeout=2)
         except serial.serialutil.SerialException:
+            # no half-built instance without self.ser,
+            # civ_connect.ConnectionManager finds the port and baudrate
             logger.error(f'Serial port exception: {com_port}')
+            raise
 
         # self.is_icom_rig = self.check_port()
 
     def check_port(self):
         ''' check port is for i-com rigs '''
+        import re  # pylint: disable=import-outside-toplevel
+        from serial.tools import list_ports  # pylint: disable=import-outside-toplevel
         is_found = False
 
         ports = list_ports.comports()
@@ -102,34 +167,158 @@ class CIV():
 
         return is_found
 
-    def send_msg(self, command_list):
+    def send_msg(self, command_list, expect_reply=True):
         ''' send_msg to rig
             Args:
                 command_list, byte-by-byte command in list format
                 command_list should include PREA, address and POSA
                 ex) [0xFE, 0xFE, 0x94, ...., 0xFD]
+                expect_reply: if False, returns right after writing
             Returns:
-                raw buffer bytes content
+                reply frame in bytes, b'' if no reply
         '''
-        msg = b''
-        for cmd in command_list:
-            msg = msg + struct.pack('B', cmd)
-        self.ser.write(msg)
+        msg = bytes(command_list)
+        metrics = self.metrics
+        start = time.monotonic() if metrics is not None else 0.0
+        if self.dispatcher is not None:
+            if not expect_reply:
+                # civ_bus.CIVBus arbitrates the bus here
+                self.dispatcher.send(msg)
+                return b''
+            frame = self.dispatcher.transact(msg, self.ser.timeout)
+            if metrics is not None:
+                metrics.transaction(msg, start, frame)
+            if frame is None:
+                logger.error(f'no reply for command 0x{msg[4]:02X}')
+                return b''
+            return civ_codec.frame_to_bytes(frame)
 
+        self.ser.write(msg)
         self.ser.flush()
-        time.sleep(0.2)
+        if metrics is not None:
+            metrics.count('bytes_out', len(msg))
 
-        buffer = self.ser.readline()
-        return buffer
+        if not expect_reply:
+            return b''
+
+        reply = self.read_response(msg)
+        if metrics is not None:
+            metrics.transaction(msg, start, civ_codec.parse_frame(reply) if reply else None)
+        return reply
+
+    def read_response(self, sent_msg):
+        ''' read frames until the reply for sent_msg arrives
+            the echo of sent_msg (single wire CI-V bus) and frames
+            for other commands or rigs are dropped
+            Args:
+                sent_msg: request frame in bytes
+            Returns:
+                reply frame in bytes, b'' on timeout
+        '''
+        request = civ_codec.parse_frame(sent_msg)
+        cmd = sent_msg[4]
+        if request is None:
+            logger.error(f'invalid request: {sent_msg.hex()}')
+            return b''
+        deadline = time.monotonic() + (self.ser.timeout or 0)
+
+        while True:
+            buffer = self.read_msg()
+            frame = civ_codec.parse_frame(buffer)
+            if self.metrics is not None and buffer:
+                self.metrics.count('frames' if frame is not None else 'framing_errors')
+            # frame from rig to host: reply, or OK/NG for set/command
+            if (frame is not None and buffer != sent_msg
+                    and frame.dst == ADHOST[0] and frame.src == request.dst
+                    and civ_codec.is_reply(request, frame)):
+                return buffer
+            if frame is not None and self.state is not None:
+                # ex) transceive broadcast
+                self.update_state(frame)
+            if not buffer or time.monotonic() > deadline:
+                logger.error(f'no reply for command 0x{cmd:02X}')
+                return b''
+
+    def query(self, command_list):
+        ''' send command and returns reply
+            Returns:
+                civ_codec.Frame, None if no reply
+        '''
+        if self.dispatcher is not None:
+            msg = bytes(command_list)
+            metrics = self.metrics
+            start = time.monotonic() if metrics is not None else 0.0
+            frame = self.dispatcher.transact(msg, self.ser.timeout)
+            if metrics is not None:
+                metrics.transaction(msg, start, frame)
+            if frame is None:
+                logger.error(f'no reply for command 0x{msg[4]:02X}')
+            return frame
+        return civ_codec.parse_frame(self.send_msg(command_list))
 
     def read_msg(self):
-        """ read serial communication buffer """
-        # TODO: readlineのほうが良いかも
-        # buffer = self.ser.read(100)
-        buffer = self.ser.readline()
-        logger.debug(buffer)
+        """ read one frame, up to POSA, from serial communication buffer """
+        buffer = self.ser.read_until(bytes(POSA))
+        if self.metrics is not None:
+            self.metrics.count('bytes_in', len(buffer))
+        # formatted only if DEBUG is enabled
+        logger.debug('%s', buffer)
         return buffer
 
+    def read_frames(self):
+        """ read frames which are not reply for a request, ex) scope data
+            Returns:
+                list of civ_codec.Frame, empty list on timeout
+        """
+        if self.dispatcher is None:
+            frames = self.parser.feed(self.read_msg())
+            if self.state is not None:
+                for frame in frames:
+                    self.update_state(frame)
+            return frames
+        try:
+            return [self.frame_queue.get(timeout=self.ser.timeout)]
+        except queue.Empty:
+            return []
+
+    def start_reader(self):
+        """ start background reader thread
+            after this call, one thread owns reading side of the port.
+            replies are routed to the caller, other frames to read_frames(),
+            so polling and scope streaming can run from different threads
+        """
+        if self.dispatcher is not None:
+            return
+        # civ_dispatch/concurrent.futures are not needed by short-lived direct reads
+        from civ_dispatch import FrameDispatcher  # pylint: disable=import-outside-toplevel
+        dispatcher = FrameDispatcher(self.ser, ADHOST[0])
+        self.attach_dispatcher(dispatcher)
+        self.is_reader_owner = True
+        dispatcher.start()
+
+    def attach_dispatcher(self, dispatcher):
+        """ use a reader thread already running on self.ser, ex) civ_bus.CIVBus
+            only frames from this rig's address are read by read_frames()
+        """
+        self.dispatcher = dispatcher
+        self.frame_queue = dispatcher.subscribe(src=self.addr_rig[0])
+        self.is_reader_owner = False
+        if self.state is not None:
+            dispatcher.add_listener(self.update_state)
+        if self.metrics is not None:
+            self.enable_metrics(self.metrics)
+
+    def stop_reader(self):
+        """ stop background reader thread, or detach from a shared one """
+        if self.dispatcher is None:
+            return
+        self.dispatcher.unsubscribe(self.frame_queue)
+        self.dispatcher.remove_listener(self.update_state)
+        if self.is_reader_owner:
+            self.dispatcher.stop()
+        self.dispatcher = None
+        self.frame_queue = None
+
     def pwr_off(self):
         ''' shut down '''
         logger.info('try to shut down connected rig')
@@ -143,34 +332,235 @@ class CIV():
         NUM_RPT = 25
         WAKE = [0xFE]
         for _ in range(NUM_RPT):
-            self.send_msg(WAKE)
+            self.send_msg(WAKE, expect_reply=False)
         msg_list = PREA + self.addr_rig + ADHOST + cmd_pwr_on + POSA
         self.send_msg(msg_list)
 
+    def query_many(self, names):
+        ''' send several read requests back to back and collect the replies
+            one round trip for all, instead of one per request
+            Args:
+                names: list of query names in CIV.QUERIES, ex) ['freq', 'opmode', 'vd']
+            Returns:
+                dict, query name -> decoded value, value on failure is same as read_*()
+        '''
+        names = list(dict.fromkeys(names))
+        out = {}
+        if self.state is not None:
+            for name in names:
+                value = self.state.get(name)
+                if value is not None:
+                    out[name] = value
+            names = [name for name in names if name not in out]
+            if not names:
+                return out
+        msgs = [bytes(PREA + self.addr_rig + ADHOST + self.QUERIES[name][0] + POSA)
+                for name in names]
+        frames = self.send_many(msgs)
+        for name, frame in zip(names, frames):
+            if frame is None:
+                logger.error(f'no reply for query: {name}')
+            out[name] = getattr(self, self.QUERIES[name][1])(frame, self.profile)
+        return out
+
+    def send_many(self, msgs):
+        ''' write request frames back to back and wait for all replies
+            the rig answers in order, set commands are answered by OK/NG
+            Args:
+                msgs: list of request frames in bytes
+            Returns:
+                list of civ_codec.Frame in the order of msgs, None if no reply
+        '''
+        metrics = self.metrics
+        start = time.monotonic() if metrics is not None else 0.0
+
+        if self.dispatcher is not None:
+            # pylint: disable=import-outside-toplevel
+            from concurrent.futures import CancelledError, TimeoutError as FutureTimeoutError
+            futures = [self.dispatcher.request(msg) for msg in msgs]
+            frames = []
+            deadline = time.monotonic() + (self.ser.timeout or 0)
+            for future in futures:
+                try:
+                    frames.append(future.result(max(deadline - time.monotonic(), 0)))
+                except (FutureTimeoutError, CancelledError):
+                    self.dispatcher.cancel(future)
+                    frames.append(None)
+        else:
+            self.ser.write(b''.join(msgs))
+            self.ser.flush()
+            if metrics is not None:
+                metrics.count('bytes_out', sum(len(msg) for msg in msgs))
+            frames = self.read_replies(msgs)
+
+        if metrics is not None:
+            # one round trip, latency is for the whole batch
+            for msg, frame in zip(msgs, frames):
+                metrics.transaction(msg, start, frame)
+        return frames
+
+    def read_query(self, name):
+        ''' read one value in CIV.QUERIES, from state cache if it is fresh '''
+        if self.state is not None:
+            value = self.state.get(name)
+            if value is not None:
+                return value
+
+        msg_list = PREA + self.addr_rig + ADHOST + self.QUERIES[name][0] + POSA
+        frame = self.query(msg_list)
+        if frame is not None and self.state is not None and self.dispatcher is None:
+            # with reader thread, state is updated by listener
+            self.update_state(frame)
+        return getattr(self, self.QUERIES[name][1])(frame, self.profile)
+
+    def enable_state_cache(self, ttl=None):
+        ''' cache frequency, mode, Vd, GPS position and scope center/span
+            read_*() and query_many() return cached values while they are fresh,
+            values are also updated by transceive broadcast (cmd 0x00/0x01)
+            Args:
+                ttl: dict, field name -> TTL in sec, see civ_state.DEFAULT_TTL
+            Returns:
+                civ_state.RigState
+        '''
+        if self.state is None:
+            self.state = RigState(ttl)
+            if self.dispatcher is not None:
+                self.dispatcher.add_listener(self.update_state)
+        elif ttl is not None:
+            self.state.ttl.update(ttl)
+        return self.state
+
+    def enable_metrics(self, metrics=None):
+        ''' count I/O, measure latency per command and call trace callbacks
+            Args:
+                metrics: civ_metrics.Metrics to share, ex) between rigs on a CIVBus
+            Returns:
+                civ_metrics.Metrics
+        '''
+        if metrics is None:
+            metrics = self.metrics
+        if metrics is None:
+            from civ_metrics import Metrics  # pylint: disable=import-outside-toplevel
+            metrics = Metrics()
+        for name, (cmd, _) in self.QUERIES.items():
+            metrics.names[tuple(cmd)] = name
+        metrics.names[tuple(cmd_set_freq)] = 'set_freq'
+        metrics.add_source(self.parser)
+        self.metrics = metrics
+        if self.dispatcher is not None:
+            if self.dispatcher.metrics is None:
+                self.dispatcher.metrics = metrics
+            metrics.add_source(self.dispatcher)
+        return metrics
+
+    def disable_metrics(self):
+        ''' stop counting, also clears the metrics of the reader thread owned by this instance,
+            the reader thread keeps running
+        '''
+        if self.dispatcher is not None and self.is_reader_owner:
+            self.dispatcher.metrics = None
+        self.metrics = None
+
+    def disable_state_cache(self):
+        ''' stop caching, every read goes to the rig '''
+        if self.dispatcher is not None:
+            self.dispatcher.remove_listener(self.update_state)
+        self.state = None
+
+    def update_state(self, frame):
+        """ update state cache from a frame sent by this rig """
+        state = self.state
+        if state is None or frame.src != self.addr_rig[0]:
+            return
+        name = self.STATE_FRAMES.get((frame.cmd, frame.subcmd))
+        if name is not None:
+            value = getattr(self, self.QUERIES[name][1])(frame, self.profile)
+            if value not in self.INVALID_VALUES:
+                state.set(name, value)
+        elif self.is_scope_frame(frame) and frame.payload[1] == 0x01:
+            try:
+                center_freq = self.decode_freq(frame.payload[4:9])
+                span = self.decode_span(frame.payload[9:14])
+            except ValueError:
+                return
+            if center_freq != 0:
+                state.set('scope', (center_freq, span))
+
+    def read_replies(self, msgs):
+        """ read replies for request frames sent back to back
+            OK/NG from a rig is the reply for its oldest set/command not answered yet
+            Returns:
+                list of civ_codec.Frame in the order of msgs, None if not received
+        """
+        # (request Frame, index of msgs) in send order
+        pending = [(civ_codec.parse_frame(msg), i) for i, msg in enumerate(msgs)]
+        frames = [None] * len(msgs)
+        remain = len(msgs)
+        deadline = time.monotonic() + (self.ser.timeout or 0)
+
+        while remain and time.monotonic() < deadline:
+            buffer = self.read_msg()
+            if not buffer:
+                break
+            for frame in self.parser.feed(buffer):
+                if frame.dst != ADHOST[0]:
+                    # echo
+                    continue
+                if self.state is not None:
+                    self.update_state(frame)
+                for entry in pending:
+                    request, i = entry
+                    if request.dst == frame.src and civ_codec.is_reply(request, frame):
+                        pending.remove(entry)
+                        frames[i] = frame
+                        remain -= 1
+                        break
+
+        return frames
+
     def read_freq(self):
         ''' Returns Frequency in Hz '''
         logger.info('Reading current Frequency')
-        msg_list = PREA + self.addr_rig + ADHOST + cmd_read_freq + POSA
-        ret = self.send_msg(msg_list)
-        ret_s = ''
-
-        s = re.search(r'fefe00(\w{2})03([0-9]{10})fd', ret.hex())
-
-        if s is not None:
-            ret_s = s.group(2)
-            # print(len(ret))
-        if len(ret_s) == 10:
-            # 送信したメッセージから0xfdの2文字分減らして帰ってきた文字のみ抽出する=周波数の文字列
-            # ret = ret[(len(msg_list) - 1) * 2:-2]
-            freq = self.reverse_msg(ret_s)
-            freq = int(freq)
-            logger.debug(f'Freq raw msg: {freq}')
-        else:
+        freq = self.read_query('freq')
+        if freq == 0:
             logger.error('Frequency read out was failed')
-            freq = 0
+        else:
+            logger.debug(f'Freq: {freq}')
 
         return freq
 
+    @classmethod
+    def parse_freq(cls, frame, profile=None):
+        ''' frequency in Hz from reply frame of cmd_read_freq or cmd_trx_freq, 0 if invalid
+            frequency data is 5 bytes (4 bytes in transceive of old rigs), 6 bytes on IC-905
+        '''
+        if frame is None or frame.cmd not in (cmd_read_freq[0], cmd_trx_freq[0])\
+                or len(frame.payload) not in (4, 5, 6):
+            return 0
+        try:
+            return civ_codec.decode_freq(frame.payload)
+        except ValueError:
+            return 0
+
+    def set_freq_msg(self, freq):
+        ''' request frame of cmd_set_freq in bytes, freq in Hz '''
+        freq_bytes = self.profile.freq_bytes if self.profile is not None else 5
+        return bytes(PREA + self.addr_rig + ADHOST + cmd_set_freq
+                     + list(civ_codec.encode_freq(freq, freq_bytes)) + POSA)
+
+    def set_freq(self, freq):
+        ''' set frequency in Hz
+            Returns:
+                True if the rig accepted (OK)
+        '''
+        frame = self.query(self.set_freq_msg(freq))
+        is_ok = frame is not None and frame.cmd == civ_codec.OK
+        if not is_ok:
+            logger.error(f'set frequency failed: {freq:,} Hz')
+        elif self.state is not None:
+            self.state.set('freq', freq)
+        return is_ok
+
     def stop_scope_readout(self):
         """ scope readout stop """
         msg_list = PREA + self.addr_rig + ADHOST + cmd_scope_readout_off + POSA
@@ -190,8 +580,7 @@ class CIV():
                 center_freq: scope center frequency in Hz
                 span: frequency span in Hz
         '''
-        count = 0
-        ret_dat = bytes(0)
+        frames = []
 
         # if sspectrum scope is not shown in rig's display, turn on scope
         if is_1st:
@@ -204,106 +593,95 @@ class CIV():
 
             # read spectrum data
             msg_list = PREA + self.addr_rig + ADHOST + cmd_read_spectrum + POSA
-            ret_dat = self.send_msg(msg_list)
-            logger.debug(f'ret_dat: {ret_dat}')
-        # print(ret.hex())
-        while count < 15:
-            ret_dat = ret_dat + self.ser.readline()
-            count += 1
-
-        # find read out response
-        # ACK: fefe0094 27 00 00 fa fd
-        # data1: fefe0094 27 00 00 01 11 00 ********** 00 ********** fd
-        # data2-11: fefe0094 27 00 ## 11 **data(50/100)** fd
-        #
-        # regex pattern definition in self.__init__()
-        # pat_scope =
-        #       re.compile(
-        #           r'fefe([0-9]{2})([0-9]{2})270000([0-9]{2})([0-9]{2})00([0-9]{10})([0-9]{12})fd'
-        #           )
-        # [('00', '94', '01', '11', '000030660900002500000000')]
-        # self.pat_scope =
-        #       re.compile(r'fefe00(\w{2})270000([0-9]{2})([0-9]{2})(\w{24}|\w{50}|\w{100})fd')
-        res = re.findall(self.pat_scope, ret_dat.hex())
-        logger.debug(f'res: {res}')
-
-        count = 1
-        scope_data = ''
-        scope_data_list = []
-        center_freq = 0
-        span = 0
-
-        is_find_1st = False
-        is_complete = False
-
-        for d in res:
-            # print(d[0])
-            if not is_complete:
-                if not is_find_1st:
-                    if d[1] == '01':
-                        # d[1] == NOW
-                        # ### check freq/span
-                        data = d[3]
-                        # d[3] = centerfreq + span
-                        center_freq = self.decode_freq(data[2:12])
-                        # print(center_freq, data[2:12])
-                        span = self.decode_span(data[12:])
-                        # print(f'centfreq: {center_freq:,} Hz, span: {span:,} Hz')
-                        logger.debug(f'Centfreq: {center_freq:,} Hz, Span: {span:,} Hz')
-                        is_find_1st = True
-                else:
-                    # ### add data
-                    scope_data = scope_data + d[3]
-                    if d[1] == '11':
-                        is_find_1st = False
-                        data_list = self.scope_data_to_list(scope_data)
-                        for da in data_list:
-                            scope_data_list.append(int(da, 16))
-                        is_complete = True
-
-        logger.debug(f'scope data: {scope_data_list}')
+            frame = self.query(msg_list)
+            if frame is not None:
+                frames.append(frame)
+
+        from civ_scope import SweepAssembler  # pylint: disable=import-outside-toplevel
+        assembler = SweepAssembler(self.scope_points)
+        sweep = None
+
+        # echo, OK and transceive frames are read here too, so the budget is
+        # scope frames and time, not reads
+        scope_frames = 0
+        deadline = time.monotonic() + (self.ser.timeout or 0)
+        while True:
+            for frame in frames:
+                if self.is_scope_frame(frame):
+                    scope_frames += 1
+                    sweep = assembler.feed(frame.payload)
+                    if sweep is not None:
+                        break
+            if sweep is not None or scope_frames >= DATA_MAX * 2\
+                    or time.monotonic() > deadline:
+                break
+            frames = self.read_frames()
+
+        if sweep is not None:
+            scope_data_list = sweep.data.tolist()
+        else:
+            scope_data_list = []
+        center_freq = assembler.center_freq
+        span = assembler.span
+        if logger.isEnabledFor(DEBUG):
+            # whole scope data is formatted only if DEBUG is enabled
+            logger.debug(f'Centfreq: {center_freq:,} Hz, Span: {span:,} Hz')
+            logger.debug(f'scope data: {scope_data_list}')
 
         return scope_data_list, center_freq, span
 
-    @classmethod
-    def scope_data_to_list(cls, scope_data):
-        """ scopedata format change from continuous string to splitted string list """
-        SCOPE_DATA_LENGTH = 475 * 2
-        out_data = []
-        if len(scope_data) == SCOPE_DATA_LENGTH:
-            for i in range(SCOPE_DATA_LENGTH // 2):
-                out_data.append(scope_data[i*2:i*2+2])
+    def iter_spectrum(self, copy=True):
+        ''' turn on scope readout once and yield sweeps as they arrive
+            Args:
+                copy: if False, Sweep.data is reused for the next sweep
+            Yields:
+                civ_scope.Sweep, data in numpy.uint8 array
+        '''
+        msg_list = PREA + self.addr_rig + ADHOST + cmd_scope_on + POSA
+        self.send_msg(msg_list)
+        self.start_scope_readout()
+
+        from civ_scope import SweepAssembler  # pylint: disable=import-outside-toplevel
+        assembler = SweepAssembler(self.scope_points, copy=copy)
+        dropped = 0
+        try:
+            while True:
+                for frame in self.read_frames():
+                    if self.is_scope_frame(frame):
+                        sweep = assembler.feed(frame.payload)
+                        if sweep is not None:
+                            if self.metrics is not None:
+                                self.metrics.sweep(assembler.dropped - dropped)
+                                dropped = assembler.dropped
+                            yield sweep
+        finally:
+            if assembler.dropped:
+                logger.info(f'scope sweeps dropped: {assembler.dropped}')
+            self.stop_scope_readout()
 
-        return out_data
+    @classmethod
+    def is_scope_frame(cls, frame):
+        """ check frame is scope waveform data from rig """
+        return (frame.cmd == cmd_read_spectrum[0] and frame.subcmd == cmd_read_spectrum[1]
+                and len(frame.payload) > 3 and frame.dst == ADHOST[0])
 
     @classmethod
-    def decode_freq(cls, freq_string):
-        """ decode frequency format """
-        FREQ_FULL_LENGTH = 10
-        FREQ_LENGTH = 10
-        if len(freq_string) == FREQ_FULL_LENGTH:
-            freq = ''
-            tmp = []
-            # 最初の2文字を捨てる
-            # freq_string = freq_string[2:]
-            for i in range(FREQ_LENGTH // 2):
-                tmp.append(freq_string[2*i:2*i+2])
-            for i in range(FREQ_LENGTH // 2):
-                freq = freq + tmp[FREQ_LENGTH // 2 - i - 1]
+    def decode_freq(cls, freq_data):
+        """ decode frequency format, 5 BCD bytes in 1 Hz digit first order """
+        FREQ_LENGTH = 5
+        if len(freq_data) == FREQ_LENGTH:
+            freq = civ_codec.decode_freq(freq_data)
         else:
             freq = 0
 
-        return int(freq)
+        return freq
 
     @classmethod
-    def decode_span(cls, span_string):
-        ''' decode span string, returns span in Hz'''
-        SPAN_FULL_LENGTH = 12
-        if len(span_string) == SPAN_FULL_LENGTH:
-            span = int(span_string[2:3]) * 1000\
-                 + int(span_string[3:4]) * 100\
-                 + int(span_string[4:5]) * 100000\
-                 + int(span_string[5:6]) * 10000
+    def decode_span(cls, span_data):
+        ''' decode span data, returns span in Hz'''
+        SPAN_LENGTH = 5
+        if len(span_data) == SPAN_LENGTH:
+            span = civ_codec.decode_span(span_data)
         else:
             span = 0
         return span
@@ -311,8 +689,9 @@ class CIV():
     @classmethod
     def serial_port_list(cls):
         """ returns serial port list """
+        from serial.tools import list_ports  # pylint: disable=import-outside-toplevel
         port_list = []
-        ports = list(serial.tools.list_ports.comports())
+        ports = list(list_ports.comports())
         for p in ports:
             # if 'USB Serial Port' in p.description:
             port_list.append(p.device)
@@ -323,7 +702,7 @@ class CIV():
         """ spectrum data save to csv """
         logger.info('output spectrum data to csv')
         # READ_MAX = 11
-        filename = f'./Log/spectrum_{datetime.now()::%Y%m%d_%H%M%S}.csv'
+        filename = f'./Log/spectrum_{datetime.now():%Y%m%d_%H%M%S}.csv'
         logger.info(f'filename: {filename}')
         count = 0
 
@@ -342,7 +721,7 @@ class CIV():
             f.write(ret.hex() + '\n')
 
             while count < 10:
-                ret = self.ser.readline()
+                ret = self.read_msg()
                 f.write(ret.hex())
                 # print(f'#{count:02} {ret.hex()}')
                 count += 1
@@ -355,121 +734,134 @@ class CIV():
 
     def read_vd(self):
         """ read Vd value in V, IC-7300 only"""
-        msg_list = PREA + self.addr_rig + ADHOST + cmd_vd + POSA
-        ret = self.send_msg(msg_list)
-        s = re.search(r'fefe00([\w]{2})1515([0-9]{4})fd', ret.hex())
-        if s is not None:
-            val = int(s.group(1))
-            # print(val)
-        else:
-            val = -1
+        return self.read_query('vd')
+
+    @classmethod
+    def parse_vd(cls, frame, profile=None):
+        """ Vd in V from reply frame of cmd_vd, 0.0 if invalid
+            level is scaled by profile.vd_scale, IC-7300 scale if profile is None
+        """
+        val = -1
+        if frame is not None and (frame.cmd, frame.subcmd) == tuple(cmd_vd)\
+                and len(frame.payload) == 2:
+            try:
+                val = civ_codec.decode_level(frame.payload)
+            except ValueError:
+                pass
 
         if val < 0 or val > 255:
             out_val = 0.0
-        elif val < 14:
-            out_val = 10 / 13 * val
         else:
-            out_val = 6 / 228 * val + 10
+            out_val = civ_rigs.scale_vd(val, profile.vd_scale if profile else None)
 
         return out_val
 
+    def read_smeter(self):
+        ''' read S-meter level 0-255, 0: S0, 120: S9, 241: S9+60dB, -1 if failed '''
+        return self.read_query('smeter')
+
+    @classmethod
+    def parse_smeter(cls, frame, profile=None):
+        """ S-meter level 0-255 from reply frame of cmd_read_Smeter, -1 if invalid """
+        if frame is not None and (frame.cmd, frame.subcmd) == tuple(cmd_read_Smeter)\
+                and len(frame.payload) == 2:
+            try:
+                return civ_codec.decode_level(frame.payload)
+            except ValueError:
+                pass
+        return -1
+
     def read_opmode(self):
         ''' returnd mode in string'''
-        opmode_str = ['LSB', 'USB', 'AM', 'CW', 'RTTY',
-                      'FM', 'Reserved', 'CW-R', 'RTTY-R', 'N/A',
-                      'N/A', 'N/A', 'N/A', 'N/A', 'N/A',
-                      'N/A', 'N/A', 'DV']
-
-        msg_list = PREA + self.addr_rig + ADHOST + cmd_read_opmode + POSA
-        ret = self.send_msg(msg_list)
-        s = re.search(r'fefe00([\w]{2})04([0-9]{4})fd', ret.hex())
+        return self.read_query('opmode')
 
-        if s is not None:
-            # print(s.group(2))
-            num = int(s.group(2)[:2])
-        else:
+    @classmethod
+    def parse_opmode(cls, frame, profile=None):
+        ''' mode string from reply frame of cmd_read_opmode or cmd_trx_opmode, 'N/A' if invalid '''
+        num = 9
+        if frame is not None and frame.cmd in (cmd_read_opmode[0], cmd_trx_opmode[0])\
+                and frame.payload:
+            try:
+                num = civ_codec.decode_bcd(frame.payload[:1])
+            except ValueError:
+                pass
+        if num >= len(OPMODE_STR):
             num = 9
 
-        return opmode_str[num]
+        return OPMODE_STR[num]
 
     def read_gps_position(self):
         """ read out GPS position data
             Returns:
                 tuple latitude, longitude
         """
-        # cmd_read_gps_pos
-        msg_list = PREA + self.addr_rig + ADHOST + cmd_read_gps_pos + POSA
-        ret = self.send_msg(msg_list)
-        pat_gps = re.compile(
-            r'fefe00(\w{2})2300([0-9]{10})([0-9]{12})(\w{8})([0-9]{4})([0-9]{6})([0-9]{14})fd'
-            )
-        s = re.findall(pat_gps, ret.hex())
-        # print(s)
-        lat = s[0][1]
-        lon = s[0][2]
-        alt = s[0][3]
-        time_utc = s[0][6]
-        # print(f'latitude: {lat}, longitude: {lon}, altitude: {alt}, time: {time_utc}')
+        return self.read_query('gps_position')
+
+    @classmethod
+    def parse_gps_position(cls, frame, profile=None):
+        """ latitude, longitude digit strings from reply frame of cmd_read_gps_pos
+            payload: lat x5, lon x6, alt x4, course x2, speed x3, time x7
+            ('', '') if invalid
+        """
+        GPS_DATA_LENGTH = 27
+        if frame is None or (frame.cmd, frame.subcmd) != tuple(cmd_read_gps_pos)\
+                or len(frame.payload) != GPS_DATA_LENGTH:
+            logger.error('GPS position read out was failed')
+            return '', ''
+        payload = frame.payload
+        lat = civ_codec.bcd_digits(payload[0:5])
+        lon = civ_codec.bcd_digits(payload[5:11])
+        alt = civ_codec.bcd_digits(payload[11:15])
+        time_utc = civ_codec.bcd_digits(payload[20:27])
         logger.debug(f'latitude: {lat}, longitude: {lon}, altitude: {alt}, time: {time_utc}')
 
         return lat, lon
 
     @classmethod
-    def reverse_msg(cls, msg_in):
-        """ reverse msg from rig, ex frequency etc. """
-        # 2桁ずつ、逆順に並んでいるので入れ替える
-        num = len(msg_in)
-        out_msg = ''
-        if num % 2 == 0:
-            for i in range(int(num / 2)):
-                out_msg = out_msg + msg_in[num-i*2-2:num-i*2]
-            return out_msg
-        else:
-            return ''
-
-    @classmethod
-    def rig_address(cls, rig_pn):
-        """ returns rig's CI-V address in [string] """
-        rig_address_dict = {
-            'IC-7300': 0x94,
-            'ID-51': 0x86,
-            'IC-R6': 0x7E,
-        }
+    def rig_profile(cls, rig_pn):
+        """ returns civ_rigs.RigProfile, None if rig_pn is not in rigs.json """
         try:
-            rig_address = rig_address_dict[rig_pn]
+            return civ_rigs.get(rig_pn)
         except KeyError:
-            # print(f'KeyError: {rig_pn} is not in list')
             logger.error(f'KeyError: {rig_pn} is not in list')
-            rig_address = 0x00
+            return None
 
-        return [rig_address]
+    def supports(self, name):
+        """ True if name ('freq', 'vd', 'scope', ...) is in the rig profile's commands
+            or the rig has no profile
+        """
+        return self.profile is None or name in self.profile.commands
+
+    @classmethod
+    def rig_address(cls, rig_pn):
+        """ returns rig's CI-V address in [int] """
+        profile = cls.rig_profile(rig_pn)
+        if profile is None:
+            return [0x00]
+
+        return [profile.address]
 
     @classmethod
     def rig_baudrate(cls, rig_pn):
         """ returns rig's max baudrate [bps] in int """
-        rig_baud_dict = {
-            'IC-7300': 115200,
-            'ID-51': 19200,
-            'IC-R6': 19200,
-        }
-        try:
-            rig_baud = rig_baud_dict[rig_pn]
-        except KeyError:
-            # print(f'KeyError: {rig_pn} is not in list')
-            logger.error(f'KeyError: {rig_pn} is not in list')
-            rig_baud = 19200
+        profile = cls.rig_profile(rig_pn)
+        if profile is None:
+            return civ_rigs.DEFAULT_BAUDRATE
 
-        return rig_baud
+        return profile.baudrate
 
     def __del__(self):
         try:
-            self.ser.close()
+            self.stop_reader()
+            if self.is_port_owner:
+                self.ser.close()
         except AttributeError:
             pass
 
 
 def main():
     ''' main func for test purpose '''
+    setup_logging(log_dir='./Log')
     # civ = CIV('COM5', 'IC-R6')
     civ = CIV('COM5', 'ID-51')
 
@@ -0,0 +1,192 @@
+''' asyncio version of CIV
+    AsyncCIV shares frame codec, commands, reply decoders and rig tables with civ.CIV,
+    one event loop can drive many rigs and scope streams
+'''
+import asyncio
+from logging import getLogger
+
+from civ import CIV, PREA, POSA, ADHOST
+from civ import cmd_read_freq, cmd_read_opmode, cmd_vd, cmd_read_gps_pos
+from civ import cmd_read_spectrum, cmd_scope_on, cmd_scope_readout_on, cmd_scope_readout_off
+from civ_dispatch import FrameRouter
+from civ_scope import SCOPE_DATA_LENGTH, SweepAssembler
+
+logger = getLogger(__name__)
+
+READ_SIZE = 256
+
+
+class AsyncCIV():
+    ''' class AsyncCIV, controls i-com rig via CI-V on asyncio streams
+        Args:
+            reader: asyncio.StreamReader compatible, read()
+            writer: asyncio.StreamWriter compatible, write(), drain(), close()
+            rig_pn: rig name, see CIV.rig_address()
+            timeout: reply timeout in sec
+    '''
+    def __init__(self, reader, writer, rig_pn='IC-7300', timeout=2) -> None:
+        logger.info(f'rig part name: {rig_pn}')
+        self.profile = CIV.rig_profile(rig_pn)
+        self.addr_rig = [self.profile.address] if self.profile is not None else [0x00]
+        if self.profile is not None and self.profile.scope is not None:
+            self.scope_points = self.profile.scope.points
+        else:
+            self.scope_points = SCOPE_DATA_LENGTH
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.router = FrameRouter(ADHOST[0])
+        self.read_task = None
+
+    @classmethod
+    async def open(cls, com_port, rig_pn='IC-7300', timeout=2):
+        ''' open serial port with pyserial-asyncio and start reading
+            Returns:
+                AsyncCIV
+        '''
+        try:
+            import serial_asyncio  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError('pyserial-asyncio is required for AsyncCIV.open()') from e
+
+        logger.info(f'open com port: {com_port}')
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=com_port, baudrate=CIV.rig_baudrate(rig_pn))
+        rig = cls(reader, writer, rig_pn, timeout)
+        rig.start()
+        return rig
+
+    def start(self):
+        ''' start reader task, call in running event loop '''
+        if self.read_task is None or self.read_task.done():
+            self.read_task = asyncio.ensure_future(self.read_loop())
+
+    async def close(self):
+        ''' stop reader task and close the stream '''
+        if self.read_task is not None:
+            self.read_task.cancel()
+            try:
+                await self.read_task
+            except asyncio.CancelledError:
+                pass
+            self.read_task = None
+        self.router.cancel_all()
+        self.writer.close()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def read_loop(self):
+        ''' reader task, parses frames and dispatches them '''
+        try:
+            while True:
+                data = await self.reader.read(READ_SIZE)
+                if not data:
+                    logger.error('CI-V stream closed')
+                    break
+                for frame in self.router.parser.feed(data):
+                    self.router.dispatch(frame)
+        finally:
+            self.router.cancel_all()
+
+    def command(self, cmd):
+        ''' returns request frame for cmd to this rig in list format '''
+        return PREA + self.addr_rig + ADHOST + cmd + POSA
+
+    async def send_msg(self, command_list, expect_reply=True):
+        ''' send command to rig
+            Returns:
+                civ_codec.Frame of the reply, None if no reply or the reader task has ended
+        '''
+        msg = bytes(command_list)
+        if not expect_reply:
+            self.writer.write(msg)
+            await self.writer.drain()
+            return None
+
+        if self.read_task is None or self.read_task.done():
+            # nobody reads replies, fail fast as civ_dispatch.FrameDispatcher.request()
+            logger.error(f'reader is not running, command 0x{msg[4]:02X}')
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self.router.add_pending(msg, future)
+        self.writer.write(msg)
+        await self.writer.drain()
+        try:
+            # wait() does not raise when read_loop() cancels the future,
+            # CancelledError here is for the calling task only
+            done, _ = await asyncio.wait((future,), timeout=self.timeout)
+        except asyncio.CancelledError:
+            self.router.cancel(future)
+            raise
+        if not done:
+            self.router.cancel(future)
+            logger.error(f'no reply for command 0x{msg[4]:02X}')
+            return None
+        if future.cancelled():
+            # read_loop() ended, pending requests were cancelled by router.cancel_all()
+            logger.error(f'reader stopped, no reply for command 0x{msg[4]:02X}')
+            return None
+        return future.result()
+
+    async def read_freq(self):
+        ''' Returns Frequency in Hz '''
+        frame = await self.send_msg(self.command(cmd_read_freq))
+        return CIV.parse_freq(frame, self.profile)
+
+    async def read_opmode(self):
+        ''' returns mode in string '''
+        frame = await self.send_msg(self.command(cmd_read_opmode))
+        return CIV.parse_opmode(frame, self.profile)
+
+    async def read_vd(self):
+        ''' read Vd value in V, IC-7300 only '''
+        frame = await self.send_msg(self.command(cmd_vd))
+        return CIV.parse_vd(frame, self.profile)
+
+    async def read_gps_position(self):
+        ''' read out GPS position data
+            Returns:
+                tuple latitude, longitude
+        '''
+        frame = await self.send_msg(self.command(cmd_read_gps_pos))
+        return CIV.parse_gps_position(frame, self.profile)
+
+    async def start_scope_readout(self):
+        ''' scope readout start '''
+        await self.send_msg(self.command(cmd_scope_readout_on))
+
+    async def stop_scope_readout(self):
+        ''' scope readout stop '''
+        await self.send_msg(self.command(cmd_scope_readout_off))
+
+    async def iter_spectrum(self, copy=True, maxsize=256):
+        ''' turn on scope readout once and yield sweeps as they arrive
+            use with async for
+            Yields:
+                civ_scope.Sweep, data in numpy.uint8 array
+        '''
+        q = asyncio.Queue(maxsize)
+        self.router.add_subscriber(q, cmd_read_spectrum[0], cmd_read_spectrum[1], self.addr_rig[0])
+        assembler = SweepAssembler(self.scope_points, copy=copy)
+        try:
+            await self.send_msg(self.command(cmd_scope_on))
+            await self.start_scope_readout()
+            while True:
+                frame = await q.get()
+                if CIV.is_scope_frame(frame):
+                    sweep = assembler.feed(frame.payload)
+                    if sweep is not None:
+                        yield sweep
+        finally:
+            self.router.unsubscribe(q)
+            if assembler.dropped:
+                logger.info(f'scope sweeps dropped: {assembler.dropped}')
+            # no await here, generator may be finalized outside of the loop
+            if not self.writer.is_closing():
+                self.writer.write(bytes(self.command(cmd_scope_readout_off)))
@@ -0,0 +1,191 @@
+''' CI-V bus manager
+    one serial port (ex. CT-17 style interface) shared by several addressed rigs
+    - the port is opened once, one reader thread demultiplexes replies by source address
+    - transmissions are arbitrated: wait for idle bus, check echo back,
+      send jammer code and retry with random backoff on collision
+'''
+from concurrent.futures import Future
+from logging import getLogger
+import random
+import threading
+import time
+
+import serial
+
+import civ_codec
+from civ import CIV, ADHOST
+from civ_dispatch import FrameDispatcher
+
+logger = getLogger(__name__)
+
+JAMMER_CODE = bytes([civ_codec.JAMMER] * 3)
+# idle time before transmission in bytes
+IDLE_BYTES = 3
+# margin for echo back in sec
+ECHO_MARGIN = 0.05
+# backoff slot in sec, doubled on every retry
+BACKOFF_SLOT = 0.01
+
+
+class CIVBus(FrameDispatcher):
+    ''' owns the serial port and hands out CIV handles per rig address
+        Args:
+            com_port: serial port name
+            rig_pns: rigs on the bus, baudrate is the lowest of their max baudrate
+            baudrate: bus baudrate, overrides rig_pns
+            timeout: reply timeout in sec
+            echo: True if transmitted frames are read back (single wire CI-V bus)
+            retries: retransmissions after collision
+            ser: already opened serial.Serial compatible object, com_port is not opened
+    '''
+    def __init__(self, com_port, rig_pns=('IC-7300',), baudrate=None, timeout=2,
+                 echo=True, retries=3, ser=None) -> None:
+        if baudrate is None:
+            baudrate = min(CIV.rig_baudrate(rig_pn) for rig_pn in rig_pns)
+        if ser is None:
+            logger.info(f'open CI-V bus: {com_port}, {baudrate} bps')
+            ser = serial.Serial(port=com_port,
+                                baudrate=baudrate,
+                                parity=serial.PARITY_NONE,
+                                stopbits=serial.STOPBITS_ONE,
+                                timeout=timeout)
+        super().__init__(ser, ADHOST[0])
+        self.com_port = com_port
+        self.echo = echo
+        self.retries = retries
+        # 1 start bit, 8 data bits, 1 stop bit
+        self.byte_time = 10 / baudrate
+        self.rigs = {}
+
+        self.tx_lock = threading.Lock()
+        self.echo_event = threading.Event()
+        self.expected_echo = None
+        self.is_collision = False
+        self.last_rx = 0.0
+        self.collisions = 0
+
+        self.start()
+
+    def rig(self, rig_pn, addr=None):
+        ''' returns CIV handle for the rig on this bus
+            Args:
+                rig_pn: rig name, see CIV.rig_address()
+                addr: CI-V address if changed from the default
+        '''
+        handle = CIV(self.com_port, rig_pn, ser=self.ser)
+        if addr is not None:
+            handle.addr_rig = [addr]
+        handle.attach_dispatcher(self)
+        self.rigs[handle.addr_rig[0]] = handle
+        return handle
+
+    def close(self):
+        ''' stop reader thread and close the port '''
+        for handle in self.rigs.values():
+            handle.stop_reader()
+        self.rigs.clear()
+        self.stop()
+        self.ser.close()
+
+    def on_data(self, data):
+        ''' check echo back and jammer code, then dispatch frames '''
+        self.last_rx = time.monotonic()
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.count('bytes_in', len(data))
+        collisions = self.parser.collisions
+        frames = self.parser.feed(data)
+        if self.parser.collisions != collisions:
+            self.collision()
+        for frame in frames:
+            if frame.src == self.addr_host and self.expected_echo is not None:
+                if civ_codec.frame_to_bytes(frame) == self.expected_echo:
+                    self.echo_event.set()
+                else:
+                    self.collision()
+            self.dispatch(frame)
+
+    def collision(self):
+        ''' collision detected by reader thread '''
+        self.is_collision = True
+        self.echo_event.set()
+
+    def wait_idle(self, timeout):
+        ''' wait until no byte is received for IDLE_BYTES '''
+        idle = self.byte_time * IDLE_BYTES
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            wait = self.last_rx + idle - now
+            if wait <= 0 or now > deadline:
+                return
+            time.sleep(wait)
+
+    def transmit(self, msg, future, timeout):
+        ''' transmit msg with collision detection
+            Args:
+                msg: frame in bytes
+                future: Future for the reply, None if no reply is expected
+                timeout: max wait for idle bus in sec
+            Returns:
+                True if transmitted without collision, or the reply has arrived
+        '''
+        with self.tx_lock:
+            for attempt in range(self.retries + 1):
+                self.wait_idle(timeout)
+                if future is not None:
+                    self.add_pending(msg, future)
+                self.echo_event.clear()
+                self.is_collision = False
+                self.expected_echo = msg
+                self.write(msg)
+                if self.echo:
+                    self.echo_event.wait(self.byte_time * len(msg) + ECHO_MARGIN)
+                    if not self.echo_event.is_set():
+                        # echo back lost, frame was broken on the bus
+                        self.is_collision = True
+                self.expected_echo = None
+                if not self.is_collision:
+                    return True
+                if future is not None and future.done():
+                    # echo late or lost, but the rig has already replied
+                    return True
+
+                if future is not None:
+                    self.remove_pending(future)
+                self.collisions += 1
+                logger.warning(f'collision on CI-V bus, retry {attempt + 1}')
+                metrics = self.metrics
+                if metrics is not None:
+                    metrics.count('retries', command=metrics.command_name(msg))
+                self.write(JAMMER_CODE)
+                time.sleep(random.uniform(0, BACKOFF_SLOT * 2 ** attempt))
+        return False
+
+    def request(self, msg):
+        ''' write request frame with bus arbitration
+            Returns:
+                Future, result is civ_codec.Frame of the reply,
+                cancelled if the reader has stopped or the frame could not be sent
+        '''
+        future = Future()
+        if self.stop_event.is_set():
+            # port lost, fail fast as FrameDispatcher.request()
+            future.cancel()
+            return future
+        if not self.transmit(msg, future, self.ser.timeout or 0):
+            logger.error(f'CI-V bus busy, command 0x{msg[4]:02X} was not sent')
+            self.cancel(future)
+        return future
+
+    def send(self, msg):
+        ''' write frame with bus arbitration, no reply is expected
+            Returns:
+                True if transmitted
+        '''
+        if self.stop_event.is_set():
+            return False
+        if not self.transmit(msg, None, self.ser.timeout or 0):
+            logger.error(f'CI-V bus busy, command 0x{msg[4]:02X} was not sent')
+            return False
+        return True
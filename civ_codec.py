@@ -0,0 +1,226 @@
+''' CI-V frame codec
+    binary frame parser / encoder and BCD helpers, works on bytes, bytearray and memoryview
+'''
+from collections import namedtuple
+
+PREAMBLE = 0xFE
+POSTAMBLE = 0xFD
+JAMMER = 0xFC
+OK = 0xFB
+NG = 0xFA
+
+# commands followed by a sub command byte
+SUBCMD_COMMANDS = frozenset((0x07, 0x0E, 0x13, 0x14, 0x15, 0x16, 0x18, 0x19, 0x1A,
+                             0x1B, 0x1C, 0x1E, 0x21, 0x23, 0x24, 0x25, 0x26, 0x27))
+# commands executed without data, answered by OK/NG: VFO/memory select, memory write,
+# memory to VFO, memory clear, power on/off
+ACK_COMMANDS = frozenset((0x07, 0x08, 0x09, 0x0A, 0x0B, 0x18))
+
+# byte -> 2 digit BCD value, None for invalid nibble (a-f)
+_BCD_DECODE = tuple((b >> 4) * 10 + (b & 0x0F) if (b >> 4) < 10 and (b & 0x0F) < 10
+                    else None for b in range(256))
+# 2 digit value -> byte
+_BCD_ENCODE = bytes((v // 10) << 4 | (v % 10) for v in range(100))
+# byte -> 2 digit BCD string
+_BCD_STR = tuple(f'{b >> 4}{b & 0x0F}' for b in range(256))
+
+# Frame: dst, src, cmd address/command in int
+#        subcmd in int, None if cmd has no sub command
+#        payload in bytes, data between (sub)command and POSTAMBLE
+Frame = namedtuple('Frame', ['dst', 'src', 'cmd', 'subcmd', 'payload'])
+
+
+def encode_frame(dst, cmd, subcmd=None, payload=b'', src=0x00):
+    ''' returns CI-V frame in bytes
+        ex) encode_frame(0x94, 0x03) -> b'\\xfe\\xfe\\x94\\x00\\x03\\xfd'
+    '''
+    msg = bytearray((PREAMBLE, PREAMBLE, dst, src, cmd))
+    if subcmd is not None:
+        msg.append(subcmd)
+    msg += payload
+    msg.append(POSTAMBLE)
+    return bytes(msg)
+
+
+def frame_to_bytes(frame):
+    ''' returns Frame encoded to bytes '''
+    return encode_frame(frame.dst, frame.cmd, frame.subcmd, frame.payload, src=frame.src)
+
+
+def decode_body(body):
+    ''' decode frame body, bytes between preamble and POSTAMBLE
+        Returns:
+            Frame, None if body is too short
+    '''
+    if len(body) < 3:
+        return None
+    cmd = body[2]
+    if cmd in SUBCMD_COMMANDS and len(body) > 3:
+        return Frame(body[0], body[1], cmd, body[3], bytes(body[4:]))
+    return Frame(body[0], body[1], cmd, None, bytes(body[3:]))
+
+
+def parse_frame(buffer):
+    ''' parse one frame from buffer
+        Returns:
+            Frame, None if buffer has no complete frame
+    '''
+    frames = FrameParser().feed(buffer)
+    if frames:
+        return frames[0]
+    return None
+
+
+def expects_ack(request):
+    ''' True if request Frame is a set/command answered by OK/NG, False for a read
+        set commands carry data, ACK_COMMANDS are executed without data
+    '''
+    return bool(request.payload) or request.cmd in ACK_COMMANDS
+
+
+def is_reply(request, frame):
+    ''' True if frame from the rig answers request Frame
+        same cmd (and subcmd if request has one), or OK/NG if request expects_ack()
+        addresses are not checked here
+    '''
+    if frame.cmd in (OK, NG):
+        return expects_ack(request)
+    return frame.cmd == request.cmd and (request.subcmd is None or frame.subcmd == request.subcmd)
+
+
+class FrameParser():
+    ''' incremental CI-V frame parser
+        feed() byte stream chunks of any size, complete frames are returned
+    '''
+    def __init__(self) -> None:
+        self.buf = bytearray()
+        self.frames = 0
+        self.errors = 0
+        self.collisions = 0
+
+    def feed(self, data):
+        ''' append data to internal buffer
+            Returns:
+                list of Frame completed by data
+        '''
+        buf = self.buf
+        buf += data
+        out = []
+        pos = 0
+        while True:
+            start = buf.find(b'\xfe\xfe', pos)
+            if start < 0:
+                # keep a trailing preamble byte for next feed
+                pos = len(buf) - 1 if buf[-1:] == b'\xfe' else len(buf)
+                break
+            end = buf.find(b'\xfd', start)
+            if end < 0:
+                pos = start
+                break
+            # skip repeated preamble
+            head = start + 2
+            while head < end and buf[head] == PREAMBLE:
+                head += 1
+            # truncated frame followed by next preamble
+            restart = buf.find(b'\xfe\xfe', head, end)
+            if restart >= 0:
+                self.errors += 1
+                pos = restart
+                continue
+            if buf.find(b'\xfc', head, end) >= 0:
+                self.collisions += 1
+                frame = None
+            else:
+                with memoryview(buf) as view:
+                    frame = decode_body(view[head:end])
+                if frame is None:
+                    self.errors += 1
+            if frame is not None:
+                self.frames += 1
+                out.append(frame)
+            pos = end + 1
+        del buf[:pos]
+        return out
+
+    def reset(self):
+        ''' discard buffered bytes '''
+        self.buf.clear()
+
+
+def decode_bcd(data):
+    ''' BCD, most significant byte first, to int
+        ex) b'\\x01\\x23' -> 123
+    '''
+    value = 0
+    try:
+        for b in data:
+            value = value * 100 + _BCD_DECODE[b]
+    except TypeError:
+        raise ValueError(f'invalid BCD data: {bytes(data)!r}') from None
+    return value
+
+
+def decode_bcd_le(data):
+    ''' BCD, least significant byte first, to int
+        ex) b'\\x00\\x30\\x07\\x14\\x00' -> 14073000
+    '''
+    value = 0
+    try:
+        for b in reversed(data):
+            value = value * 100 + _BCD_DECODE[b]
+    except TypeError:
+        raise ValueError(f'invalid BCD data: {bytes(data)!r}') from None
+    return value
+
+
+def encode_bcd(value, length):
+    ''' int to BCD in length bytes, most significant byte first '''
+    return bytes(reversed(encode_bcd_le(value, length)))
+
+
+def encode_bcd_le(value, length):
+    ''' int to BCD in length bytes, least significant byte first '''
+    if value < 0 or value >= 100 ** length:
+        raise ValueError(f'{value} does not fit in {length} BCD bytes')
+    out = bytearray(length)
+    for i in range(length):
+        value, digits = divmod(value, 100)
+        out[i] = _BCD_ENCODE[digits]
+    return bytes(out)
+
+
+def bcd_digits(data):
+    ''' BCD to digit string, most significant byte first
+        ex) b'\\x35\\x41' -> '3541'
+    '''
+    return ''.join([_BCD_STR[b] for b in data])
+
+
+def decode_freq(data):
+    ''' frequency in Hz from 5 (or 4) BCD bytes, 1 Hz digit first '''
+    return decode_bcd_le(data)
+
+
+def encode_freq(freq, length=5):
+    ''' frequency in Hz to BCD bytes, 1 Hz digit first '''
+    return encode_bcd_le(freq, length)
+
+
+def decode_span(data):
+    ''' scope span in Hz from 5 BCD bytes, 1 Hz digit first '''
+    return decode_bcd_le(data)
+
+
+def encode_span(span):
+    ''' scope span in Hz to 5 BCD bytes '''
+    return encode_bcd_le(span, 5)
+
+
+def decode_level(data):
+    ''' level value 0-255 from 2 BCD bytes, ex) Vd, S-meter '''
+    return decode_bcd(data)
+
+
+def encode_level(level):
+    ''' level value 0-255 to 2 BCD bytes '''
+    return encode_bcd(level, 2)
@@ -0,0 +1,332 @@
+''' connection manager, finds the rig and keeps the link up
+    - discover(): probes serial ports in parallel with a read frequency frame
+      at each baudrate, returns port, baudrate and CI-V address of the rig
+    - the result is cached per rig in CACHE_PATH and tried first next time
+    - ConnectionManager.connect() returns civ.CIV with the reader thread running,
+      when the port is lost (USB unplugged), calls fail fast and the same CIV
+      is reconnected in background with exponential backoff
+        manager = ConnectionManager('IC-7300')
+        rig = manager.connect()
+'''
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+from logging import getLogger
+import os
+import threading
+import time
+
+import serial
+
+import civ
+import civ_codec
+import civ_rigs
+
+logger = getLogger(__name__)
+
+# discovered ports, rig name -> {'port', 'baudrate', 'address'}
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.civ_ports.json')
+# baudrates tried after the rig's own, fastest first
+PROBE_BAUDRATES = (115200, 19200, 9600, 4800)
+# sec to wait for a reply at each baudrate
+PROBE_TIMEOUT = 0.3
+# read timeout of connected port, same as civ.CIV
+PORT_TIMEOUT = 2
+# reconnect interval in sec, doubled after each failure
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 30.0
+
+# ProbeResult: port name, baudrate, address CI-V address in int,
+#              rig rig name in rigs.json, '' if the address is unknown
+ProbeResult = namedtuple('ProbeResult', ['port', 'baudrate', 'address', 'rig'])
+
+
+def open_port(port, baudrate, timeout=PORT_TIMEOUT):
+    ''' open serial port, 8N1 as civ.CIV '''
+    return serial.Serial(port=port, baudrate=baudrate, parity=serial.PARITY_NONE,
+                         stopbits=serial.STOPBITS_ONE, timeout=timeout)
+
+
+def candidate_ports():
+    ''' serial port names, ports with i-com USB driver (civ.ICOM_DRIVER_KW) first '''
+    from serial.tools import list_ports  # pylint: disable=import-outside-toplevel
+    ports = list_ports.comports()
+    ports.sort(key=lambda p: civ.ICOM_DRIVER_KW not in (p.description or ''))
+    return [p.device for p in ports]
+
+
+def probe(port, rig_pn=None, baudrates=None, timeout=PROBE_TIMEOUT, open_serial=open_port):
+    ''' find a rig on one port
+        read frequency frames to all known rig addresses are sent at once,
+        at each baudrate until a rig answers
+        Args:
+            rig_pn: rig name, its address and baudrate are tried first
+            baudrates: list of baudrates, default is the rig's and PROBE_BAUDRATES
+            open_serial: open_serial(port, baudrate, timeout) returns serial.Serial compatible
+        Returns:
+            ProbeResult, None if no rig answered or the port can not be opened
+    '''
+    profile = civ_rigs.profiles().get(rig_pn)
+    addresses = sorted({p.address for p in civ_rigs.profiles().values()})
+    if profile is not None:
+        addresses.remove(profile.address)
+        addresses.insert(0, profile.address)
+    if baudrates is None:
+        baudrates = list(dict.fromkeys(
+            ([profile.baudrate] if profile is not None else []) + list(PROBE_BAUDRATES)))
+    request = b''.join(civ_codec.encode_frame(addr, civ.cmd_read_freq[0], src=civ.ADHOST[0])
+                       for addr in addresses)
+
+    for baudrate in baudrates:
+        try:
+            ser = open_serial(port, baudrate, timeout / 4)
+        except (OSError, ValueError) as e:
+            # busy, removed or not a serial port
+            logger.debug(f'probe {port}: {e}')
+            return None
+        try:
+            address = probe_link(ser, request, addresses, timeout)
+        except OSError as e:
+            logger.debug(f'probe {port}: {e}')
+            return None
+        finally:
+            ser.close()
+        if address is not None:
+            found = civ_rigs.find_by_address(address)
+            if profile is not None and profile.address == address:
+                found = profile
+            logger.info(f'rig found: {port} {baudrate} bps, address 0x{address:02X}')
+            return ProbeResult(port, baudrate, address, found.name if found else '')
+    return None
+
+
+def probe_link(ser, request, addresses, timeout):
+    ''' write request and wait for a read frequency reply
+        Returns:
+            address of the replying rig, addresses[0] is preferred, None if no reply
+    '''
+    ser.reset_input_buffer()
+    ser.write(request)
+    ser.flush()
+    parser = civ_codec.FrameParser()
+    found = None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for frame in parser.feed(ser.read(max(ser.in_waiting, 1))):
+            # echo of request has dst of the rig
+            if frame.dst == civ.ADHOST[0] and frame.cmd == civ.cmd_read_freq[0]\
+                    and frame.src in addresses:
+                if frame.src == addresses[0]:
+                    return frame.src
+                if found is None:
+                    found = frame.src
+    return found
+
+
+def discover(rig_pn=None, ports=None, baudrates=None, timeout=PROBE_TIMEOUT,
+             open_serial=open_port):
+    ''' probe ports in parallel, one thread per port
+        Args:
+            rig_pn: rig name, a port with this rig is preferred
+            ports: port names, default is candidate_ports()
+        Returns:
+            ProbeResult, None if not found
+    '''
+    if ports is None:
+        ports = candidate_ports()
+    if not ports:
+        return None
+    with ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix='civ-probe') as executor:
+        results = list(executor.map(
+            lambda port: probe(port, rig_pn, baudrates, timeout, open_serial), ports))
+    results = [r for r in results if r is not None]
+    for result in results:
+        if result.rig == rig_pn:
+            return result
+    return results[0] if results else None
+
+
+def load_cache(path=CACHE_PATH):
+    ''' dict, rig name -> ProbeResult, empty if no cache '''
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return {rig: ProbeResult(entry['port'], entry['baudrate'], entry['address'], rig)
+                for rig, entry in data.items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+def save_cache(result, path=CACHE_PATH):
+    ''' store result under its rig name '''
+    cache = load_cache(path)
+    cache[result.rig] = result
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({rig: {'port': r.port, 'baudrate': r.baudrate, 'address': r.address}
+                       for rig, r in cache.items()}, f, indent=2)
+    except OSError as e:
+        logger.warning(f'port cache not saved: {e}')
+
+
+class ConnectionManager():
+    ''' owns the serial port of one rig, finds it and reconnects it
+        Args:
+            rig_pn: rig name in rigs.json, None for the first rig found
+            port: port name, None to use the cache or discover()
+            cache_path: port cache file, None not to cache
+            open_serial: open_serial(port, baudrate, timeout) returns serial.Serial compatible
+            on_change: callback(is_connected) called from the reconnect thread
+    '''
+    def __init__(self, rig_pn='IC-7300', port=None, cache_path=CACHE_PATH,
+                 open_serial=open_port, on_change=None) -> None:
+        self.rig_pn = rig_pn
+        self.port = port
+        self.cache_path = cache_path
+        self.open_serial = open_serial
+        self.on_change = on_change
+        self.rig = None
+        self.result = None
+        self.is_connected = False
+        self.is_closed = threading.Event()
+        self.thread = None
+
+    def find(self, port=None):
+        ''' port, baudrate and address of the rig: given port, cached port, then all ports
+            Returns:
+                ProbeResult, None if not found
+        '''
+        port = port or self.port
+        if port is not None:
+            return probe(port, self.rig_pn, open_serial=self.open_serial)
+        if self.cache_path is not None:
+            cached = load_cache(self.cache_path).get(self.rig_pn)
+            if cached is not None:
+                result = probe(cached.port, self.rig_pn, [cached.baudrate],
+                               open_serial=self.open_serial)
+                if result is not None:
+                    return result
+                logger.info(f'cached port not answering: {cached.port}')
+        return discover(self.rig_pn, open_serial=self.open_serial)
+
+    def connect(self, port=None):
+        ''' find the rig, open its port and start the reader thread
+            Returns:
+                civ.CIV, the same instance after reconnect
+            Raises:
+                ConnectionError if the rig is not found
+        '''
+        return self.open(self.find(port))
+
+    def refind(self):
+        ''' last port and baudrate first, then same as find() '''
+        if self.result is not None:
+            result = probe(self.result.port, self.rig_pn, [self.result.baudrate],
+                           open_serial=self.open_serial)
+            if result is not None:
+                return result
+        return self.find()
+
+    def open(self, result):
+        ''' open port of find() result, see connect() '''
+        if result is None:
+            raise ConnectionError(f'rig not found: {self.rig_pn or "any"}')
+        if self.cache_path is not None and result.rig:
+            save_cache(result, self.cache_path)
+        ser = self.open_serial(result.port, result.baudrate, PORT_TIMEOUT)
+        self.attach(ser, result)
+        self.start()
+        return self.rig
+
+    def start(self):
+        ''' start the reconnect thread, without a connection it keeps looking for the rig
+            and on_change(True) is called when it is connected, see self.rig
+        '''
+        if self.thread is None:
+            self.is_closed.clear()
+            self.thread = threading.Thread(target=self.watch, name='civ-connect', daemon=True)
+            self.thread.start()
+
+    def attach(self, ser, result):
+        ''' use ser for self.rig, creates it on first connect '''
+        old_ser = None
+        if self.rig is None:
+            self.rig = civ.CIV(result.port, self.rig_pn or result.rig, ser=ser)
+        else:
+            old_ser = self.rig.ser
+            # new port first, calls during the switch go to the new port directly
+            self.rig.ser = ser
+            self.rig.stop_reader()
+        self.rig.addr_rig = [result.address]
+        self.rig.start_reader()
+        if old_ser is not None:
+            try:
+                old_ser.close()
+            except OSError:
+                pass
+        self.result = result
+        self.port = result.port
+        self.set_connected(True)
+
+    def set_connected(self, is_connected):
+        ''' update state and call on_change '''
+        if is_connected == self.is_connected:
+            return
+        self.is_connected = is_connected
+        if self.on_change is not None:
+            try:
+                self.on_change(is_connected)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(f'on_change callback failed: {e}')
+
+    def watch(self):
+        ''' reconnect thread, waits until the reader thread stops on a port error
+            a reader stopped by rig.stop_reader() is not a link loss, the port is kept
+        '''
+        while not self.is_closed.is_set():
+            if not self.is_connected:
+                self.reconnect()
+                continue
+            dispatcher = self.rig.dispatcher
+            if dispatcher is None:
+                # reader stopped by the application, check again later
+                self.is_closed.wait(RECONNECT_MIN)
+                continue
+            dispatcher.stop_event.wait()
+            if self.is_closed.is_set() or dispatcher.error is None:
+                # stop_reader(), or a new reader started by attach()
+                continue
+            # reader stopped on error, its requests fail fast until reconnected
+            logger.warning(f'connection lost: {self.port}: {dispatcher.error}')
+            self.set_connected(False)
+            try:
+                # release the port, the device may come back with the same name
+                self.rig.ser.close()
+            except OSError:
+                pass
+
+    def reconnect(self):
+        ''' find and open the rig with exponential backoff until connected or closed '''
+        delay = RECONNECT_MIN
+        while not self.is_closed.wait(delay):
+            try:
+                self.open(self.refind())
+                logger.info(f'connected: {self.port}')
+                return
+            except (ConnectionError, OSError) as e:
+                delay = min(delay * 2, RECONNECT_MAX)
+                logger.info(f'connect failed, retry in {delay:.1f} sec: {e}')
+
+    def close(self):
+        ''' stop reconnecting, stop the reader and close the port '''
+        self.is_closed.set()
+        if self.rig is not None:
+            self.rig.stop_reader()
+            try:
+                self.rig.ser.close()
+            except OSError:
+                pass
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+        self.set_connected(False)
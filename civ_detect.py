@@ -0,0 +1,173 @@
+''' signal detector on the scope stream
+    per bin noise floor is seeded from the first sweep of a band by a low percentile of the
+    bins around each bin, so carriers already on the air are not taken as floor,
+    then tracked incrementally, bins above floor + threshold are active,
+    adjacent active bins form one signal, start/stop events are emitted when signals
+    appear and disappear
+        detector = Detector(threshold=20)
+        for event in detector.run(rig.iter_spectrum()):
+            print(event.kind, event.freq, event.duration)
+'''
+from collections import namedtuple
+import time
+
+import numpy as np
+
+from civ_scope import bin_freqs
+
+# noise floor tracking per sweep, slow up, fast down
+FLOOR_UP = 0.01
+FLOOR_DOWN = 0.2
+# initial noise floor: percentile of the bins in a window, wider than a carrier
+FLOOR_WINDOW = 51
+FLOOR_PERCENTILE = 20
+
+# SignalEvent: kind 'start' or 'stop'
+#              freq peak frequency in Hz, bin peak bin number, level peak level 0-160
+#              (strongest while the signal lasted for 'stop')
+#              timestamp time.time() of the sweep, duration sec for 'stop', 0 for 'start'
+SignalEvent = namedtuple('SignalEvent', ['kind', 'freq', 'bin', 'level', 'timestamp',
+                                         'duration'])
+
+
+def estimate_floor(data, window=FLOOR_WINDOW, percentile=FLOOR_PERCENTILE):
+    ''' noise floor per bin from one sweep, low percentile of window bins around each bin
+        signals narrower than about half of window are not part of the floor
+    '''
+    data = np.asarray(data, dtype=np.float32)
+    window = min(window, len(data))
+    pad = window // 2
+    padded = np.pad(data, (pad, window - 1 - pad), mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    return np.percentile(windows, percentile, axis=1).astype(np.float32)
+
+
+class Signal():
+    ''' signal being tracked, bins first..last (inclusive) in the last sweep '''
+    def __init__(self, first, last, peak, level, start) -> None:
+        self.first = first
+        self.last = last
+        self.peak = peak
+        self.level = level
+        self.start = start
+        self.last_seen = start
+        self.misses = 0
+
+
+class Detector():
+    ''' incremental signal detector
+        Args:
+            threshold: level above noise floor to become active, scope level 0-160
+            hysteresis: active bins stay active until they fall below
+                        floor + threshold - hysteresis
+            hold: sweeps a signal may be missing before its stop event
+            floor_up, floor_down: noise floor tracking factors per sweep
+            floor_window, floor_percentile: initial noise floor, see estimate_floor()
+    '''
+    def __init__(self, threshold=20, hysteresis=6, hold=2,
+                 floor_up=FLOOR_UP, floor_down=FLOOR_DOWN,
+                 floor_window=FLOOR_WINDOW, floor_percentile=FLOOR_PERCENTILE) -> None:
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.hold = hold
+        self.floor_up = floor_up
+        self.floor_down = floor_down
+        self.floor_window = floor_window
+        self.floor_percentile = floor_percentile
+        self.floor = None
+        self.active = None
+        self.freqs = None
+        self.band = None
+        self.signals = []
+
+    def reset(self, timestamp=None):
+        ''' forget floor and signals, returns stop events of the signals being tracked '''
+        events = self.stop_all(time.time() if timestamp is None else timestamp)
+        self.floor = None
+        self.active = None
+        self.band = None
+        return events
+
+    def stop_all(self, timestamp):
+        ''' stop events for all tracked signals '''
+        events = [self.event('stop', s, timestamp) for s in self.signals]
+        self.signals = []
+        return events
+
+    def event(self, kind, signal, timestamp):
+        ''' SignalEvent of signal '''
+        duration = signal.last_seen - signal.start if kind == 'stop' else 0.0
+        return SignalEvent(kind, float(self.freqs[signal.peak]), signal.peak, signal.level,
+                           timestamp, duration)
+
+    def feed(self, sweep):
+        ''' process one civ_scope.Sweep
+            Returns:
+                list of SignalEvent
+        '''
+        return self.process(sweep.data, sweep.center_freq, sweep.span, sweep.timestamp)
+
+    def process(self, data, center_freq, span, timestamp=None):
+        ''' process one sweep, ex) result of CIV.read_spectrum()
+            Returns:
+                list of SignalEvent
+        '''
+        if timestamp is None:
+            timestamp = time.time()
+        data = np.asarray(data, dtype=np.float32)
+        events = []
+        if (center_freq, span, len(data)) != self.band:
+            # other band, floor and signals are meaningless
+            events += self.reset(timestamp)
+            self.band = (center_freq, span, len(data))
+            self.freqs = bin_freqs(center_freq, span, len(data))
+        if self.floor is None:
+            # carriers present from the first sweep are detected in it
+            self.floor = estimate_floor(data, self.floor_window, self.floor_percentile)
+            self.active = np.zeros(len(data), dtype=bool)
+
+        above = data - self.floor
+        self.active = (above > self.threshold) \
+            | (self.active & (above > self.threshold - self.hysteresis))
+        # floor is not updated under a signal
+        rate = np.where(above > 0, self.floor_up, self.floor_down)
+        rate[self.active] = 0
+        self.floor += rate * above
+
+        # runs of active bins
+        edges = np.diff(np.concatenate(([0], self.active.view(np.int8), [0])))
+        firsts = np.flatnonzero(edges == 1)
+        lasts = np.flatnonzero(edges == -1) - 1
+        matched = set()
+        for first, last in zip(firsts.tolist(), lasts.tolist()):
+            run = data[first:last + 1]
+            peak = first + int(run.argmax())
+            level = int(run.max())
+            signal = next((s for s in self.signals if id(s) not in matched
+                           and s.first <= last and first <= s.last), None)
+            if signal is None:
+                signal = Signal(first, last, peak, level, timestamp)
+                self.signals.append(signal)
+                events.append(self.event('start', signal, timestamp))
+            else:
+                signal.first, signal.last = first, last
+                if level >= signal.level:
+                    signal.peak, signal.level = peak, level
+                signal.last_seen = timestamp
+                signal.misses = 0
+            matched.add(id(signal))
+
+        for signal in [s for s in self.signals if id(s) not in matched]:
+            signal.misses += 1
+            if signal.misses > self.hold:
+                self.signals.remove(signal)
+                events.append(self.event('stop', signal, timestamp))
+        return events
+
+    def run(self, sweeps):
+        ''' detect on a sweep stream, ex) CIV.iter_spectrum()
+            Yields:
+                SignalEvent
+        '''
+        for sweep in sweeps:
+            yield from self.feed(sweep)
@@ -0,0 +1,268 @@
+''' background reader thread for CI-V
+    one thread owns the serial port reading side, parses frames continuously
+    and routes them:
+    - solicited replies -> waiting caller via concurrent.futures.Future
+    - unsolicited frames (scope data, transceive broadcast) -> subscriber queues
+'''
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeoutError
+from logging import getLogger
+import queue
+import threading
+
+import civ_codec
+
+logger = getLogger(__name__)
+
+# default host address
+ADDR_HOST = 0x00
+
+
+class FrameRouter():
+    ''' matches frames to pending requests and subscribers
+        no I/O here, shared by FrameDispatcher (thread) and civ_async.AsyncCIV (asyncio)
+        futures: concurrent.futures.Future or asyncio.Future
+        queues: queue.Queue or asyncio.Queue
+        Args:
+            addr_host: host (PC) address, frames from this address are echo
+    '''
+    def __init__(self, addr_host=ADDR_HOST) -> None:
+        self.addr_host = addr_host
+        self.parser = civ_codec.FrameParser()
+
+        # rig address -> list of [request Frame, future] in send order,
+        # OK/NG completes only requests which civ_codec.expects_ack()
+        self.pending = {}
+        # [cmd, subcmd, src, queue], None matches any
+        self.subscribers = []
+        # callback(frame) for every frame from rigs, called from reader
+        self.listeners = []
+        self.dropped = 0
+        # civ_metrics.Metrics, None if disabled
+        self.metrics = None
+
+        self.lock = threading.Lock()
+
+    def add_pending(self, msg, future):
+        ''' register future for the reply of request frame msg in bytes '''
+        frame = civ_codec.parse_frame(msg)
+        with self.lock:
+            self.pending.setdefault(frame.dst, []).append([frame, future])
+
+    def cancel(self, future):
+        ''' cancel and remove pending request '''
+        with self.lock:
+            future.cancel()
+        self.remove_pending(future)
+
+    def remove_pending(self, future):
+        ''' remove pending request without cancelling future '''
+        with self.lock:
+            for entries in self.pending.values():
+                for i, entry in enumerate(entries):
+                    if entry[1] is future:
+                        del entries[i]
+                        return
+
+    def cancel_all(self):
+        ''' cancel all pending requests '''
+        with self.lock:
+            for entries in self.pending.values():
+                for _, future in entries:
+                    future.cancel()
+            self.pending.clear()
+
+    def dispatch(self, frame):
+        ''' route one frame to waiting caller or subscribers '''
+        if frame.src == self.addr_host:
+            # echo of our own frame on single wire bus
+            return
+
+        for listener in self.listeners:
+            try:
+                listener(frame)
+            except Exception:  # pylint: disable=broad-except
+                # the frame still goes to the waiting caller
+                logger.exception(f'listener failed on command 0x{frame.cmd:02X}')
+
+        future = None
+        with self.lock:
+            entries = self.pending.get(frame.src)
+            if entries:
+                for i, (request, fut) in enumerate(entries):
+                    if civ_codec.is_reply(request, frame):
+                        future = fut
+                        del entries[i]
+                        break
+            if future is not None:
+                # under lock, not to race with cancel(),
+                # done if a retransmitted request got its reply twice
+                if not future.done():
+                    future.set_result(frame)
+                return
+            targets = [q for cmd, subcmd, src, q in self.subscribers
+                       if (cmd is None or cmd == frame.cmd)
+                       and (subcmd is None or subcmd == frame.subcmd)
+                       and (src is None or src == frame.src)]
+
+        for q in targets:
+            self.put_nowait(q, frame)
+
+    def put_nowait(self, q, frame):
+        ''' put frame to subscriber queue, the oldest frame is dropped if full
+            router is the only producer, so the queue has room after dropping
+        '''
+        while q.full():
+            try:
+                q.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                break
+        q.put_nowait(frame)
+
+    def add_subscriber(self, q, cmd=None, subcmd=None, src=None):
+        ''' add subscriber queue, cmd/subcmd/src(rig address) None matches any '''
+        with self.lock:
+            self.subscribers.append([cmd, subcmd, src, q])
+
+    def add_listener(self, callback):
+        ''' add callback(frame) called for every frame from rigs '''
+        with self.lock:
+            self.listeners = self.listeners + [callback]
+
+    def remove_listener(self, callback):
+        ''' remove callback '''
+        with self.lock:
+            self.listeners = [c for c in self.listeners if c != callback]
+
+    def unsubscribe(self, q):
+        ''' remove subscriber queue '''
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s[3] is not q]
+
+
+class FrameDispatcher(FrameRouter):
+    ''' reader thread and command/response dispatcher
+        Args:
+            ser: serial.Serial compatible object, read(), write(), in_waiting
+            addr_host: host (PC) address, frames from this address are echo
+    '''
+    def __init__(self, ser, addr_host=ADDR_HOST) -> None:
+        super().__init__(addr_host)
+        self.ser = ser
+
+        self.write_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        # exception which stopped the reader thread, None if stopped by stop()
+        self.error = None
+
+    def start(self):
+        ''' start reader thread '''
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='civ-reader', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        ''' stop reader thread, pending requests are cancelled '''
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+        self.cancel_all()
+
+    def is_running(self):
+        ''' True if reader thread is alive '''
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        ''' reader thread main loop '''
+        while not self.stop_event.is_set():
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:  # pylint: disable=broad-except
+                # port closed or device removed
+                logger.error(f'serial read failed: {e}')
+                self.error = e
+                break
+            if data:
+                try:
+                    self.on_data(data)
+                except Exception:  # pylint: disable=broad-except
+                    # bug in a listener or decoder, keep reading the port
+                    logger.exception('frame handling failed')
+        self.stop_event.set()
+        # callers waiting for replies return now, not after their timeout
+        self.cancel_all()
+
+    def on_data(self, data):
+        ''' called from reader thread with received bytes '''
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.count('bytes_in', len(data))
+        for frame in self.parser.feed(data):
+            self.dispatch(frame)
+
+    def request(self, msg):
+        ''' write request frame and register a Future for its reply
+            Args:
+                msg: request frame in bytes
+            Returns:
+                Future, result is civ_codec.Frame of the reply,
+                cancelled if the reader has stopped or the port failed
+        '''
+        future = Future()
+        if self.stop_event.is_set():
+            # port lost, fail fast
+            future.cancel()
+            return future
+        self.add_pending(msg, future)
+        try:
+            self.write(msg)
+        except OSError as e:
+            logger.error(f'serial write failed: {e}')
+            self.cancel(future)
+        return future
+
+    def transact(self, msg, timeout):
+        ''' write request frame and wait for its reply
+            Returns:
+                civ_codec.Frame, None on timeout
+        '''
+        future = self.request(msg)
+        try:
+            return future.result(timeout)
+        except (FutureTimeoutError, CancelledError):
+            self.cancel(future)
+            return None
+
+    def send(self, msg):
+        ''' write frame without waiting for a reply
+            Returns:
+                True if written
+        '''
+        self.write(msg)
+        return True
+
+    def write(self, msg):
+        ''' write bytes to serial port, serialized between threads '''
+        with self.write_lock:
+            self.ser.write(msg)
+            self.ser.flush()
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.count('bytes_out', len(msg))
+
+    def subscribe(self, cmd=None, subcmd=None, maxsize=256, src=None):
+        ''' subscribe unsolicited frames
+            Args:
+                cmd, subcmd, src: frame filter, None matches any
+                maxsize: queue size, the oldest frame is dropped when full
+            Returns:
+                queue.Queue of civ_codec.Frame
+        '''
+        q = queue.Queue(maxsize)
+        self.add_subscriber(q, cmd, subcmd, src)
+        return q
@@ -0,0 +1,257 @@
+''' scope sweep post-processing
+    stages work on numpy arrays, one sweep (points,) or a block of sweeps (N, points),
+    and are chained by Pipeline
+        pipeline = Pipeline(DbScale(), ExpAverage(0.3), PeakHold(decay=0.5), Resample(400))
+    live scope stream
+        for sweep in pipeline.stream(rig.iter_spectrum()):
+    recorded capture, civ_record.Capture
+        for block in pipeline.run(records['data'] for records in capture.iter_sweeps()):
+    stateful stages (averaging, hold) keep their state between calls, reset() clears it
+'''
+import numpy as np
+
+# IC-7300 scope amplitude 0-160, 0.5 dB per level for dBm-like scale
+DB_PER_LEVEL = 0.5
+# dBm-like value of level 0
+DB_REF = -130.0
+
+
+class Stage():
+    ''' base of processing stages
+        process() takes one sweep, process_block() takes (N, points) in time order
+    '''
+    def process(self, data):
+        ''' returns processed sweep, may be the stage's own buffer, valid until next call '''
+        raise NotImplementedError
+
+    def process_block(self, block):
+        ''' returns (N, out points) array, sweeps are processed in order '''
+        return np.stack([np.array(self.process(row)) for row in block])
+
+    def reset(self):
+        ''' clear state, ex) center/span changed '''
+
+
+class DbScale(Stage):
+    ''' amplitude level 0-160 to dBm-like scale, ref + level * per_level
+        uint8 input is converted by a lookup table
+    '''
+    def __init__(self, ref=DB_REF, per_level=DB_PER_LEVEL) -> None:
+        self.ref = ref
+        self.per_level = per_level
+        self.table = (ref + np.arange(256) * per_level).astype(np.float32)
+
+    def process(self, data):
+        data = np.asarray(data)
+        if data.dtype == np.uint8:
+            return self.table[data]
+        return (self.ref + data * self.per_level).astype(np.float32)
+
+    def process_block(self, block):
+        return self.process(block)
+
+
+class ExpAverage(Stage):
+    ''' exponential moving average, y += alpha * (x - y)
+        Args:
+            alpha: 0-1, 1 is no averaging
+    '''
+    def __init__(self, alpha=0.3) -> None:
+        self.alpha = alpha
+        self.state = None
+
+    def process(self, data):
+        if self.state is None or self.state.shape != np.shape(data):
+            self.state = np.array(data, dtype=np.float32)
+        else:
+            self.state += self.alpha * (data - self.state)
+        return self.state
+
+    def reset(self):
+        self.state = None
+
+
+class MovingAverage(Stage):
+    ''' mean of the last n sweeps, running sum over a ring of n sweeps
+        Args:
+            n: number of sweeps
+    '''
+    def __init__(self, n=8) -> None:
+        self.n = n
+        self.buf = None
+        self.sum = None
+        self.index = 0
+        self.count = 0
+
+    def setup(self, shape):
+        ''' empty ring for sweeps of shape '''
+        self.buf = np.zeros((self.n,) + shape, dtype=np.float64)
+        self.sum = np.zeros(shape, dtype=np.float64)
+        self.index = 0
+        self.count = 0
+
+    def process(self, data):
+        if self.buf is None or self.buf.shape[1:] != np.shape(data):
+            self.setup(np.shape(data))
+        self.sum += data
+        self.sum -= self.buf[self.index]
+        self.buf[self.index] = data
+        self.index = (self.index + 1) % self.n
+        self.count = min(self.count + 1, self.n)
+        return (self.sum / self.count).astype(np.float32)
+
+    def process_block(self, block):
+        # window sums by cumulative sum over ring history + block
+        block = np.asarray(block, dtype=np.float64)
+        if self.buf is None or self.buf.shape[1:] != block.shape[1:]:
+            self.setup(block.shape[1:])
+        # oldest first
+        history = np.roll(self.buf, -self.index, axis=0)[self.n - self.count:]
+        joined = np.concatenate([history, block])
+        cum = np.concatenate([np.zeros((1,) + block.shape[1:]), np.cumsum(joined, axis=0)])
+        ends = np.arange(len(history) + 1, len(joined) + 1)
+        starts = np.maximum(ends - self.n, 0)
+        out = (cum[ends] - cum[starts]) / (ends - starts)[:, None]
+        for row in block[-self.n:]:
+            self.buf[self.index] = row
+            self.index = (self.index + 1) % self.n
+        self.count = min(self.count + len(block), self.n)
+        self.sum = self.buf.sum(axis=0)
+        return out.astype(np.float32)
+
+    def reset(self):
+        self.buf = None
+
+
+class PeakHold(Stage):
+    ''' max or min hold with decay toward the current sweep
+        Args:
+            mode: 'max' or 'min'
+            decay: hold value moves this much per sweep toward the data, 0 holds forever
+    '''
+    def __init__(self, mode='max', decay=0.0) -> None:
+        if mode not in ('max', 'min'):
+            raise ValueError(f'mode must be max or min: {mode}')
+        self.mode = mode
+        self.decay = decay
+        self.state = None
+
+    def process(self, data):
+        if self.state is None or self.state.shape != np.shape(data):
+            self.state = np.array(data, dtype=np.float32)
+        elif self.mode == 'max':
+            self.state -= self.decay
+            np.maximum(self.state, data, out=self.state)
+        else:
+            self.state += self.decay
+            np.minimum(self.state, data, out=self.state)
+        return self.state
+
+    def process_block(self, block):
+        if self.decay == 0:
+            # running max/min without loop
+            func = np.maximum if self.mode == 'max' else np.minimum
+            block = np.asarray(block, dtype=np.float32)
+            if self.state is not None and self.state.shape == block.shape[1:]:
+                block = np.concatenate([self.state[None], block])
+                out = func.accumulate(block, axis=0)[1:]
+            else:
+                out = func.accumulate(block, axis=0)
+            self.state = out[-1].copy()
+            return out
+        return super().process_block(block)
+
+    def reset(self):
+        self.state = None
+
+
+class Resample(Stage):
+    ''' change number of bins to the display width
+        fewer bins: max (keeps narrow peaks) or mean of the bins merged
+        more bins: linear interpolation
+        Args:
+            width: output bins
+            method: 'max' or 'mean' for decimation
+    '''
+    def __init__(self, width, method='max') -> None:
+        if method not in ('max', 'mean'):
+            raise ValueError(f'method must be max or mean: {method}')
+        self.width = width
+        self.method = method
+        self.points = None
+        # decimation: first input bin and number of bins of each output bin
+        self.edges = self.sizes = None
+        # interpolation: input bins on both sides and weight of the high side
+        self.low = self.high = self.weight = None
+
+    def setup(self, points):
+        ''' index tables for input points '''
+        self.points = points
+        if self.width < points:
+            self.edges = (np.arange(self.width) * points) // self.width
+            # float32, the mean stays float32
+            self.sizes = np.diff(np.append(self.edges, points)).astype(np.float32)
+        else:
+            pos = np.linspace(0, points - 1, self.width)
+            self.low = np.floor(pos).astype(np.intp)
+            self.high = np.minimum(self.low + 1, points - 1)
+            self.weight = (pos - self.low).astype(np.float32)
+
+    def process(self, data):
+        data = np.asarray(data)
+        points = data.shape[-1]
+        if points == self.width:
+            return data
+        if points != self.points:
+            self.setup(points)
+        if self.width < points:
+            if self.method == 'max':
+                return np.maximum.reduceat(data, self.edges, axis=-1)
+            return (np.add.reduceat(data, self.edges, axis=-1, dtype=np.float32)
+                    / self.sizes)
+        low = data[..., self.low].astype(np.float32)
+        return low + (data[..., self.high] - low) * self.weight
+
+    def process_block(self, block):
+        return self.process(block)
+
+
+class Pipeline(Stage):
+    ''' chain of stages, also a Stage itself '''
+    def __init__(self, *stages) -> None:
+        self.stages = list(stages)
+
+    def process(self, data):
+        for stage in self.stages:
+            data = stage.process(data)
+        return data
+
+    def process_block(self, block):
+        for stage in self.stages:
+            block = stage.process_block(block)
+        return block
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def stream(self, sweeps):
+        ''' process live civ_scope.Sweep stream, ex) CIV.iter_spectrum()
+            state is reset when center/span changes
+            Yields:
+                civ_scope.Sweep, data replaced by processed numpy.float32 array
+        '''
+        band = None
+        for sweep in sweeps:
+            if (sweep.center_freq, sweep.span) != band:
+                band = (sweep.center_freq, sweep.span)
+                self.reset()
+            yield sweep._replace(data=np.array(self.process(sweep.data), dtype=np.float32))
+
+    def run(self, blocks):
+        ''' process (N, points) blocks in time order, ex) from civ_record.Capture
+            Yields:
+                processed block
+        '''
+        for block in blocks:
+            yield self.process_block(block)
@@ -0,0 +1,266 @@
+''' metrics and tracing for CI-V I/O
+    disabled by default, CIV.enable_metrics() returns Metrics,
+    instrumented code checks `metrics is not None` only, so the cost is one attribute test
+    - counters: bytes in/out, frames, framing errors, collisions, requests/timeouts/retries
+      per command, sweeps and dropped sweeps
+    - latency histograms per command, request to reply, 'scope' is the interval of sweeps
+    - trace callbacks, called with Trace for every transaction
+    snapshot() returns dict, to_json() and to_prometheus() dump it as text
+'''
+import bisect
+from collections import namedtuple
+import json
+import math
+import threading
+import time
+
+import civ_codec
+
+# histogram bucket upper bounds in sec
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+# smoothing factor of sweep rate
+RATE_ALPHA = 0.1
+
+# Trace: command name, request frame in bytes, reply civ_codec.Frame (None on timeout),
+#        start time.monotonic(), duration in sec
+Trace = namedtuple('Trace', ['command', 'request', 'reply', 'start', 'duration'])
+
+
+class Histogram():
+    ''' fixed bucket histogram, counts[i] is the number of values <= buckets[i],
+        not cumulative, the last count is for values above all buckets
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        ''' add one value '''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        ''' upper bound of the bucket holding quantile q (0-1), at most max, 0.0 if empty '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        ''' dict of cumulative buckets as (upper bound, count), count, sum, mean, max,
+            p50/p90/p99 quantiles estimated from buckets
+        '''
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {
+            'buckets': cumulative,
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics():
+    ''' counters, latency histograms and trace callbacks, thread safe
+        shared by CIV handles and their reader thread, see CIV.enable_metrics()
+    '''
+    # counters without label
+    COUNTERS = ('bytes_in', 'bytes_out', 'frames', 'framing_errors', 'collisions',
+                'sweeps', 'sweeps_dropped', 'frames_dropped')
+    # counters per command
+    COMMAND_COUNTERS = ('requests', 'timeouts', 'retries')
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        # counter name -> {command name: count}
+        self.command_counters = {name: {} for name in self.COMMAND_COUNTERS}
+        # command name -> Histogram
+        self.latency = {}
+        # (cmd,) or (cmd, subcmd) -> command name, ex) (0x03,) -> 'freq'
+        self.names = {(0x27, 0x00): 'scope', (0x27, 0x10): 'scope_on',
+                      (0x27, 0x11): 'scope_readout'}
+        # objects with frames/errors/collisions or dropped attributes, read by snapshot()
+        self.sources = []
+        # id(source) -> source_counts() at reset()
+        self.bases = {}
+        self.tracers = []
+        self.last_sweep = None
+        self.sweep_rate = 0.0
+
+    def command_name(self, msg):
+        ''' command name of a request frame in bytes, ex) 'freq' or '1A05' if not named '''
+        if len(msg) < 6:
+            return 'unknown'
+        cmd = msg[4]
+        if cmd in civ_codec.SUBCMD_COMMANDS and len(msg) > 6:
+            name = self.names.get((cmd, msg[5]))
+            if name is not None:
+                return name
+            return f'{cmd:02X}{msg[5]:02X}'
+        return self.names.get((cmd,), f'{cmd:02X}')
+
+    def count(self, name, value=1, command=None):
+        ''' add value to counter, command is required for COMMAND_COUNTERS '''
+        with self.lock:
+            if command is None:
+                self.counters[name] += value
+            else:
+                counters = self.command_counters[name]
+                counters[command] = counters.get(command, 0) + value
+
+    def observe(self, command, sec):
+        ''' add latency of command '''
+        with self.lock:
+            histogram = self.latency.get(command)
+            if histogram is None:
+                histogram = self.latency[command] = Histogram()
+            histogram.observe(sec)
+
+    def transaction(self, msg, start, reply):
+        ''' record one request/reply, reply is None on timeout '''
+        now = time.monotonic()
+        command = self.command_name(msg)
+        with self.lock:
+            counters = self.command_counters['requests']
+            counters[command] = counters.get(command, 0) + 1
+            if reply is None:
+                counters = self.command_counters['timeouts']
+                counters[command] = counters.get(command, 0) + 1
+            else:
+                histogram = self.latency.get(command)
+                if histogram is None:
+                    histogram = self.latency[command] = Histogram()
+                histogram.observe(now - start)
+            tracers = self.tracers
+        for tracer in tracers:
+            tracer(Trace(command, msg, reply, start, now - start))
+
+    def sweep(self, dropped=0):
+        ''' one sweep completed, dropped: sweeps lost since the last one '''
+        now = time.monotonic()
+        with self.lock:
+            self.counters['sweeps'] += 1
+            self.counters['sweeps_dropped'] += dropped
+            if self.last_sweep is not None:
+                interval = now - self.last_sweep
+                histogram = self.latency.get('scope')
+                if histogram is None:
+                    histogram = self.latency['scope'] = Histogram()
+                histogram.observe(interval)
+                if interval > 0:
+                    rate = 1 / interval
+                    self.sweep_rate = rate if not self.sweep_rate \
+                        else self.sweep_rate + RATE_ALPHA * (rate - self.sweep_rate)
+            self.last_sweep = now
+
+    def add_source(self, source):
+        ''' add civ_codec.FrameParser, FrameRouter or CIVBus, their counters
+            (frames, errors, collisions, dropped) are added at snapshot()
+        '''
+        with self.lock:
+            if all(s is not source for s in self.sources):
+                self.sources = self.sources + [source]
+
+    def add_tracer(self, callback):
+        ''' add callback(Trace) called after every transaction, from the caller's thread '''
+        with self.lock:
+            self.tracers = self.tracers + [callback]
+
+    def remove_tracer(self, callback):
+        ''' remove callback '''
+        with self.lock:
+            self.tracers = [t for t in self.tracers if t != callback]
+
+    def reset(self):
+        ''' clear all counters and histograms, sources and tracers are kept '''
+        with self.lock:
+            self.start = time.monotonic()
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+            self.command_counters = {name: {} for name in self.COMMAND_COUNTERS}
+            self.latency = {}
+            self.last_sweep = None
+            self.sweep_rate = 0.0
+            # snapshot() reports counts after reset
+            self.bases = {id(source): self.source_counts(source) for source in self.sources}
+
+    @classmethod
+    def source_counts(cls, source):
+        ''' (frames, framing errors, collisions, dropped frames) of a source '''
+        parser = getattr(source, 'parser', source)
+        # CIVBus counts collisions on transmit, others count jammer codes received
+        collisions = getattr(source, 'collisions', getattr(parser, 'collisions', 0))
+        return (getattr(parser, 'frames', 0), getattr(parser, 'errors', 0), collisions,
+                getattr(source, 'dropped', 0))
+
+    def snapshot(self):
+        ''' returns dict of all metrics
+            counters, command_counters, latency (Histogram.snapshot() per command),
+            sweep_rate (recent sweeps/s), uptime in sec
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            for source in self.sources:
+                counts = self.source_counts(source)
+                base = self.bases.get(id(source), (0, 0, 0, 0))
+                for name, value, value0 in zip(('frames', 'framing_errors', 'collisions',
+                                                'frames_dropped'), counts, base):
+                    counters[name] += value - value0
+            return {
+                'uptime': time.monotonic() - self.start,
+                'counters': counters,
+                'command_counters': {name: dict(c) for name, c in self.command_counters.items()},
+                'latency': {name: h.snapshot() for name, h in self.latency.items()},
+                'sweep_rate': self.sweep_rate,
+            }
+
+    def to_json(self, indent=None):
+        ''' snapshot() in json text '''
+        snapshot = self.snapshot()
+        for histogram in snapshot['latency'].values():
+            histogram['buckets'] = [('+Inf' if math.isinf(b) else b, c)
+                                    for b, c in histogram['buckets']]
+        return json.dumps(snapshot, indent=indent)
+
+    def to_prometheus(self, prefix='civ'):
+        ''' snapshot() in prometheus text exposition format '''
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        for name, counters in snapshot['command_counters'].items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for command, value in sorted(counters.items()):
+                lines.append(f'{prefix}_{name}_total{{command="{command}"}} {value}')
+        lines.append(f'# TYPE {prefix}_latency_seconds histogram')
+        for command, histogram in sorted(snapshot['latency'].items()):
+            for bound, count in histogram['buckets']:
+                le = '+Inf' if math.isinf(bound) else f'{bound:g}'
+                lines.append(f'{prefix}_latency_seconds_bucket'
+                             f'{{command="{command}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_latency_seconds_sum{{command="{command}"}} '
+                         f'{histogram["sum"]:.6f}')
+            lines.append(f'{prefix}_latency_seconds_count{{command="{command}"}} '
+                         f'{histogram["count"]}')
+        lines.append(f'# TYPE {prefix}_sweep_rate gauge')
+        lines.append(f'{prefix}_sweep_rate {snapshot["sweep_rate"]:.3f}')
+        return '\n'.join(lines) + '\n'
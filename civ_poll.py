@@ -0,0 +1,230 @@
+''' priority poll scheduler
+    periodic reads declared with rate and priority, sent in batches by CIV.query_many()
+        poller = PollScheduler(rig, callback=update_labels)
+        poller.start()
+        poller.set_scope(True)      # scope stream running, less link time for polling
+    the link time per query is estimated from frame lengths and the baudrate,
+    polling uses at most POLL_SHARE of the link time left by the scope stream,
+    items that do not fit wait, higher priority first, and a failing item
+    is polled less often until it answers again
+    the thread sleeps until the next item is due, no busy loop
+'''
+from logging import getLogger
+import threading
+import time
+
+import civ_rigs
+
+logger = getLogger(__name__)
+
+# (query name, rate in Hz, priority: 0 is the highest), see default_items()
+DEFAULT_ITEMS = (
+    ('freq', 10.0, 0),
+    ('opmode', 1.0, 1),
+    ('vd', 0.2, 2),
+    ('gps_position', 0.1, 3),
+)
+# share of free link time used by polling
+POLL_SHARE = 0.5
+# share of link time kept for polling even if the scope stream fills the link
+MIN_POLL_SHARE = 0.1
+# scope sweeps per sec assumed by set_scope()
+SCOPE_RATE = 30.0
+# bytes per scope data frame besides the division data: FE FE dst src 27 00 ... FD
+SCOPE_FRAME_OVERHEAD = 12
+# bits per byte on the line, 8N1
+BITS_PER_BYTE = 10
+# failing item interval is doubled up to this factor
+MAX_BACKOFF = 8
+# reply payload bytes including subcmd, for link time estimation
+REPLY_PAYLOAD = {'freq': 5, 'opmode': 2, 'vd': 3, 'gps_position': 28, 'smeter': 3}
+DEFAULT_REPLY_PAYLOAD = 4
+# decoded value on failure, see CIV.parse_*()
+FAILED_VALUES = {'freq': 0, 'opmode': 'N/A', 'vd': 0.0, 'gps_position': ('', ''),
+                 'smeter': -1}
+
+
+def default_items(rig):
+    ''' DEFAULT_ITEMS the rig supports, see CIV.supports() '''
+    return [item for item in DEFAULT_ITEMS if rig.supports(item[0])]
+
+
+class PollItem():
+    ''' one periodic read
+        cost: estimated link bytes of request, echo and reply
+    '''
+    def __init__(self, name, rate, priority, cost) -> None:
+        self.name = name
+        self.rate = rate
+        self.priority = priority
+        self.cost = cost
+        self.next_due = 0.0
+        self.failures = 0
+        # last good value and its time.monotonic(), None if not read yet
+        self.value = None
+        self.updated = None
+
+    @property
+    def interval(self):
+        ''' sec between reads, longer while failing '''
+        return min(2 ** self.failures, MAX_BACKOFF) / self.rate
+
+
+class PollScheduler():
+    ''' poll rig values at declared rates in a background thread
+        Args:
+            rig: civ.CIV, start_reader() is recommended when the scope is streamed
+            items: iterable of (query name in CIV.QUERIES, rate in Hz, priority),
+                   None for default_items(rig)
+            callback: callback(values) called from the poll thread after each batch,
+                      values is dict, query name -> value, failed reads are not included
+    '''
+    def __init__(self, rig, items=None, callback=None) -> None:
+        self.rig = rig
+        self.callback = callback
+        baudrate = getattr(rig.ser, 'baudrate', 0) \
+            or (rig.profile.baudrate if rig.profile is not None else civ_rigs.DEFAULT_BAUDRATE)
+        # link bytes per sec
+        self.link_rate = baudrate / BITS_PER_BYTE
+        scope = rig.profile.scope if rig.profile is not None and rig.profile.scope \
+            else civ_rigs.DEFAULT_SCOPE
+        self.sweep_bytes = scope.divisions * (scope.division_bytes + SCOPE_FRAME_OVERHEAD)
+        self.scope_rate = 0.0
+        self.budget = self.poll_budget()
+        # link bytes polling may use now, refilled at budget bytes/s, up to 1 sec of budget
+        # or the largest item
+        self.credit = self.budget
+        self.refilled = time.monotonic()
+
+        self.items = {}
+        self.lock = threading.Lock()
+        # set on add/stop/set_scope, wakes the poll thread
+        self.wake = threading.Event()
+        self.is_stopped = threading.Event()
+        self.thread = None
+        if items is None:
+            items = default_items(rig)
+        for name, rate, priority in items:
+            self.add(name, rate, priority)
+
+    def poll_budget(self):
+        ''' link bytes per sec for polling '''
+        free = self.link_rate - self.scope_rate * self.sweep_bytes
+        return max(free * POLL_SHARE, self.link_rate * MIN_POLL_SHARE)
+
+    def add(self, name, rate, priority=0):
+        ''' add or replace an item, name is a query name in CIV.QUERIES '''
+        if name not in self.rig.QUERIES:
+            raise ValueError(f'unknown query: {name}')
+        if rate <= 0:
+            raise ValueError(f'rate must be positive: {rate}')
+        request = 6 + len(self.rig.QUERIES[name][0])
+        reply = 6 + REPLY_PAYLOAD.get(name, DEFAULT_REPLY_PAYLOAD)
+        with self.lock:
+            # request is echoed back on single wire CI-V
+            self.items[name] = PollItem(name, rate, priority, 2 * request + reply)
+        self.wake.set()
+
+    def remove(self, name):
+        ''' stop polling name '''
+        with self.lock:
+            self.items.pop(name, None)
+
+    def set_scope(self, is_on, rate=SCOPE_RATE):
+        ''' scope stream started or stopped, its link time is reserved while on '''
+        with self.lock:
+            self.scope_rate = rate if is_on else 0.0
+            self.budget = self.poll_budget()
+        self.wake.set()
+
+    def get(self, name):
+        ''' last good value of name, None if not read yet '''
+        item = self.items.get(name)
+        return None if item is None else item.value
+
+    def age(self, name):
+        ''' sec since the last good read of name, None if not read yet '''
+        item = self.items.get(name)
+        if item is None or item.updated is None:
+            return None
+        return time.monotonic() - item.updated
+
+    def start(self):
+        ''' start poll thread '''
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.is_stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='civ-poll', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        ''' stop poll thread, waits the batch being read '''
+        self.is_stopped.set()
+        self.wake.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+        self.thread = None
+
+    def next_batch(self, now):
+        ''' due items fitting in the link credit, highest priority first
+            Returns:
+                (list of PollItem, sec to wait if the list is empty)
+        '''
+        with self.lock:
+            limit = max([self.budget] + [item.cost for item in self.items.values()])
+            self.credit = min(self.credit + (now - self.refilled) * self.budget, limit)
+            self.refilled = now
+            due = sorted((item for item in self.items.values() if item.next_due <= now),
+                         key=lambda item: (item.priority, item.next_due))
+            batch = []
+            credit = self.credit
+            for item in due:
+                if item.cost > credit:
+                    break
+                batch.append(item)
+                credit -= item.cost
+            if batch:
+                self.credit = credit
+                return batch, 0.0
+            if due:
+                # wait for credit of the highest priority item
+                return [], (due[0].cost - self.credit) / self.budget
+            wait = min((item.next_due for item in self.items.values()), default=now + 1.0)
+            return [], wait - now
+
+    def poll_once(self, batch):
+        ''' read batch in one round trip, returns dict of good values '''
+        values = self.rig.query_many([item.name for item in batch])
+        now = time.monotonic()
+        good = {}
+        for item in batch:
+            value = values.get(item.name)
+            if value is None or value == FAILED_VALUES.get(item.name):
+                item.failures += 1
+                if item.failures == 1:
+                    logger.info(f'poll failed, backing off: {item.name}')
+            else:
+                item.failures = 0
+                item.value = value
+                item.updated = now
+                good[item.name] = value
+            # keep the phase, skip missed periods under load
+            item.next_due += item.interval
+            if item.next_due <= now:
+                item.next_due = now + item.interval
+        return good
+
+    def run(self):
+        ''' poll thread main loop '''
+        while not self.is_stopped.is_set():
+            self.wake.clear()
+            batch, wait = self.next_batch(time.monotonic())
+            if not batch:
+                self.wake.wait(wait)
+                continue
+            good = self.poll_once(batch)
+            if good and self.callback is not None:
+                try:
+                    self.callback(good)
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.error(f'poll callback failed: {e}')
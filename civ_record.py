@@ -0,0 +1,541 @@
+''' compact binary recording of scope sweeps and telemetry
+    append-only chunked file, all numbers little-endian
+
+    file header (FILE_HEADER, 64 bytes)
+        magic, version, rig name, rig address, scope points/divisions/division bytes,
+        created time
+    chunks, each one is CHUNK_HEADER (36 bytes) + count fixed-size records of one kind
+        KIND_SWEEP      SWEEP_DTYPE records, scope data in uint8
+        KIND_TELEMETRY  TELEMETRY_DTYPE records, freq/opmode/Vd/GPS position
+        KIND_INDEX      INDEX_DTYPE records, one per chunk since the previous index chunk,
+                        aux field of the header is the offset of the previous index chunk,
+                        followed by INDEX_TRAILER, so the last index is found from the file end
+    records of a chunk are written at once, so a crash loses at most the buffered chunk,
+    and every chunk can be mapped as a numpy structured array without parsing
+    Capture reads a recording through numpy.memmap
+'''
+from collections import namedtuple
+from logging import getLogger
+import math
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import civ_rigs
+from civ_scope import SCOPE_DATA_LENGTH
+
+logger = getLogger(__name__)
+
+MAGIC = b'CIVREC\r\n'
+VERSION = 1
+
+# magic, version, header size, rig name, rig address,
+# scope points, divisions, division bytes, created time
+FILE_HEADER = struct.Struct('<8sHH16sBxHHHxxd18x')
+# magic, kind, record count, first timestamp, last timestamp, aux
+CHUNK_HEADER = struct.Struct('<4sB3xIddQ')
+CHUNK_MAGIC = b'CHNK'
+# offset of the index chunk, magic
+INDEX_TRAILER = struct.Struct('<Q4s')
+INDEX_MAGIC = b'CIDX'
+
+KIND_SWEEP = 1
+KIND_TELEMETRY = 2
+KIND_INDEX = 3
+
+TELEMETRY_DTYPE = np.dtype([('timestamp', '<f8'), ('freq', '<u8'), ('opmode', 'S8'),
+                            ('vd', '<f4'), ('lat', 'S12'), ('lon', 'S12')])
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('kind', 'u1'), ('count', '<u4'),
+                        ('t_first', '<f8'), ('t_last', '<f8'),
+                        ('freq_min', '<u8'), ('freq_max', '<u8')])
+
+# sweeps per chunk, about 8 sec at 30 sweeps/s
+CHUNK_SWEEPS = 256
+# max sec between chunk writes
+FLUSH_INTERVAL = 10.0
+# data chunks between index chunks
+INDEX_CHUNKS = 64
+
+# FileHeader: rig name, rig address, ScopeGeometry like points/divisions/division_bytes,
+#             created time.time()
+FileHeader = namedtuple('FileHeader', ['rig', 'address', 'points', 'divisions',
+                                       'division_bytes', 'created'])
+# SweepArray: data (N, points) numpy.uint8, timestamp, center_freq, span arrays of N
+SweepArray = namedtuple('SweepArray', ['data', 'timestamp', 'center_freq', 'span'])
+# ChunkHeader: offset of the chunk header in the file, kind, record count,
+#              first/last timestamp, aux
+ChunkHeader = namedtuple('ChunkHeader', ['offset', 'kind', 'count', 't_first', 't_last',
+                                         'aux'])
+
+
+def sweep_dtype(points=SCOPE_DATA_LENGTH):
+    ''' structured dtype of one sweep record '''
+    return np.dtype([('timestamp', '<f8'), ('center_freq', '<u8'), ('span', '<u4'),
+                     ('seq', '<u4'), ('data', 'u1', (points,))])
+
+
+def record_dtype(kind, points=SCOPE_DATA_LENGTH):
+    ''' structured dtype of records of kind '''
+    if kind == KIND_SWEEP:
+        return sweep_dtype(points)
+    if kind == KIND_TELEMETRY:
+        return TELEMETRY_DTYPE
+    if kind == KIND_INDEX:
+        return INDEX_DTYPE
+    raise ValueError(f'unknown chunk kind: {kind}')
+
+
+def chunk_size(kind, count, points=SCOPE_DATA_LENGTH):
+    ''' bytes of a chunk including the header '''
+    size = CHUNK_HEADER.size + count * record_dtype(kind, points).itemsize
+    if kind == KIND_INDEX:
+        size += INDEX_TRAILER.size
+    return size
+
+
+def read_header(f):
+    ''' FileHeader from the start of binary file object f, raises ValueError if not a recording '''
+    f.seek(0)
+    raw = f.read(FILE_HEADER.size)
+    if len(raw) < FILE_HEADER.size:
+        raise ValueError('file too short')
+    magic, version, size, rig, address, points, divisions, division_bytes, created = \
+        FILE_HEADER.unpack(raw)
+    if magic != MAGIC or size != FILE_HEADER.size:
+        raise ValueError('not a CI-V recording')
+    if version != VERSION:
+        raise ValueError(f'unsupported version: {version}')
+    return FileHeader(rig.rstrip(b'\x00').decode('ascii'), address, points, divisions,
+                      division_bytes, created)
+
+
+def iter_chunks(f, start=FILE_HEADER.size):
+    ''' walk chunk headers from offset start, stops at the end or at a broken chunk
+        Yields:
+            ChunkHeader
+    '''
+    points = read_header(f).points
+    offset = start
+    while True:
+        f.seek(offset)
+        raw = f.read(CHUNK_HEADER.size)
+        if len(raw) < CHUNK_HEADER.size:
+            return
+        magic, kind, count, t_first, t_last, aux = CHUNK_HEADER.unpack(raw)
+        if magic != CHUNK_MAGIC:
+            logger.warning(f'broken chunk at {offset}')
+            return
+        size = chunk_size(kind, count, points)
+        f.seek(0, 2)
+        if offset + size > f.tell():
+            # not completely written
+            return
+        yield ChunkHeader(offset, kind, count, t_first, t_last, aux)
+        offset += size
+
+
+def scan_entry(f, chunk, points=SCOPE_DATA_LENGTH):
+    ''' INDEX_DTYPE entry of a data chunk found by iter_chunks(), reads sweep records
+        for the frequency range
+    '''
+    freq_min = freq_max = 0
+    if chunk.kind == KIND_SWEEP and chunk.count:
+        f.seek(chunk.offset + CHUNK_HEADER.size)
+        dtype = sweep_dtype(points)
+        records = np.frombuffer(f.read(chunk.count * dtype.itemsize), dtype=dtype)
+        freq_min = int((records['center_freq'] - records['span']).min())
+        freq_max = int((records['center_freq'] + records['span']).max())
+    return (chunk.offset, chunk.kind, chunk.count, chunk.t_first, chunk.t_last,
+            freq_min, freq_max)
+
+
+class Recorder():
+    ''' append sweeps and telemetry samples to a recording file
+        Args:
+            path: file name, appended if it is an existing recording of the same geometry
+            rig: rig name, ex) 'IC-7300'
+            address: rig CI-V address in int
+            scope: civ_rigs.ScopeGeometry, None for IC-7300 geometry
+            chunk_sweeps: sweeps buffered per chunk
+            flush_interval: max sec between chunk writes
+            index_chunks: data chunks between index chunks
+    '''
+    def __init__(self, path, rig='', address=0x00, scope=None, chunk_sweeps=CHUNK_SWEEPS,
+                 flush_interval=FLUSH_INTERVAL, index_chunks=INDEX_CHUNKS) -> None:
+        if scope is None:
+            scope = civ_rigs.DEFAULT_SCOPE
+        points, divisions, division_bytes = scope
+        self.path = path
+        self.points = points
+        self.flush_interval = flush_interval
+        self.index_chunks = index_chunks
+        self.sweeps = np.zeros(chunk_sweeps, dtype=sweep_dtype(points))
+        self.num_sweeps = 0
+        self.telemetry = []
+        self.index = []
+        self.last_index = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, 'w+b' if is_new else 'r+b')  # pylint: disable=consider-using-with
+        if is_new:
+            self.f.write(FILE_HEADER.pack(MAGIC, VERSION, FILE_HEADER.size,
+                                          rig.encode('ascii')[:16], address,
+                                          points, divisions, division_bytes, time.time()))
+            self.f.flush()
+        else:
+            header = read_header(self.f)
+            if header.points != points:
+                self.f.close()
+                raise ValueError(f'{path}: scope points {header.points} != {points}')
+            end = FILE_HEADER.size
+            for chunk in iter_chunks(self.f):
+                if chunk.kind == KIND_INDEX:
+                    self.last_index = chunk.offset
+                    self.index = []
+                else:
+                    # not indexed yet if the last recording was interrupted
+                    self.index.append(scan_entry(self.f, chunk, points))
+                end = chunk.offset + chunk_size(chunk.kind, chunk.count, points)
+            # drop a partly written chunk of an interrupted recording
+            self.f.truncate(end)
+            self.f.seek(end)
+
+    def write_sweep(self, sweep):
+        ''' buffer one civ_scope.Sweep, written with the next chunk, ignored after close() '''
+        with self.lock:
+            if self.f.closed:
+                return
+            rec = self.sweeps[self.num_sweeps]
+            rec['timestamp'] = sweep.timestamp
+            rec['center_freq'] = sweep.center_freq
+            rec['span'] = sweep.span
+            rec['seq'] = sweep.seq
+            rec['data'] = sweep.data
+            self.num_sweeps += 1
+            if self.num_sweeps == len(self.sweeps) \
+                    or time.monotonic() - self.last_flush > self.flush_interval:
+                self._flush()
+
+    def write_telemetry(self, freq=None, opmode=None, vd=None, gps_position=None,
+                        timestamp=None):
+        ''' buffer one telemetry sample, arguments are same as CIV.query_many() result
+            so recorder.write_telemetry(**rig.query_many(['freq', 'opmode', 'vd']))
+            None, 0 or 'N/A' are stored as unknown
+        '''
+        lat, lon = gps_position or ('', '')
+        sample = (time.time() if timestamp is None else timestamp,
+                  freq or 0, (opmode or 'N/A').encode('ascii'),
+                  math.nan if not vd else vd,
+                  lat.encode('ascii'), lon.encode('ascii'))
+        with self.lock:
+            if self.f.closed:
+                return
+            self.telemetry.append(sample)
+            if time.monotonic() - self.last_flush > self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        ''' write buffered records now '''
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        ''' write buffered records and a final index chunk '''
+        with self.lock:
+            if self.f.closed:
+                return
+            self._flush()
+            if self.index:
+                self._write_index()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self):
+        ''' write buffered telemetry and sweeps, lock is held by caller '''
+        self.last_flush = time.monotonic()
+        if self.telemetry:
+            records = np.array(self.telemetry, dtype=TELEMETRY_DTYPE)
+            self.telemetry = []
+            self._write_chunk(KIND_TELEMETRY, records)
+        if self.num_sweeps:
+            records = self.sweeps[:self.num_sweeps]
+            low = records['center_freq'] - records['span']
+            high = records['center_freq'] + records['span']
+            self._write_chunk(KIND_SWEEP, records, int(low.min()), int(high.max()))
+            self.num_sweeps = 0
+        self.f.flush()
+        if len(self.index) >= self.index_chunks:
+            self._write_index()
+
+    def _write_chunk(self, kind, records, freq_min=0, freq_max=0):
+        ''' append one data chunk and add it to the index, returns its offset '''
+        offset = self.f.tell()
+        t_first = float(records['timestamp'][0])
+        t_last = float(records['timestamp'][-1])
+        self.f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, kind, len(records), t_first, t_last, 0))
+        self.f.write(records.tobytes())
+        self.index.append((offset, kind, len(records), t_first, t_last, freq_min, freq_max))
+        return offset
+
+    def _write_index(self):
+        ''' append index chunk of data chunks written since the previous one '''
+        records = np.array(self.index, dtype=INDEX_DTYPE)
+        self.index = []
+        offset = self.f.tell()
+        self.f.write(CHUNK_HEADER.pack(CHUNK_MAGIC, KIND_INDEX, len(records),
+                                       float(records['t_first'].min()),
+                                       float(records['t_last'].max()), self.last_index))
+        self.f.write(records.tobytes())
+        self.f.write(INDEX_TRAILER.pack(offset, INDEX_MAGIC))
+        self.f.flush()
+        self.last_index = offset
+
+
+def record(rig, path, duration=None, telemetry_interval=3.0):
+    ''' record scope sweeps and telemetry of rig to path
+        Args:
+            rig: civ.CIV
+            duration: sec, None for until KeyboardInterrupt
+            telemetry_interval: sec between freq/opmode/Vd reads
+        Returns:
+            number of sweeps recorded
+    '''
+    count = 0
+    deadline = None if duration is None else time.monotonic() + duration
+    next_telemetry = 0.0
+    names = [name for name in ('freq', 'opmode', 'vd') if rig.supports(name)]
+    profile = rig.profile
+    with Recorder(path, profile.name if profile else '', rig.addr_rig[0],
+                  profile.scope if profile else None) as recorder:
+        sweeps = rig.iter_spectrum(copy=False)
+        try:
+            for sweep in sweeps:
+                recorder.write_sweep(sweep)
+                count += 1
+                now = time.monotonic()
+                if now >= next_telemetry:
+                    # needs start_reader(), replies are mixed with scope frames
+                    if rig.dispatcher is not None:
+                        recorder.write_telemetry(**rig.query_many(names))
+                    next_telemetry = now + telemetry_interval
+                if deadline is not None and now >= deadline:
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sweeps.close()
+    logger.info(f'{count} sweeps recorded to {path}')
+    return count
+
+
+class Capture():
+    ''' read a recording through numpy.memmap, nothing is loaded until it is accessed
+        chunks are located by the index chunks, found from INDEX_TRAILER at the end of
+        the file, or by walking chunk headers if the recording was not closed
+        Args:
+            path: recording file name
+    '''
+    def __init__(self, path) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            self.header = read_header(f)
+            self.points = self.header.points
+            # INDEX_DTYPE array of data chunks
+            self.chunks = self.load_index(f)
+        self.mm = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def load_index(self, f):
+        ''' INDEX_DTYPE array of all data chunks in file f '''
+        f.seek(0, 2)
+        end = f.tell()
+        tables = []
+        offset = 0
+        if end >= FILE_HEADER.size + INDEX_TRAILER.size:
+            f.seek(end - INDEX_TRAILER.size)
+            offset, magic = INDEX_TRAILER.unpack(f.read(INDEX_TRAILER.size))
+            if magic != INDEX_MAGIC:
+                offset = 0
+        if offset:
+            # walk back from the last index chunk
+            while offset:
+                f.seek(offset)
+                magic, kind, count, _, _, aux = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                if magic != CHUNK_MAGIC or kind != KIND_INDEX:
+                    raise ValueError(f'{self.path}: broken index chunk at {offset}')
+                tables.append(np.frombuffer(f.read(count * INDEX_DTYPE.itemsize),
+                                            dtype=INDEX_DTYPE))
+                offset = aux
+            tables.reverse()
+        else:
+            logger.info(f'{self.path}: recording was not closed, scanning chunks')
+            pending = []
+            for chunk in iter_chunks(f):
+                if chunk.kind == KIND_INDEX:
+                    f.seek(chunk.offset + CHUNK_HEADER.size)
+                    tables.append(np.frombuffer(f.read(chunk.count * INDEX_DTYPE.itemsize),
+                                                dtype=INDEX_DTYPE))
+                    pending = []
+                else:
+                    pending.append(scan_entry(f, chunk, self.points))
+            tables.append(np.array(pending, dtype=INDEX_DTYPE))
+        if not tables:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.concatenate(tables)
+
+    def close(self):
+        ''' drop the mapping, the file is unmapped when views returned before are gone '''
+        self.mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        ''' number of sweeps '''
+        return int(self.chunks['count'][self.chunks['kind'] == KIND_SWEEP].sum())
+
+    def time_range(self):
+        ''' (first, last) timestamp of sweeps and telemetry, None if empty '''
+        if not len(self.chunks):
+            return None
+        return float(self.chunks['t_first'].min()), float(self.chunks['t_last'].max())
+
+    def select(self, kind, t0=None, t1=None, freq_min=None, freq_max=None):
+        ''' index entries of chunks of kind overlapping time and frequency range '''
+        chunks = self.chunks
+        mask = chunks['kind'] == kind
+        if t0 is not None:
+            mask &= chunks['t_last'] >= t0
+        if t1 is not None:
+            mask &= chunks['t_first'] <= t1
+        if kind == KIND_SWEEP:
+            if freq_min is not None:
+                mask &= chunks['freq_max'] >= freq_min
+            if freq_max is not None:
+                mask &= chunks['freq_min'] <= freq_max
+        return chunks[mask]
+
+    def records(self, entry):
+        ''' structured array view of the records of one chunk '''
+        start = int(entry['offset']) + CHUNK_HEADER.size
+        dtype = record_dtype(int(entry['kind']), self.points)
+        return self.mm[start:start + int(entry['count']) * dtype.itemsize].view(dtype)
+
+    def iter_sweeps(self, t0=None, t1=None, freq_min=None, freq_max=None):
+        ''' sweep records in time and frequency range, chunk by chunk
+            t0, t1: time.time() range, None for no limit
+            freq_min, freq_max: Hz, sweeps overlapping the range
+            Yields:
+                SWEEP_DTYPE structured array, a view of the file if the whole chunk
+                or a time slice of it is selected
+        '''
+        for entry in self.select(KIND_SWEEP, t0, t1, freq_min, freq_max):
+            records = self.records(entry)
+            # timestamps are in order in a chunk
+            start, stop = 0, len(records)
+            if t0 is not None:
+                start = int(np.searchsorted(records['timestamp'], t0, 'left'))
+            if t1 is not None:
+                stop = int(np.searchsorted(records['timestamp'], t1, 'right'))
+            records = records[start:stop]
+            if freq_min is not None or freq_max is not None:
+                mask = np.ones(len(records), dtype=bool)
+                if freq_min is not None:
+                    mask &= records['center_freq'] + records['span'] >= freq_min
+                if freq_max is not None:
+                    mask &= records['center_freq'] - records['span'] <= freq_max
+                if not mask.all():
+                    records = records[mask]
+            if len(records):
+                yield records
+
+    def sweeps(self, t0=None, t1=None, freq_min=None, freq_max=None):
+        ''' sweeps in time and frequency range, arguments are same as iter_sweeps()
+            Returns:
+                SweepArray, data is a (N, points) view of the file if the range is
+                in one chunk, else a copy of the selected sweeps only
+        '''
+        blocks = list(self.iter_sweeps(t0, t1, freq_min, freq_max))
+        if not blocks:
+            records = np.zeros(0, dtype=sweep_dtype(self.points))
+        elif len(blocks) == 1:
+            records = blocks[0]
+        else:
+            records = np.concatenate(blocks)
+        return SweepArray(records['data'], records['timestamp'], records['center_freq'],
+                          records['span'])
+
+    def telemetry(self, t0=None, t1=None):
+        ''' TELEMETRY_DTYPE array of samples in time range '''
+        blocks = []
+        for entry in self.select(KIND_TELEMETRY, t0, t1):
+            records = self.records(entry)
+            mask = np.ones(len(records), dtype=bool)
+            if t0 is not None:
+                mask &= records['timestamp'] >= t0
+            if t1 is not None:
+                mask &= records['timestamp'] <= t1
+            blocks.append(records[mask])
+        if not blocks:
+            return np.zeros(0, dtype=TELEMETRY_DTYPE)
+        return np.concatenate(blocks)
+
+    # per bin statistics, computed chunk by chunk, memory does not grow with the capture
+    # arguments are same as iter_sweeps(), sweeps are expected to have the same center/span
+
+    def average(self, **query):
+        ''' mean level per bin, None if no sweep '''
+        total = np.zeros(self.points)
+        count = 0
+        for records in self.iter_sweeps(**query):
+            total += records['data'].sum(axis=0, dtype=np.uint64)
+            count += len(records)
+        return total / count if count else None
+
+    def max_hold(self, **query):
+        ''' max level per bin, None if no sweep '''
+        out = None
+        for records in self.iter_sweeps(**query):
+            peak = records['data'].max(axis=0)
+            out = peak if out is None else np.maximum(out, peak)
+        return out
+
+    def histogram(self, **query):
+        ''' (points, 256) count of each level per bin '''
+        hist = np.zeros(self.points * 256, dtype=np.int64)
+        offsets = np.arange(self.points, dtype=np.intp) * 256
+        for records in self.iter_sweeps(**query):
+            hist += np.bincount((records['data'] + offsets).ravel(), minlength=len(hist))
+        return hist.reshape(self.points, 256)
+
+    def noise_floor(self, percentile=10, **query):
+        ''' level per bin below which percentile % of sweeps are, None if no sweep
+            exact for uint8 levels, from histogram()
+        '''
+        hist = self.histogram(**query)
+        total = hist[0].sum()
+        if not total:
+            return None
+        cum = hist.cumsum(axis=1)
+        return np.argmax(cum >= total * percentile / 100, axis=1).astype(np.uint8)
+
+    def occupancy(self, threshold, **query):
+        ''' ratio of sweeps with level above threshold per bin, None if no sweep '''
+        above = np.zeros(self.points, dtype=np.int64)
+        count = 0
+        for records in self.iter_sweeps(**query):
+            above += (records['data'] > threshold).sum(axis=0)
+            count += len(records)
+        return above / count if count else None
@@ -0,0 +1,278 @@
+''' raw capture and replay of the serial link
+    SerialTap wraps a serial port and logs every byte read/written with timestamp
+        rig = civ.CIV('COM5', ser=civ_replay.SerialTap(serial.Serial('COM5', 19200), 'link.civraw'))
+    ReplaySerial is a serial.Serial compatible object replaying what the rig sent
+        rig = civ.CIV('replay', 'IC-7300', ser=civ_replay.ReplaySerial('link.civraw', speed=None))
+
+    file format, little-endian
+        RAW_HEADER: magic, start time.time(), baudrate
+        RAW_RECORD + data bytes, repeated
+            time in sec from start, direction DIR_RX (rig -> host) or DIR_TX, data length
+'''
+from collections import deque
+from logging import getLogger
+import struct
+import sys
+import threading
+import time
+
+import civ_codec
+
+logger = getLogger(__name__)
+
+RAW_MAGIC = b'CIVRAW\r\n'
+RAW_HEADER = struct.Struct('<8sdI')
+RAW_RECORD = struct.Struct('<dBI')
+DIR_RX = 0
+DIR_TX = 1
+# received bytes held ahead of the host with speed=None
+MAX_BUFFER = 65536
+
+
+def read_header(f):
+    ''' (start time, baudrate) from binary file object f, raises ValueError if not a capture '''
+    raw = f.read(RAW_HEADER.size)
+    if len(raw) < RAW_HEADER.size:
+        raise ValueError('file too short')
+    magic, start, baudrate = RAW_HEADER.unpack(raw)
+    if magic != RAW_MAGIC:
+        raise ValueError('not a CI-V raw capture')
+    return start, baudrate
+
+
+def iter_records(path):
+    ''' records of a capture, stops at a partly written record
+        Yields:
+            (time from start in sec, direction, bytes)
+    '''
+    with open(path, 'rb') as f:
+        read_header(f)
+        while True:
+            raw = f.read(RAW_RECORD.size)
+            if len(raw) < RAW_RECORD.size:
+                return
+            t, direction, length = RAW_RECORD.unpack(raw)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield t, direction, data
+
+
+class SerialTap():
+    ''' serial port wrapper logging raw bytes in both directions
+        other attributes are passed to the wrapped port
+        Args:
+            ser: serial.Serial or compatible object
+            path: capture file name, overwritten
+    '''
+    def __init__(self, ser, path) -> None:
+        self.ser = ser
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.f = open(path, 'wb')  # pylint: disable=consider-using-with
+        self.f.write(RAW_HEADER.pack(RAW_MAGIC, time.time(), getattr(ser, 'baudrate', 0) or 0))
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def log(self, direction, data):
+        ''' append one record, empty data is not logged '''
+        if not data:
+            return
+        with self.lock:
+            if self.f.closed:
+                return
+            self.f.write(RAW_RECORD.pack(time.monotonic() - self.start, direction, len(data)))
+            self.f.write(data)
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        self.log(DIR_RX, data)
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        data = self.ser.read_until(expected, size)
+        self.log(DIR_RX, data)
+        return data
+
+    def readline(self):
+        data = self.ser.readline()
+        self.log(DIR_RX, data)
+        return data
+
+    def write(self, data):
+        self.log(DIR_TX, bytes(data))
+        return self.ser.write(data)
+
+    def flush(self):
+        self.ser.flush()
+        with self.lock:
+            if not self.f.closed:
+                self.f.flush()
+
+    def close(self):
+        ''' close the port and the capture file '''
+        self.ser.close()
+        with self.lock:
+            self.f.close()
+
+
+class ReplaySerial():
+    ''' serial.Serial compatible object replaying received bytes of a capture
+        each transmission in the capture is held until the host write()s,
+        so replies are never released before the query they answer
+        Args:
+            path: capture file name written by SerialTap
+            speed: 1.0 real time, 10.0 ten times faster, received bytes are timed
+                   from the host write() which passed the preceding transmission,
+                   None as fast as possible, received bytes up to the next transmission
+                   in the capture are released by each write() of the host
+            timeout: read timeout in sec, same as serial.Serial
+    '''
+    def __init__(self, path, speed=1.0, timeout=2) -> None:
+        with open(path, 'rb') as f:
+            _, self.baudrate = read_header(f)
+        self.name = f'replay://{path}'
+        self.speed = speed
+        self.timeout = timeout
+        self.records = iter_records(path)
+        # next record not released yet
+        self.next_record = next(self.records, None)
+        # timing anchor: capture time and time.monotonic() it is replayed at,
+        # moved to each transmission in the capture when the host passes it
+        self.anchor_t = None if self.next_record is None else self.next_record[0]
+        self.anchor = time.monotonic()
+        # time.monotonic() of host writes not matched to a transmission in the capture yet
+        self.tx_times = deque()
+        self.is_open = True
+        self.buf = bytearray()
+        self.cv = threading.Condition()
+        self.release()
+
+    @property
+    def is_done(self):
+        ''' True if all received bytes are released '''
+        return self.next_record is None
+
+    def release(self):
+        ''' move due records to buf, returns sec until the next one, None if not timed
+            cv is held by caller, or in __init__
+        '''
+        while self.next_record is not None:
+            t, direction, data = self.next_record
+            if self.speed is None:
+                if len(self.buf) >= MAX_BUFFER:
+                    return None
+                if direction == DIR_TX:
+                    if not self.tx_times:
+                        return None
+                    self.tx_times.popleft()
+            else:
+                due = self.anchor + (t - self.anchor_t) / self.speed
+                remain = due - time.monotonic()
+                if remain > 0:
+                    return remain
+                if direction == DIR_TX:
+                    if not self.tx_times:
+                        # wait for the host, woken up by write()
+                        return None
+                    # host may be late, the following replies are timed from its write
+                    self.anchor = max(self.tx_times.popleft(), due)
+                    self.anchor_t = t
+            if direction == DIR_RX:
+                self.buf += data
+            self.next_record = next(self.records, None)
+        return None
+
+    def wait_data(self, ready, timeout):
+        ''' wait until ready() or timeout, cv is held by caller '''
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            remain_record = self.release()
+            if ready() or not self.is_open:
+                return
+            remain = deadline - time.monotonic()
+            if remain <= 0:
+                return
+            if remain_record is not None:
+                remain = min(remain, remain_record)
+            self.cv.wait(remain)
+
+    @property
+    def in_waiting(self):
+        ''' bytes ready to read '''
+        with self.cv:
+            self.release()
+            return len(self.buf)
+
+    def read(self, size=1):
+        ''' read up to size bytes, waits timeout for the first byte '''
+        with self.cv:
+            self.wait_data(lambda: self.buf, self.timeout)
+            data = bytes(self.buf[:size])
+            del self.buf[:size]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        ''' read until expected, size bytes or timeout '''
+        def ready():
+            return expected in self.buf or (size is not None and len(self.buf) >= size)
+
+        with self.cv:
+            self.wait_data(ready, self.timeout)
+            idx = self.buf.find(expected)
+            end = idx + len(expected) if idx >= 0 else len(self.buf)
+            if size is not None:
+                end = min(end, size)
+            data = bytes(self.buf[:end])
+            del self.buf[:end]
+        return data
+
+    def readline(self):
+        ''' same as serial.Serial.readline() '''
+        return self.read_until(b'\n')
+
+    def write(self, data):
+        ''' host transmission is not sent anywhere, it passes the next transmission
+            in the capture and releases the replies after it
+        '''
+        with self.cv:
+            self.tx_times.append(time.monotonic())
+            self.release()
+            self.cv.notify_all()
+        return len(data)
+
+    def flush(self):
+        ''' nothing to flush '''
+
+    def reset_input_buffer(self):
+        ''' discard bytes not read yet '''
+        with self.cv:
+            self.buf.clear()
+
+    def close(self):
+        ''' stop replay '''
+        with self.cv:
+            self.is_open = False
+            self.records.close()
+            self.next_record = None
+            self.cv.notify_all()
+
+
+def main():
+    ''' print frames of a capture, python civ_replay.py link.civraw '''
+    parsers = {DIR_RX: civ_codec.FrameParser(), DIR_TX: civ_codec.FrameParser()}
+    for t, direction, data in iter_records(sys.argv[1]):
+        for frame in parsers[direction].feed(data):
+            mark = '<-' if direction == DIR_RX else '->'
+            print(f'{t:10.4f} {mark} {frame.src:02X}>{frame.dst:02X} cmd {frame.cmd:02X} '
+                  f'sub {"--" if frame.subcmd is None else f"{frame.subcmd:02X}"} '
+                  f'{frame.payload.hex()}')
+    for direction, parser in parsers.items():
+        if parser.errors:
+            print(f'{"rx" if direction == DIR_RX else "tx"} framing errors: {parser.errors}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+''' rig profile registry
+    profiles are loaded once from rigs.json, adding a rig means adding data to the file
+'''
+from collections import namedtuple
+import json
+from logging import getLogger
+import os
+
+logger = getLogger(__name__)
+
+RIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rigs.json')
+DEFAULT_BAUDRATE = 19200
+DEFAULT_FREQ_BYTES = 5
+# IC-7300: 0000=0V, 0013=10V, 0241=16V
+DEFAULT_VD_SCALE = ((0, 0.0), (13, 10.0), (241, 16.0))
+
+# ScopeGeometry: points per sweep, division frames per sweep, data bytes per division frame
+ScopeGeometry = namedtuple('ScopeGeometry', ['points', 'divisions', 'division_bytes'])
+# IC-7300 scope data, used if the rig profile has no scope geometry
+DEFAULT_SCOPE = ScopeGeometry(475, 11, 50)
+
+# RigProfile: name rig part name, ex) 'IC-7300'
+#             address CI-V address in int
+#             baudrate max baudrate [bps]
+#             freq_bytes BCD bytes of frequency data
+#             commands frozenset of supported query names, ex) 'freq', 'scope'
+#             scope ScopeGeometry, None if no scope data output
+#             vd_scale tuple of (level, V) points, None if no Vd meter
+RigProfile = namedtuple('RigProfile', ['name', 'address', 'baudrate', 'freq_bytes',
+                                       'commands', 'scope', 'vd_scale'])
+
+_profiles = {}
+_is_loaded = False
+
+
+def profile_from_dict(name, data):
+    ''' RigProfile from one entry of rigs.json '''
+    scope = data.get('scope')
+    vd_scale = data.get('vd_scale')
+    return RigProfile(
+        name=name,
+        address=int(data['address'], 16),
+        baudrate=data.get('baudrate') or DEFAULT_BAUDRATE,
+        freq_bytes=data.get('freq_bytes', DEFAULT_FREQ_BYTES),
+        commands=frozenset(data.get('commands', ())),
+        scope=ScopeGeometry(**scope) if scope else None,
+        vd_scale=tuple(tuple(p) for p in vd_scale) if vd_scale else None,
+    )
+
+
+def load(path=RIG_FILE):
+    ''' load profiles from json file and register them
+        Returns:
+            list of loaded RigProfile
+    '''
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    loaded = [profile_from_dict(name, entry) for name, entry in data['rigs'].items()]
+    for profile in loaded:
+        register(profile)
+    logger.debug(f'{len(loaded)} rig profiles loaded from {path}')
+    return loaded
+
+
+def register(profile):
+    ''' add or replace a profile '''
+    _profiles[profile.name] = profile
+
+
+def profiles():
+    ''' returns dict, rig part name -> RigProfile '''
+    global _is_loaded  # pylint: disable=global-statement
+    if not _is_loaded:
+        _is_loaded = True
+        load()
+    return _profiles
+
+
+def get(rig_pn):
+    ''' returns RigProfile of rig_pn, raises KeyError if unknown '''
+    return profiles()[rig_pn]
+
+
+def find_by_address(address):
+    ''' returns RigProfile with the default CI-V address, None if unknown '''
+    for profile in profiles().values():
+        if profile.address == address:
+            return profile
+    return None
+
+
+def scale_vd(level, vd_scale=None):
+    ''' Vd meter level 0-255 to V, piecewise linear between vd_scale points '''
+    points = vd_scale or DEFAULT_VD_SCALE
+    if level <= points[0][0]:
+        return points[0][1]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if level <= x1:
+            return y0 + (y1 - y0) * (level - x0) / (x1 - x0)
+    # above the last point, extend the last segment
+    (x0, y0), (x1, y1) = points[-2], points[-1]
+    return y0 + (y1 - y0) * (level - x0) / (x1 - x0)
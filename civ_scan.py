@@ -0,0 +1,78 @@
+''' channel / band scanner with S-meter sampling
+    set frequency, wait settle time, read S-meter, for each step
+        for result in civ_scan.scan_range(rig, 7_000_000, 7_200_000, 2_000):
+            print(result.freq, result.level)
+    S-meter read of the current step and set frequency of the next step are sent
+    back to back, one round trip per step
+'''
+from collections import namedtuple
+from logging import getLogger
+import time
+
+import civ
+import civ_codec
+
+logger = getLogger(__name__)
+
+# sec from OK of set frequency to S-meter read
+DEFAULT_SETTLE = 0.02
+
+# ScanResult: freq in Hz, level S-meter 0-255 (-1 if read or set frequency failed),
+#             timestamp time.time()
+ScanResult = namedtuple('ScanResult', ['freq', 'level', 'timestamp'])
+
+
+def frange(start, stop, step):
+    ''' frequencies from start to stop (inclusive) by step, in Hz '''
+    if step <= 0:
+        raise ValueError(f'step must be positive: {step}')
+    return range(int(start), int(stop) + 1, int(step))
+
+
+def scan(rig, freqs, settle=DEFAULT_SETTLE, restore=True):
+    ''' scan frequencies and read S-meter
+        Args:
+            rig: civ.CIV
+            freqs: iterable of frequencies in Hz
+            settle: minimum sec between frequency change and S-meter read
+            restore: set the frequency before scan back at the end
+        Yields:
+            ScanResult
+    '''
+    freqs = iter(freqs)
+    freq = next(freqs, None)
+    if freq is None:
+        return
+    smeter_msg = bytes(civ.PREA + rig.addr_rig + civ.ADHOST + civ.cmd_read_Smeter + civ.POSA)
+    freq0 = rig.read_freq() if restore else 0
+    try:
+        # False if the rig did not take the frequency, its S-meter is for another one
+        is_set = rig.set_freq(freq)
+        set_time = time.monotonic()
+        while freq is not None:
+            next_freq = next(freqs, None)
+            remain = settle - (time.monotonic() - set_time)
+            if remain > 0:
+                time.sleep(remain)
+            msgs = [smeter_msg]
+            if next_freq is not None:
+                msgs.append(rig.set_freq_msg(next_freq))
+            frames = rig.send_many(msgs)
+            set_time = time.monotonic()
+            level = rig.parse_smeter(frames[0], rig.profile) if is_set else -1
+            if next_freq is not None:
+                is_set = frames[1] is not None and frames[1].cmd == civ_codec.OK
+                if not is_set:
+                    logger.error(f'set frequency failed: {next_freq:,} Hz')
+            yield ScanResult(freq, level, time.time())
+            freq = next_freq
+    finally:
+        if freq0:
+            rig.set_freq(freq0)
+        elif rig.state is not None:
+            rig.state.invalidate('freq')
+
+
+def scan_range(rig, start, stop, step, settle=DEFAULT_SETTLE, restore=True):
+    ''' scan from start to stop (inclusive) by step in Hz, see scan() '''
+    return scan(rig, frange(start, stop, step), settle, restore)
@@ -0,0 +1,150 @@
+''' spectrum scope waveform assembly
+    scope data (cmd 0x27 0x00) arrives in 11 division frames per sweep,
+    divisions are written into a preallocated numpy.uint8 array
+'''
+from collections import namedtuple
+import time
+
+import numpy as np
+
+import civ_codec
+import civ_rigs
+
+SCOPE_DATA_LENGTH = civ_rigs.DEFAULT_SCOPE.points
+
+# Sweep: data numpy.uint8 array, amplitude 0-160
+#        center_freq, span in Hz
+#        seq sweep sequence number, counts up from 0
+#        timestamp time.time() when the sweep was completed
+Sweep = namedtuple('Sweep', ['data', 'center_freq', 'span', 'seq', 'timestamp'])
+
+
+def bin_freqs(center_freq, span, points=SCOPE_DATA_LENGTH):
+    ''' frequency in Hz of each scope bin, center_freq +- span '''
+    return np.linspace(center_freq - span, center_freq + span, points)
+
+
+class SweepAssembler():
+    ''' assemble scope division frames into sweeps
+        Args:
+            length: number of points in a sweep
+            copy: if False, Sweep.data is the internal buffer,
+                  valid until the next sweep is completed
+    '''
+    def __init__(self, length=SCOPE_DATA_LENGTH, copy=True) -> None:
+        self.length = length
+        self.copy = copy
+        self.buf = np.zeros(length, dtype=np.uint8)
+        self.pos = 0
+        self.division = 0
+        self.center_freq = 0
+        self.span = 0
+        self.seq = 0
+        self.dropped = 0
+        self.is_started = False
+
+    def feed(self, payload):
+        ''' feed payload of one scope data frame, after cmd 0x27 0x00
+            1st: 00 [seq=01] [max=11] [mode] [center freq x5] [span x5] [out of range]
+            2-11: 00 [seq] [max=11] [data x50, 25 in last frame]
+            Returns:
+                Sweep when completed, else None
+        '''
+        if len(payload) < 4:
+            return None
+        division = payload[1]
+        if division == 0x01:
+            if self.is_started:
+                self.dropped += 1
+            try:
+                self.center_freq = civ_codec.decode_freq(payload[4:9])
+                self.span = civ_codec.decode_span(payload[9:14])
+            except ValueError:
+                self.is_started = False
+                self.dropped += 1
+                return None
+            self.pos = 0
+            self.division = 1
+            self.is_started = True
+            return None
+
+        if not self.is_started:
+            return None
+        try:
+            division = civ_codec.decode_bcd(payload[1:2])
+            division_max = civ_codec.decode_bcd(payload[2:3])
+        except ValueError:
+            division = -1
+            division_max = 0
+        end = self.pos + len(payload) - 3
+        if division != self.division + 1 or end > self.length:
+            # lost division frame
+            self.is_started = False
+            self.dropped += 1
+            return None
+
+        self.buf[self.pos:end] = np.frombuffer(payload, dtype=np.uint8, offset=3)
+        self.pos = end
+        self.division = division
+        if division < division_max:
+            return None
+
+        self.is_started = False
+        if self.pos != self.length:
+            self.dropped += 1
+            return None
+        data = self.buf.copy() if self.copy else self.buf
+        sweep = Sweep(data, self.center_freq, self.span, self.seq, time.time())
+        self.seq += 1
+        return sweep
+
+
+class SweepRing():
+    ''' fixed-size ring buffer of sweeps for waterfall / spectrogram
+        each sweep is written twice, at index and index + depth,
+        so view() returns the history in time order without copying.
+        views are live, a reader holding one across push() sees rows
+        overwritten in place, compare pushed before and after or copy the view
+        Args:
+            depth: number of sweeps kept, memory is 2 * depth * points bytes
+            points: number of points in a sweep
+    '''
+    def __init__(self, depth, points=SCOPE_DATA_LENGTH) -> None:
+        self.depth = depth
+        self.points = points
+        self.buf = np.zeros((2 * depth, points), dtype=np.uint8)
+        self.index = 0
+        self.count = 0
+        # sweeps pushed since clear(), including overwritten ones
+        self.pushed = 0
+
+    @property
+    def dropped(self):
+        ''' sweeps overwritten since clear() '''
+        return self.pushed - self.count
+
+    def push(self, data):
+        ''' add one sweep, the oldest one is overwritten when full '''
+        self.buf[self.index] = data
+        self.buf[self.index + self.depth] = data
+        self.index = (self.index + 1) % self.depth
+        self.count = min(self.count + 1, self.depth)
+        self.pushed += 1
+
+    def view(self):
+        ''' (depth, points) view, oldest sweep first, newest last
+            rows not written yet are zero
+        '''
+        return self.buf[self.index:self.index + self.depth]
+
+    def latest(self, num=1):
+        ''' view of the newest num sweeps, oldest first '''
+        num = min(num, self.count)
+        return self.buf[self.index + self.depth - num:self.index + self.depth]
+
+    def clear(self):
+        ''' discard history '''
+        self.buf[:] = 0
+        self.index = 0
+        self.count = 0
+        self.pushed = 0
@@ -0,0 +1,340 @@
+''' network rig server, many TCP clients share one CI-V link
+    the server owns the serial port, reads are answered from the state cache
+    (kept fresh by transceive broadcast and TTL), writes are serialized
+    and scope sweeps are sent to subscribed clients
+
+    protocol: one command per line, a subset of hamlib rigctld
+        f, get_freq              -> frequency in Hz
+        F, set_freq <Hz>         -> RPRT 0
+        m, get_mode              -> mode, passband (0: not known)
+        l, get_level STRENGTH    -> S-meter in dB relative to S9
+        t, get_ptt               -> 0
+        v, get_vfo               -> VFOA
+        s, get_split_vfo         -> 0, VFOA
+        \\chk_vfo                -> 0
+        \\dump_state             -> rig capabilities, read by hamlib NET rigctl (model 2)
+                                   when it opens, ex) WSJT-X with rig 'Hamlib NET rigctl'
+        q                        -> close connection
+        long names need a leading backslash, ex) \\get_freq
+    extensions
+        \\get_vd                 -> Vd in V
+        \\subscribe_scope        -> stream of sweeps until the client disconnects,
+                                   one line per sweep: SWEEP <time.time()> <center Hz>
+                                   <span Hz> <data in hex>
+    errors are RPRT -<hamlib error code>
+
+    python civ_server.py COM5 --rig IC-7300 --tcp-port 4532
+'''
+import argparse
+from logging import getLogger
+import queue
+import socketserver
+import threading
+
+import civ
+
+logger = getLogger(__name__)
+
+# rigctld default port
+DEFAULT_PORT = 4532
+# sweeps buffered per subscriber, the oldest is dropped when full
+SCOPE_QUEUE_SIZE = 8
+
+# hamlib error codes
+RIG_OK = 0
+RIG_EINVAL = 1
+RIG_ENIMPL = 4
+RIG_ETIMEOUT = 5
+RIG_ERJCTED = 9
+
+# short and long command names -> (RigServer method name, number of arguments)
+COMMANDS = {
+    'f': ('get_freq', 0), '\\get_freq': ('get_freq', 0),
+    'F': ('set_freq', 1), '\\set_freq': ('set_freq', 1),
+    'm': ('get_mode', 0), '\\get_mode': ('get_mode', 0),
+    'l': ('get_level', 1), '\\get_level': ('get_level', 1),
+    't': ('get_ptt', 0), '\\get_ptt': ('get_ptt', 0),
+    'v': ('get_vfo', 0), '\\get_vfo': ('get_vfo', 0),
+    's': ('get_split_vfo', 0), '\\get_split_vfo': ('get_split_vfo', 0),
+    '\\chk_vfo': ('chk_vfo', 0),
+    '\\dump_state': ('dump_state', 0),
+    '\\get_vd': ('get_vd', 0),
+}
+
+# \\dump_state reply, rigctld protocol version 0 as read by hamlib netrigctl_open():
+# protocol version, rig model (2: NET rigctl), ITU region,
+# rx ranges and tx ranges (start, end, modes, low/high power, vfo, antenna),
+# each terminated by 0 0 0 0 0 0 0, tuning steps and filters (modes, Hz) terminated by 0 0,
+# max RIT, max XIT, max IF shift, announces, preamps, attenuators,
+# has get/set func, get/set level, get/set parm bit masks
+DUMP_STATE = (
+    '0', '2', '2',
+    '30000.000000 470000000.000000 0x1ff -1 -1 0x3 0x1',
+    '0 0 0 0 0 0 0',
+    '0 0 0 0 0 0 0',
+    '0x1ff 1',
+    '0 0',
+    '0x1ff 0',
+    '0 0',
+    '0', '0', '0', '0',
+    '', '',
+    '0x0', '0x0', '0x40000000', '0x0', '0x0', '0x0',
+)
+
+# civ.OPMODE_STR -> rigctld mode name
+MODE_NAMES = {'CW-R': 'CWR', 'RTTY-R': 'RTTYR'}
+
+
+def smeter_db(level):
+    ''' S-meter level 0-255 to dB relative to S9, 0: S0 (-54 dB), 120: S9, 241: S9+60 dB '''
+    if level <= 120:
+        return round(level * 54 / 120) - 54
+    return round((level - 120) * 60 / 121)
+
+
+class RigError(Exception):
+    ''' command failed, code is hamlib error code '''
+    def __init__(self, code, message='') -> None:
+        super().__init__(message)
+        self.code = code
+
+
+def put_latest(q, item):
+    ''' put item to queue, the oldest item is dropped if full '''
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    ''' thread per client, rig_server is set by RigServer '''
+    allow_reuse_address = True
+    daemon_threads = True
+    rig_server = None
+
+
+class ClientHandler(socketserver.StreamRequestHandler):
+    ''' one client connection, runs in its own thread '''
+    def handle(self):
+        rig_server = self.server.rig_server
+        peer = f'{self.client_address[0]}:{self.client_address[1]}'
+        logger.info(f'client connected: {peer}')
+        try:
+            for line in self.rfile:
+                args = line.decode('ascii', 'replace').split()
+                if not args:
+                    continue
+                if args[0] == 'q':
+                    break
+                if args[0] == '\\subscribe_scope':
+                    rig_server.stream_scope(self.wfile)
+                    break
+                self.wfile.write(rig_server.execute(args).encode('ascii'))
+        except (ConnectionError, OSError) as e:
+            logger.info(f'client error: {peer} {e}')
+        logger.info(f'client disconnected: {peer}')
+
+
+class RigServer():
+    ''' TCP server in front of one rig
+        Args:
+            rig: civ.CIV, the reader thread and the state cache are started here
+            host: address to listen, '0.0.0.0' for LAN
+            port: TCP port
+    '''
+    def __init__(self, rig, host='127.0.0.1', port=DEFAULT_PORT) -> None:
+        self.rig = rig
+        rig.start_reader()
+        rig.enable_state_cache()
+        # set commands from clients go to the rig one at a time
+        self.write_lock = threading.Lock()
+
+        # scope fan out, see stream_scope()
+        self.subscribers = []
+        self.scope_lock = threading.Lock()
+        self.scope_thread = None
+
+        self.tcp = TCPServer((host, port), ClientHandler)
+        self.tcp.rig_server = self
+        self.address = self.tcp.server_address
+        self.thread = None
+
+    def start(self):
+        ''' serve in background thread '''
+        logger.info(f'rig server listening on {self.address[0]}:{self.address[1]}')
+        self.thread = threading.Thread(target=self.tcp.serve_forever, name='civ-server',
+                                       daemon=True)
+        self.thread.start()
+
+    def serve_forever(self):
+        ''' serve in this thread until stop() '''
+        logger.info(f'rig server listening on {self.address[0]}:{self.address[1]}')
+        self.tcp.serve_forever()
+
+    def stop(self):
+        ''' stop serving and close the listening socket, the rig is not closed '''
+        self.tcp.shutdown()
+        self.tcp.server_close()
+        with self.scope_lock:
+            subscribers = self.subscribers
+            self.subscribers = []
+        for q in subscribers:
+            # ends stream_scope() of the client
+            put_latest(q, None)
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def execute(self, args):
+        ''' run one command line split into args, returns reply text '''
+        command = COMMANDS.get(args[0])
+        if command is None:
+            return f'RPRT -{RIG_ENIMPL}\n'
+        name, nargs = command
+        if len(args) - 1 != nargs:
+            return f'RPRT -{RIG_EINVAL}\n'
+        try:
+            values = getattr(self, name)(*args[1:])
+        except RigError as e:
+            return f'RPRT -{e.code}\n'
+        if values is None:
+            return f'RPRT {RIG_OK}\n'
+        return ''.join(f'{value}\n' for value in values)
+
+    # commands, return list of reply values, None for RPRT 0, raise RigError on failure
+
+    def get_freq(self):
+        freq = self.rig.read_freq()
+        if freq == 0:
+            raise RigError(RIG_ETIMEOUT)
+        return [freq]
+
+    def set_freq(self, freq):
+        try:
+            freq = int(float(freq))
+        except ValueError as e:
+            raise RigError(RIG_EINVAL) from e
+        with self.write_lock:
+            if not self.rig.set_freq(freq):
+                raise RigError(RIG_ERJCTED)
+
+    def get_mode(self):
+        mode = self.rig.read_opmode()
+        if mode == 'N/A':
+            raise RigError(RIG_ETIMEOUT)
+        return [MODE_NAMES.get(mode, mode), 0]
+
+    def get_level(self, level):
+        if level != 'STRENGTH':
+            raise RigError(RIG_ENIMPL)
+        value = self.rig.read_smeter()
+        if value < 0:
+            raise RigError(RIG_ETIMEOUT)
+        return [smeter_db(value)]
+
+    def get_ptt(self):
+        return [0]
+
+    def get_vfo(self):
+        return ['VFOA']
+
+    def get_split_vfo(self):
+        return [0, 'VFOA']
+
+    def chk_vfo(self):
+        return [0]
+
+    def dump_state(self):
+        return list(DUMP_STATE)
+
+    def get_vd(self):
+        vd = self.rig.read_vd()
+        if vd == 0:
+            raise RigError(RIG_ETIMEOUT)
+        return [f'{vd:.2f}']
+
+    # scope fan out
+
+    def stream_scope(self, wfile):
+        ''' send sweeps to one client until it disconnects, called from its handler thread '''
+        q = queue.Queue(SCOPE_QUEUE_SIZE)
+        with self.scope_lock:
+            self.subscribers = self.subscribers + [q]
+            if self.scope_thread is None:
+                self.start_scope()
+        try:
+            while True:
+                line = q.get()
+                if line is None:
+                    return
+                wfile.write(line)
+        finally:
+            with self.scope_lock:
+                self.subscribers = [s for s in self.subscribers if s is not q]
+
+    def start_scope(self):
+        ''' start scope thread, scope_lock is held by caller '''
+        self.scope_thread = threading.Thread(target=self.scope_loop, name='civ-scope',
+                                             daemon=True)
+        self.scope_thread.start()
+
+    def scope_loop(self):
+        ''' read sweeps while any client is subscribed, each line is formatted once '''
+        sweeps = self.rig.iter_spectrum(copy=False)
+        is_idle = False
+        try:
+            for sweep in sweeps:
+                line = (f'SWEEP {sweep.timestamp:.3f} {sweep.center_freq} {sweep.span} '
+                        f'{sweep.data.tobytes().hex()}\n').encode('ascii')
+                with self.scope_lock:
+                    subscribers = self.subscribers
+                if not subscribers:
+                    is_idle = True
+                    break
+                for q in subscribers:
+                    # slow client loses its oldest sweep
+                    put_latest(q, line)
+        finally:
+            # readout off before the thread slot is released,
+            # a stream started by a new subscriber is not turned off by this one
+            sweeps.close()
+            with self.scope_lock:
+                self.scope_thread = None
+                if is_idle and self.subscribers:
+                    # subscribed while the stream was closed
+                    self.start_scope()
+
+
+def main():
+    ''' run server, python civ_server.py COM5 --rig IC-7300 '''
+    parser = argparse.ArgumentParser(description='CI-V rig server')
+    parser.add_argument('port', help='serial port, ex) COM5, or sim for civ_sim.SimulatedRig')
+    parser.add_argument('--rig', default='IC-7300', help='rig name in rigs.json')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen')
+    parser.add_argument('--tcp-port', type=int, default=DEFAULT_PORT, help='TCP port')
+    args = parser.parse_args()
+
+    civ.setup_logging(log_dir='./Log')
+    if args.port == 'sim':
+        import civ_sim  # pylint: disable=import-outside-toplevel
+        rig = civ.CIV('sim', args.rig, ser=civ_sim.SimulatedRig(args.rig))
+    else:
+        rig = civ.CIV(args.port, args.rig)
+    server = RigServer(rig, args.host, args.tcp_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.tcp.server_close()
+        rig.stop_reader()
+
+
+if __name__ == '__main__':
+    main()
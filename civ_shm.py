@@ -0,0 +1,233 @@
+''' shared memory fan-out of scope sweeps to local processes
+    one publisher writes sweeps to a ring in multiprocessing.shared_memory,
+    any number of readers attach by name and read numpy views without copy
+        publisher = SweepPublisher('civ_scope')
+        publisher.run(rig)                      # or publisher.write(sweep)
+    other process
+        reader = SweepReader('civ_scope')
+        for sweep in reader.iter_sweeps():
+            ...
+    the writer never waits for readers, a reader too slow to keep up skips
+    the overwritten sweeps and counts them in overruns
+
+    memory layout: HEADER_DTYPE, SLOT_DTYPE * slots, uint8 * points * slots
+    each slot is guarded by a sequence lock, slot begin/end hold sweep number + 1,
+    begin is written before the data and end after, so begin == end == n + 1
+    means slot has sweep n and is not being written
+'''
+from logging import getLogger
+from multiprocessing import shared_memory, resource_tracker
+import os
+import time
+import weakref
+
+import numpy as np
+
+from civ_scope import SCOPE_DATA_LENGTH, Sweep
+
+logger = getLogger(__name__)
+
+SHM_MAGIC = b'CIVSHM\r\n'
+DEFAULT_SLOTS = 64
+# sec between checks of iter_sweeps() when no new sweep
+POLL_INTERVAL = 0.005
+
+# seq: number of sweeps written
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('slots', '<u4'), ('points', '<u4'),
+                         ('seq', '<u8')])
+# begin, end: sweep number + 1, 0 if empty
+SLOT_DTYPE = np.dtype([('begin', '<u8'), ('end', '<u8'), ('center_freq', '<u8'),
+                       ('span', '<u8'), ('timestamp', '<f8')])
+
+# names created by SweepPublisher in this process (and its forked children),
+# registered to the resource tracker shared with the readers here
+_published = set()
+
+
+def shm_size(slots, points):
+    ''' bytes of shared memory for slots sweeps of points '''
+    return HEADER_DTYPE.itemsize + SLOT_DTYPE.itemsize * slots + slots * points
+
+
+def ring_views(buf, slots, points):
+    ''' (header, slot metadata, data) numpy views of shared memory buffer '''
+    header = np.ndarray((), HEADER_DTYPE, buf)
+    meta = np.ndarray((slots,), SLOT_DTYPE, buf, HEADER_DTYPE.itemsize)
+    data = np.ndarray((slots, points), np.uint8, buf,
+                      HEADER_DTYPE.itemsize + SLOT_DTYPE.itemsize * slots)
+    return header, meta, data
+
+
+class SweepPublisher():
+    ''' writer of the shared memory ring, creates it
+        Args:
+            name: shared memory name, None for a random name, see self.name
+            slots: sweeps kept in the ring
+            points: points in a sweep
+    '''
+    def __init__(self, name=None, slots=DEFAULT_SLOTS, points=SCOPE_DATA_LENGTH) -> None:
+        self.shm = shared_memory.SharedMemory(name, create=True,
+                                              size=shm_size(slots, points))
+        self.name = self.shm.name
+        _published.add(self.name)
+        self.slots = slots
+        self.points = points
+        self.header, self.meta, self.data = ring_views(self.shm.buf, slots, points)
+        self.meta[:] = 0
+        self.header['magic'] = SHM_MAGIC
+        self.header['slots'] = slots
+        self.header['points'] = points
+        self.header['seq'] = 0
+        self.seq = 0
+        logger.info(f'scope shared memory: {self.name}, {slots} slots')
+
+    def write(self, sweep):
+        ''' write one civ_scope.Sweep, never blocks '''
+        self.publish(sweep.data, sweep.center_freq, sweep.span, sweep.timestamp)
+
+    def publish(self, data, center_freq, span, timestamp=None):
+        ''' write one sweep, ex) result of CIV.read_spectrum() '''
+        slot = self.meta[self.seq % self.slots]
+        mark = self.seq + 1
+        slot['begin'] = mark
+        self.data[self.seq % self.slots] = data
+        slot['center_freq'] = center_freq
+        slot['span'] = span
+        slot['timestamp'] = time.time() if timestamp is None else timestamp
+        slot['end'] = mark
+        self.seq = mark
+        self.header['seq'] = mark
+
+    def run(self, rig):
+        ''' publish sweeps of rig.iter_spectrum() until interrupted '''
+        sweeps = rig.iter_spectrum(copy=False)
+        try:
+            for sweep in sweeps:
+                self.write(sweep)
+        finally:
+            sweeps.close()
+
+    def close(self, unlink=True):
+        ''' detach, and remove the shared memory if unlink '''
+        del self.header, self.meta, self.data
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+            _published.discard(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SweepReader():
+    ''' reader of the shared memory ring, attaches by name
+        Args:
+            name: shared memory name of SweepPublisher
+            latest: start from the newest sweep, False to start from the oldest in the ring
+    '''
+    def __init__(self, name, latest=True) -> None:
+        # the publisher owns the memory, do not let this process remove it at exit
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            # before python 3.13
+            self.shm = shared_memory.SharedMemory(name)
+            if os.name == 'posix' and name not in _published:
+                resource_tracker.unregister(self.shm._name,  # pylint: disable=protected-access
+                                            'shared_memory')
+        header = np.ndarray((), HEADER_DTYPE, self.shm.buf)
+        if header['magic'] != SHM_MAGIC:
+            self.shm.close()
+            raise ValueError(f'not a scope shared memory: {name}')
+        self.name = name
+        self.slots = int(header['slots'])
+        self.points = int(header['points'])
+        del header
+        self.header, self.meta, self.data = ring_views(self.shm.buf, self.slots, self.points)
+        # sweeps read with copy=False are views of self.data and may outlive close(),
+        # the memory is unmapped when the last of them is gone
+        self.finalizer = weakref.finalize(self.data, self.shm.close)
+        written = self.written
+        # next sweep number to read
+        self.next_seq = max(written - 1, 0) if latest else max(written - self.slots + 1, 0)
+        # sweeps overwritten before they were read
+        self.overruns = 0
+
+    @property
+    def written(self):
+        ''' number of sweeps written by the publisher '''
+        return int(self.header['seq'])
+
+    def get(self, n):
+        ''' sweep number n as Sweep with data viewing the shared memory
+            None if not written yet or already overwritten
+            check is_valid(n) after using the data, the writer may overwrite it meanwhile
+        '''
+        slot = self.meta[n % self.slots]
+        mark = n + 1
+        if slot['end'] != mark or slot['begin'] != mark:
+            return None
+        sweep = Sweep(self.data[n % self.slots], int(slot['center_freq']), int(slot['span']),
+                      n, float(slot['timestamp']))
+        if slot['begin'] != mark:
+            # overwritten while metadata was read
+            return None
+        return sweep
+
+    def is_valid(self, n):
+        ''' True if sweep number n is still in its slot '''
+        return self.meta['begin'][n % self.slots] == n + 1
+
+    def read_new(self, copy=False):
+        ''' sweeps written since the last call, oldest first
+            sweeps overwritten before this call are skipped and counted in overruns
+            Args:
+                copy: copy data out of the shared memory, safe to keep
+            Returns:
+                list of civ_scope.Sweep
+        '''
+        written = self.written
+        # the slot after the newest may be being written
+        oldest = written - self.slots + 1
+        if self.next_seq < oldest:
+            self.overruns += oldest - self.next_seq
+            self.next_seq = oldest
+        sweeps = []
+        for n in range(self.next_seq, written):
+            sweep = self.get(n)
+            if sweep is not None and copy:
+                sweep = sweep._replace(data=sweep.data.copy())
+                if not self.is_valid(n):
+                    sweep = None
+            if sweep is None:
+                self.overruns += 1
+            else:
+                sweeps.append(sweep)
+        self.next_seq = written
+        return sweeps
+
+    def iter_sweeps(self, copy=True, poll_interval=POLL_INTERVAL):
+        ''' yield sweeps as they are published, polls the sequence counter
+            Yields:
+                civ_scope.Sweep
+        '''
+        while True:
+            sweeps = self.read_new(copy)
+            if not sweeps:
+                time.sleep(poll_interval)
+            yield from sweeps
+
+    def close(self):
+        ''' detach, the shared memory stays for the publisher and other readers
+            sweeps read with copy=False stay valid, the mapping is released after them
+        '''
+        del self.header, self.meta, self.data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,313 @@
+''' loopback rig simulator for hardware-free test and benchmark
+    SimulatedRig is a serial.Serial compatible object, pass it to CIV as ser
+        rig = civ.CIV('sim', 'IC-7300', ser=civ_sim.SimulatedRig('IC-7300'))
+    answers cmd 0x03/0x04/0x05/0x06/0x15/0x23/0x27, streams scope frames,
+    and can inject echo, collision, line noise and latency
+'''
+from datetime import datetime, timezone
+import heapq
+from logging import getLogger
+import random
+import threading
+import time
+
+import numpy as np
+import serial
+
+import civ_codec
+import civ_rigs
+
+logger = getLogger(__name__)
+
+MODE_FILTER = 0x01
+# scope amplitude range
+SCOPE_MAX = 160
+
+
+class SimulatedRig():
+    ''' simulated i-com rig behind a serial port
+        Args:
+            rig_pn: rig name in rigs.json
+            freq: initial frequency in Hz
+            opmode: initial operating mode number, 0x01 USB
+            echo: write back received frames, as single wire CI-V bus
+            latency: reply delay in sec
+            scope_rate: scope sweeps per sec while readout is on
+            collision_rate: probability that a received frame collides
+            noise_rate: probability that junk bytes are put before a reply
+            transceive: broadcast frequency/mode changes (cmd 0x00/0x01)
+            timeout: read timeout in sec, same as serial.Serial
+            seed: random seed
+    '''
+    def __init__(self, rig_pn='IC-7300', freq=14_074_000, opmode=0x01, echo=True,
+                 latency=0.0, scope_rate=30.0, collision_rate=0.0, noise_rate=0.0,
+                 transceive=True, timeout=2, seed=None) -> None:
+        profile = civ_rigs.get(rig_pn)
+        self.name = f'sim://{rig_pn}'
+        self.addr = profile.address
+        self.baudrate = profile.baudrate
+        self.freq_bytes = profile.freq_bytes
+        if profile.scope is not None:
+            self.scope = profile.scope
+        else:
+            self.scope = civ_rigs.DEFAULT_SCOPE
+
+        self.freq = freq
+        self.opmode = opmode
+        self.vd_level = 120
+        self.smeter_level = 40
+        self.span = 25000
+        self.is_scope_on = True
+        self.is_readout_on = False
+
+        self.echo = echo
+        self.latency = latency
+        self.scope_rate = scope_rate
+        self.collision_rate = collision_rate
+        self.noise_rate = noise_rate
+        self.transceive = transceive
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.np_random = np.random.default_rng(seed)
+
+        self.is_open = True
+        # see unplug()
+        self.is_unplugged = False
+        self.parser = civ_codec.FrameParser()
+        self.buf = bytearray()
+        self.cv = threading.Condition()
+        # (time.monotonic(), order, bytes) delivered by worker thread
+        self.schedule = []
+        self.order = 0
+        self.next_sweep = 0.0
+        self.worker = threading.Thread(target=self.run, name='civ-sim', daemon=True)
+        self.worker.start()
+
+    # serial.Serial compatible interface
+
+    @property
+    def in_waiting(self):
+        ''' bytes ready to read '''
+        self.check_plugged()
+        return len(self.buf)
+
+    def check_plugged(self):
+        ''' raises serial.SerialException after unplug(), as pyserial on device removal '''
+        if self.is_unplugged:
+            raise serial.SerialException(f'{self.name}: device disconnected')
+
+    def read(self, size=1):
+        ''' read up to size bytes, waits timeout for the first byte '''
+        with self.cv:
+            self.cv.wait_for(lambda: self.buf or not self.is_open, self.timeout)
+            self.check_plugged()
+            data = bytes(self.buf[:size])
+            del self.buf[:size]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        ''' read until expected, size bytes or timeout '''
+        self.check_plugged()
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self.cv:
+            while True:
+                idx = self.buf.find(expected)
+                if idx >= 0:
+                    end = idx + len(expected)
+                    break
+                if size is not None and len(self.buf) >= size:
+                    end = size
+                    break
+                remain = deadline - time.monotonic()
+                if remain <= 0 or not self.is_open:
+                    end = len(self.buf)
+                    break
+                self.cv.wait(remain)
+            if size is not None:
+                end = min(end, size)
+            data = bytes(self.buf[:end])
+            del self.buf[:end]
+        return data
+
+    def readline(self):
+        ''' same as serial.Serial.readline() '''
+        return self.read_until(b'\n')
+
+    def write(self, data):
+        ''' receive bytes from host '''
+        self.check_plugged()
+        data = bytes(data)
+        frames = self.parser.feed(data)
+        if self.collision_rate and frames and self.random.random() < self.collision_rate:
+            # frame broken on the bus, host reads jammer in its echo
+            broken = bytearray(data)
+            broken[len(broken) // 2] = civ_codec.JAMMER
+            self.push(bytes(broken))
+            return len(data)
+        if self.echo:
+            self.push(data)
+        for frame in frames:
+            if frame.dst != self.addr:
+                continue
+            reply = self.answer(frame)
+            if reply:
+                self.push(reply, self.latency)
+        return len(data)
+
+    def flush(self):
+        ''' nothing to flush '''
+
+    def reset_input_buffer(self):
+        ''' discard bytes not read yet '''
+        with self.cv:
+            self.buf.clear()
+
+    def close(self):
+        ''' stop worker thread '''
+        with self.cv:
+            self.is_open = False
+            self.cv.notify_all()
+
+    def unplug(self):
+        ''' simulate USB cable pulled, reads and writes raise serial.SerialException '''
+        self.is_unplugged = True
+        self.close()
+
+    # rig side
+
+    def push(self, data, delay=0.0):
+        ''' queue bytes for host, after delay sec '''
+        if self.noise_rate and self.random.random() < self.noise_rate:
+            # junk bytes never contain preamble/postamble
+            data = bytes(self.random.randrange(0x00, 0xF0)
+                         for _ in range(self.random.randint(1, 8))) + data
+        with self.cv:
+            if delay > 0:
+                self.order += 1
+                heapq.heappush(self.schedule, (time.monotonic() + delay, self.order, data))
+            else:
+                self.buf += data
+            self.cv.notify_all()
+
+    def frame(self, cmd, subcmd=None, payload=b'', dst=0x00):
+        ''' frame from this rig '''
+        return civ_codec.encode_frame(dst, cmd, subcmd, payload, src=self.addr)
+
+    def answer(self, frame):
+        ''' returns reply bytes for a request frame, b'' if no reply '''
+        cmd, subcmd, payload = frame.cmd, frame.subcmd, frame.payload
+        ok = self.frame(civ_codec.OK, dst=frame.src)
+        if cmd == 0x03:
+            return self.frame(0x03, payload=civ_codec.encode_freq(self.freq, self.freq_bytes),
+                              dst=frame.src)
+        if cmd == 0x04:
+            return self.frame(0x04, payload=bytes((civ_codec.encode_bcd(self.opmode, 1)[0],
+                                                   MODE_FILTER)), dst=frame.src)
+        if cmd == 0x05 and payload:
+            self.freq = civ_codec.decode_freq(payload)
+            return ok + self.broadcast(0x00, civ_codec.encode_freq(self.freq, self.freq_bytes))
+        if cmd == 0x06 and payload:
+            self.opmode = civ_codec.decode_bcd(payload[:1])
+            return ok + self.broadcast(0x01, payload[:1] + bytes((MODE_FILTER,)))
+        if cmd == 0x15 and subcmd == 0x15:
+            return self.frame(0x15, 0x15, civ_codec.encode_level(self.vd_level), frame.src)
+        if cmd == 0x15 and subcmd == 0x02:
+            level = min(max(self.smeter_level + self.random.randint(-3, 3), 0), 255)
+            return self.frame(0x15, 0x02, civ_codec.encode_level(level), frame.src)
+        if cmd == 0x23 and subcmd == 0x00:
+            return self.frame(0x23, 0x00, self.gps_payload(), frame.src)
+        if cmd == 0x27 and subcmd == 0x10 and payload:
+            self.is_scope_on = payload[0] == 0x01
+            return ok
+        if cmd == 0x27 and subcmd == 0x11 and payload:
+            self.is_readout_on = payload[0] == 0x01
+            with self.cv:
+                self.next_sweep = time.monotonic()
+                self.cv.notify_all()
+            return ok
+        if cmd == 0x27 and subcmd == 0x00:
+            return self.sweep_frames()
+        return self.frame(civ_codec.NG, dst=frame.src)
+
+    def broadcast(self, cmd, payload):
+        ''' transceive frame, b'' if transceive is off '''
+        if not self.transceive:
+            return b''
+        return self.frame(cmd, payload=payload, dst=0x00)
+
+    def gps_payload(self):
+        ''' lat x5, lon x6, alt x4, course x2, speed x3, time x7 '''
+        now = datetime.now(timezone.utc)
+        lat = bytes((0x35, 0x41, 0x23, 0x40, 0x01))
+        lon = bytes((0x01, 0x39, 0x45, 0x67, 0x80, 0x01))
+        alt = bytes((0x00, 0x00, 0x40, 0x00))
+        course = bytes((0x01, 0x80))
+        speed = bytes((0x00, 0x00, 0x00))
+        utc = civ_codec.encode_bcd(int(f'{now:%Y%m%d%H%M%S}'), 7)
+        return lat + lon + alt + course + speed + utc
+
+    def sweep_data(self):
+        ''' waveform of one sweep, noise floor and a few carriers '''
+        points = self.scope.points
+        data = self.np_random.normal(25, 4, points)
+        bins = np.arange(points)
+        for center, level in ((points * 0.3, 90), (points * 0.55, 120), (points * 0.8, 70)):
+            data += level * np.exp(-0.5 * ((bins - center) / 2.5) ** 2)
+        return np.clip(data, 0, SCOPE_MAX).astype(np.uint8).tobytes()
+
+    def sweep_frames(self):
+        ''' scope data frames of one sweep, cmd 0x27 0x00 '''
+        divisions = self.scope.divisions
+        div_max = civ_codec.encode_bcd(divisions, 1)[0]
+        first = (bytes((0x00, 0x01, div_max, 0x00))
+                 + civ_codec.encode_freq(self.freq, 5)
+                 + civ_codec.encode_span(self.span)
+                 + b'\x00')
+        out = [self.frame(0x27, 0x00, first)]
+        data = self.sweep_data()
+        size = self.scope.division_bytes
+        for i in range(divisions - 1):
+            chunk = data[i * size:(i + 1) * size]
+            head = bytes((0x00, civ_codec.encode_bcd(i + 2, 1)[0], div_max))
+            out.append(self.frame(0x27, 0x00, head + chunk))
+        return b''.join(out)
+
+    def run(self):
+        ''' worker thread, delivers delayed replies and streams scope frames '''
+        while True:
+            with self.cv:
+                if not self.is_open:
+                    return
+                now = time.monotonic()
+                while self.schedule and self.schedule[0][0] <= now:
+                    self.buf += heapq.heappop(self.schedule)[2]
+                    self.cv.notify_all()
+                is_streaming = self.is_readout_on and self.is_scope_on and self.scope_rate > 0
+                wake = [self.schedule[0][0]] if self.schedule else []
+                if is_streaming:
+                    wake.append(self.next_sweep)
+                if not is_streaming or now < self.next_sweep:
+                    self.cv.wait(max(min(wake) - now, 0) if wake else None)
+                    continue
+                self.next_sweep = max(self.next_sweep + 1 / self.scope_rate, now)
+            self.push(self.sweep_frames())
+
+
+def main():
+    ''' read out simulated IC-7300 '''
+    import civ  # pylint: disable=import-outside-toplevel
+
+    civ.setup_logging()
+    rig = civ.CIV('sim', 'IC-7300', ser=SimulatedRig('IC-7300', echo=False))
+    print(f'Frequency: {rig.read_freq():,} Hz')
+    print(rig.read_opmode())
+    print(f'Vd: {rig.read_vd():.3g} V')
+    print(rig.read_gps_position())
+    sweeps = rig.iter_spectrum()
+    for sweep, _ in zip(sweeps, range(3)):
+        print(sweep.seq, sweep.center_freq, sweep.span, sweep.data[:8])
+    sweeps.close()
+
+
+if __name__ == '__main__':
+    main()
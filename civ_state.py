@@ -0,0 +1,63 @@
+''' rig state cache
+    last known values with timestamps and per-field TTL, see CIV.enable_state_cache()
+'''
+import threading
+import time
+
+# default TTL in sec
+DEFAULT_TTL = {
+    'freq': 1.0,
+    'opmode': 1.0,
+    'vd': 5.0,
+    'gps_position': 10.0,
+    'scope': 1.0,
+}
+
+
+class RigState():
+    ''' last known rig values with timestamps
+        Args:
+            ttl: dict, field name -> TTL in sec, merged into DEFAULT_TTL
+                 None TTL never expires (value updated only by transceive broadcast)
+    '''
+    def __init__(self, ttl=None) -> None:
+        self.ttl = dict(DEFAULT_TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        # field name -> (value, time.monotonic())
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def set(self, name, value, timestamp=None):
+        ''' store value '''
+        if timestamp is None:
+            timestamp = time.monotonic()
+        with self.lock:
+            self.entries[name] = (value, timestamp)
+
+    def get(self, name):
+        ''' returns value if fresh, None if stale or unknown '''
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        ttl = self.ttl.get(name)
+        if ttl is not None and time.monotonic() - entry[1] > ttl:
+            return None
+        return entry[0]
+
+    def get_entry(self, name):
+        ''' returns (value, timestamp) even if stale, None if unknown '''
+        return self.entries.get(name)
+
+    def invalidate(self, name=None):
+        ''' drop one field, or all fields if name is None '''
+        with self.lock:
+            if name is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(name, None)
+
+    def snapshot(self):
+        ''' returns dict, field name -> value of all known fields '''
+        with self.lock:
+            return {name: entry[0] for name, entry in self.entries.items()}
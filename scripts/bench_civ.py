@@ -0,0 +1,237 @@
+""" benchmark CI-V protocol hot paths without hardware
+
+    python scripts/bench_civ.py --output bench.json
+    python scripts/bench_civ.py --compare bench.json
+    python scripts/bench_civ.py --replay link.civraw
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+sys.path.append("./")
+
+import civ  # noqa: E402  pylint: disable=wrong-import-position
+import civ_codec  # noqa: E402  pylint: disable=wrong-import-position
+import civ_replay  # noqa: E402  pylint: disable=wrong-import-position
+import civ_sim  # noqa: E402  pylint: disable=wrong-import-position
+from civ_scope import SweepAssembler  # noqa: E402  pylint: disable=wrong-import-position
+
+# slowdown ratio reported by --compare
+SLOWDOWN_LIMIT = 1.2
+
+
+def _measure(func, count, repeat=5):
+    """
+        Run func(count) repeat times.
+        Returns the best time per item in sec.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(count)
+        best = min(best, time.perf_counter() - start)
+    return best / count
+
+
+def _result(name, sec_per_item, unit):
+    """
+        Benchmark result entry.
+    """
+    return {
+        'name': name,
+        'unit': unit,
+        'us_per_item': sec_per_item * 1e6,
+        'items_per_sec': 1 / sec_per_item,
+    }
+
+
+def _sweep_stream(sim, count):
+    """
+        Byte stream of count scope sweeps from the simulator.
+    """
+    return b''.join(sim.sweep_frames() for _ in range(count))
+
+
+def bench_parse(sim):
+    """
+        FrameParser.feed() on a scope byte stream, fed in 64 byte chunks.
+    """
+    stream = _sweep_stream(sim, 20)
+    num_frames = len(civ_codec.FrameParser().feed(stream))
+    chunks = [stream[i:i + 64] for i in range(0, len(stream), 64)]
+
+    def run(count):
+        for _ in range(count // num_frames):
+            parser = civ_codec.FrameParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+
+    count = num_frames * 20
+    return _result('frame_parse', _measure(run, count), 'frame')
+
+
+def bench_assemble(sim):
+    """
+        SweepAssembler.feed() per sweep, frames already parsed.
+    """
+    frames = civ_codec.FrameParser().feed(_sweep_stream(sim, 1))
+    payloads = [frame.payload for frame in frames]
+    assembler = SweepAssembler(sim.scope.points, copy=False)
+
+    def run(count):
+        for _ in range(count):
+            for payload in payloads:
+                assembler.feed(payload)
+
+    return _result('sweep_assemble', _measure(run, 2000), 'sweep')
+
+
+def bench_bcd():
+    """
+        BCD frequency/span/level decoding.
+    """
+    freq = civ_codec.encode_freq(14_074_000)
+    span = civ_codec.encode_span(25_000)
+    level = civ_codec.encode_level(120)
+
+    def run(count):
+        for _ in range(count):
+            civ.CIV.decode_freq(freq)
+            civ.CIV.decode_span(span)
+            civ_codec.decode_level(level)
+
+    return _result('bcd_decode', _measure(run, 50000), 'freq+span+level')
+
+
+def bench_encode():
+    """
+        Request frame encoding, list format and civ_codec.encode_frame().
+    """
+    msg_list = civ.PREA + [0x94] + civ.ADHOST + civ.cmd_read_freq + civ.POSA
+
+    def run_list(count):
+        for _ in range(count):
+            bytes(msg_list)
+
+    def run_codec(count):
+        for _ in range(count):
+            civ_codec.encode_frame(0x94, 0x03)
+
+    return [_result('encode_list', _measure(run_list, 100000), 'frame'),
+            _result('encode_frame', _measure(run_codec, 100000), 'frame')]
+
+
+def bench_query():
+    """
+        End-to-end query latency against the simulator, without and with reader thread.
+    """
+    out = []
+    for mode in ('direct', 'reader'):
+        rig = civ.CIV('sim', 'IC-7300', ser=civ_sim.SimulatedRig('IC-7300', scope_rate=0))
+        if mode == 'reader':
+            rig.start_reader()
+
+        def run_freq(count):
+            for _ in range(count):
+                rig.read_freq()
+
+        def run_many(count):
+            for _ in range(count):
+                rig.query_many(['freq', 'opmode', 'vd'])
+
+        out.append(_result(f'read_freq_{mode}', _measure(run_freq, 200, 3), 'query'))
+        out.append(_result(f'query_many_{mode}', _measure(run_many, 200, 3), 'batch of 3'))
+        rig.stop_reader()
+        rig.ser.close()
+    return out
+
+
+def bench_replay(path):
+    """
+        Frame parsing and sweep assembly on received bytes of a raw capture.
+    """
+    chunks = [data for _, direction, data in civ_replay.iter_records(path)
+              if direction == civ_replay.DIR_RX]
+    num_bytes = sum(len(chunk) for chunk in chunks)
+
+    def run(count):
+        for _ in range(count // num_bytes):
+            parser = civ_codec.FrameParser()
+            assembler = SweepAssembler(copy=False)
+            for chunk in chunks:
+                for frame in parser.feed(chunk):
+                    if civ.CIV.is_scope_frame(frame):
+                        assembler.feed(frame.payload)
+
+    return _result('replay_decode', _measure(run, num_bytes * 5, 3), 'byte')
+
+
+def run_all(replay=None):
+    """
+        Run all benchmarks, replay: raw capture file for bench_replay().
+    """
+    sim = civ_sim.SimulatedRig('IC-7300', scope_rate=0, seed=0)
+    results = [bench_parse(sim), bench_assemble(sim), bench_bcd()]
+    results += bench_encode()
+    results += bench_query()
+    if replay:
+        results.append(bench_replay(replay))
+    sim.close()
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(report, base):
+    """
+        Print ratio to base report, returns True if nothing got slower than SLOWDOWN_LIMIT.
+    """
+    base_results = {r['name']: r for r in base['results']}
+    is_ok = True
+    for r in report['results']:
+        b = base_results.get(r['name'])
+        if b is None:
+            continue
+        ratio = r['us_per_item'] / b['us_per_item']
+        mark = ''
+        if ratio > SLOWDOWN_LIMIT:
+            mark = '  <-- slower'
+            is_ok = False
+        print(f"{r['name']:20} {b['us_per_item']:10.2f} -> {r['us_per_item']:10.2f} us"
+              f"  x{ratio:.2f}{mark}")
+    return is_ok
+
+
+def _main(args) -> None:
+    """
+        Run the benchmarks, print, save and compare results.
+    """
+    report = run_all(args.replay)
+    for r in report['results']:
+        print(f"{r['name']:20} {r['us_per_item']:10.2f} us/{r['unit']}"
+              f"  {r['items_per_sec']:12.0f} /s")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            base = json.load(f)
+        if not compare(report, base):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark CI-V protocol hot paths')
+    parser.add_argument('--output', help='save results to json file')
+    parser.add_argument('--compare', help='compare with results in json file')
+    parser.add_argument('--replay', help='also decode received bytes of a raw capture file')
+    _main(parser.parse_args())
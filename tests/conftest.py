@@ -0,0 +1,32 @@
+''' fixtures, every test runs on civ_sim.SimulatedRig, no hardware is needed '''
+import pytest
+
+import civ
+import civ_sim
+
+
+@pytest.fixture
+def make_rig():
+    ''' make_rig(reader=False, rig_pn='IC-7300', **sim_options) returns civ.CIV
+        on a new SimulatedRig, the reader thread and the simulator are stopped after the test
+    '''
+    rigs = []
+
+    def make(reader=False, rig_pn='IC-7300', **sim_options):
+        rig = civ.CIV('sim', rig_pn, ser=civ_sim.SimulatedRig(rig_pn, **sim_options))
+        if reader:
+            rig.start_reader()
+        rigs.append(rig)
+        return rig
+
+    yield make
+    for rig in rigs:
+        # closing first wakes the reader thread blocked in read()
+        rig.ser.close()
+        rig.stop_reader()
+
+
+@pytest.fixture(params=[False, True], ids=['direct', 'reader'])
+def rig(request, make_rig):
+    ''' IC-7300 with echo on, read directly and with the reader thread '''
+    return make_rig(reader=request.param, echo=True)
@@ -0,0 +1,89 @@
+''' civ_async: AsyncCIV on the simulator through a small stream adapter '''
+import asyncio
+
+from civ_async import AsyncCIV
+import civ_sim
+
+
+class SimWriter():
+    ''' asyncio.StreamWriter subset writing to SimulatedRig '''
+    def __init__(self, sim) -> None:
+        self.sim = sim
+
+    def write(self, data):
+        self.sim.write(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.sim.close()
+
+    def is_closing(self):
+        return not self.sim.is_open
+
+
+class SimReader():
+    ''' asyncio.StreamReader subset reading SimulatedRig, returns b'' after close '''
+    def __init__(self, sim) -> None:
+        self.sim = sim
+
+    async def read(self, size):
+        while self.sim.is_open:
+            data = self.sim.read(size)
+            if data:
+                return data
+            await asyncio.sleep(0.005)
+        return b''
+
+
+def open_sim(**sim_options):
+    ''' AsyncCIV on a new SimulatedRig, read() of the simulator does not block '''
+    sim = civ_sim.SimulatedRig('IC-7300', timeout=0, **sim_options)
+    return AsyncCIV(SimReader(sim), SimWriter(sim), 'IC-7300', timeout=0.5), sim
+
+
+def test_read_values():
+    async def main():
+        rig, _ = open_sim(echo=True)
+        async with rig:
+            return await rig.read_freq(), await rig.read_opmode()
+
+    assert asyncio.run(main()) == (14_074_000, 'USB')
+
+
+def test_iter_spectrum():
+    async def main():
+        rig, _ = open_sim()
+        async with rig:
+            sweeps = []
+            async for sweep in rig.iter_spectrum():
+                sweeps.append(sweep)
+                if len(sweeps) == 2:
+                    break
+            return sweeps
+
+    sweeps = asyncio.run(main())
+    assert [sweep.center_freq for sweep in sweeps] == [14_074_000, 14_074_000]
+
+
+def test_reader_ended():
+    async def main():
+        rig, sim = open_sim(latency=0.2)
+        rig.start()
+        pending = asyncio.ensure_future(rig.read_freq())
+        await asyncio.sleep(0.05)
+        # stream closed while the request is pending
+        sim.close()
+        freq = await pending
+        # reader task is done, no wait for the timeout
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        opmode = await rig.read_opmode()
+        elapsed = loop.time() - start
+        await rig.close()
+        return freq, opmode, elapsed
+
+    freq, opmode, elapsed = asyncio.run(main())
+    assert (freq, opmode) == (0, 'N/A')
+    assert elapsed < 0.1
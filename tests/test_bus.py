@@ -0,0 +1,103 @@
+''' civ_bus: CIVBus arbitration on the simulator '''
+import pytest
+
+import civ
+import civ_bus
+import civ_sim
+
+
+class LateEchoRig(civ_sim.SimulatedRig):
+    ''' interface which echoes transmitted bytes after echo_delay sec '''
+    def __init__(self, echo_delay, **options) -> None:
+        super().__init__(echo=False, **options)
+        self.echo_delay = echo_delay
+        self.received = []
+
+    def write(self, data):
+        self.received.append(bytes(data))
+        if self.echo_delay is not None:
+            self.push(bytes(data), self.echo_delay)
+        return super().write(data)
+
+
+@pytest.fixture
+def make_bus():
+    buses = []
+
+    def make(sim, **options):
+        bus = civ_bus.CIVBus('sim', ser=sim, **options)
+        buses.append(bus)
+        return bus
+
+    yield make
+    for bus in buses:
+        bus.ser.close()
+        bus.close()
+
+
+def test_bus_read(make_bus):
+    bus = make_bus(civ_sim.SimulatedRig('IC-7300', echo=True, timeout=0.2))
+    rig = bus.rig('IC-7300')
+    assert rig.read_freq() == 14_074_000
+    assert rig.set_freq(7_074_000)
+    assert rig.read_freq() == 7_074_000
+    assert bus.collisions == 0
+
+
+def test_collision_retry(make_bus):
+    sim = civ_sim.SimulatedRig('IC-7300', echo=True, collision_rate=0.5, seed=3, timeout=0.2)
+    bus = make_bus(sim, retries=8)
+    rig = bus.rig('IC-7300')
+    for _ in range(10):
+        assert rig.read_freq() == 14_074_000
+    assert bus.collisions > 0
+    assert bus.is_running()
+
+
+def test_collision_gives_up(make_bus):
+    sim = civ_sim.SimulatedRig('IC-7300', echo=True, collision_rate=1.0, timeout=0.2)
+    bus = make_bus(sim, retries=2)
+    rig = bus.rig('IC-7300')
+    assert rig.read_freq() == 0
+    assert bus.collisions == 3
+    assert bus.is_running()
+
+
+def test_missing_echo_after_reply(make_bus):
+    # interface does not echo, the rig still replies
+    sim = LateEchoRig(None, timeout=0.2)
+    bus = make_bus(sim, echo=True)
+    rig = bus.rig('IC-7300')
+    for _ in range(3):
+        assert rig.read_freq() == 14_074_000
+    assert bus.is_running()
+    # the reply tells the frame has reached the rig, no retransmission
+    assert bus.collisions == 0
+    assert civ_bus.JAMMER_CODE not in sim.received
+
+
+def test_late_echo(make_bus):
+    # echo arrives after the echo wait, reply after the echo
+    sim = LateEchoRig(civ_bus.ECHO_MARGIN * 2, latency=civ_bus.ECHO_MARGIN * 4, timeout=0.2)
+    bus = make_bus(sim, echo=True)
+    rig = bus.rig('IC-7300')
+    assert rig.read_freq() == 14_074_000
+    assert rig.read_opmode() == 'USB'
+    assert bus.is_running()
+
+
+def test_send_without_reply_uses_arbitration(make_bus):
+    sim = civ_sim.SimulatedRig('IC-7300', echo=True, collision_rate=1.0, timeout=0.2)
+    bus = make_bus(sim, retries=1)
+    rig = bus.rig('IC-7300')
+    assert rig.send_msg(rig.set_freq_msg(7_074_000), expect_reply=False) == b''
+    assert bus.collisions == 2
+
+
+def test_request_after_stop(make_bus):
+    bus = make_bus(civ_sim.SimulatedRig('IC-7300', echo=True, timeout=0.2))
+    bus.stop()
+    msg = bytes(civ.PREA + [0x94] + civ.ADHOST + civ.cmd_read_freq + civ.POSA)
+    assert bus.request(msg).cancelled()
+    assert bus.transact(msg, 1) is None
+    assert not bus.send(msg)
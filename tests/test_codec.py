@@ -0,0 +1,67 @@
+''' civ_codec: frames and BCD '''
+import pytest
+
+import civ_codec
+
+
+@pytest.mark.parametrize('value, length', [(0, 1), (99, 1), (123, 2), (9999, 2), (1234567, 4)])
+def test_bcd_round_trip(value, length):
+    assert civ_codec.decode_bcd(civ_codec.encode_bcd(value, length)) == value
+    assert civ_codec.decode_bcd_le(civ_codec.encode_bcd_le(value, length)) == value
+
+
+def test_bcd_byte_order():
+    assert civ_codec.encode_bcd(123, 2) == b'\x01\x23'
+    assert civ_codec.encode_freq(14_073_000) == b'\x00\x30\x07\x14\x00'
+    assert civ_codec.bcd_digits(b'\x35\x41') == '3541'
+
+
+@pytest.mark.parametrize('freq, length', [(14_074_000, 5), (7_000_000, 4), (10_368_100_000, 6)])
+def test_freq_round_trip(freq, length):
+    assert civ_codec.decode_freq(civ_codec.encode_freq(freq, length)) == freq
+
+
+def test_level_and_span_round_trip():
+    assert civ_codec.decode_level(civ_codec.encode_level(241)) == 241
+    assert civ_codec.decode_span(civ_codec.encode_span(25000)) == 25000
+
+
+def test_bcd_errors():
+    with pytest.raises(ValueError):
+        civ_codec.decode_bcd(b'\x1a')
+    with pytest.raises(ValueError):
+        civ_codec.encode_bcd(100, 1)
+
+
+def test_frame_round_trip():
+    msg = civ_codec.encode_frame(0x94, 0x15, 0x02, b'\x01\x20', src=0x00)
+    assert msg == b'\xfe\xfe\x94\x00\x15\x02\x01\x20\xfd'
+    frame = civ_codec.parse_frame(msg)
+    assert frame == civ_codec.Frame(0x94, 0x00, 0x15, 0x02, b'\x01\x20')
+    assert civ_codec.frame_to_bytes(frame) == msg
+    # 0x03 has no sub command
+    assert civ_codec.parse_frame(civ_codec.encode_frame(0x00, 0x03, src=0x94)).subcmd is None
+
+
+def test_parser_split_and_broken_frames():
+    msg = civ_codec.encode_frame(0x00, 0x03, payload=civ_codec.encode_freq(7_074_000), src=0x94)
+    parser = civ_codec.FrameParser()
+    # junk, a frame cut by the next preamble, a collision and a frame split in two reads
+    stream = b'\x12\x34' + msg[:5] + msg + b'\xfe\xfe\x94\x00\xfc\xfd' + msg
+    frames = parser.feed(stream[:-3]) + parser.feed(stream[-3:])
+    assert [civ_codec.decode_freq(f.payload) for f in frames] == [7_074_000, 7_074_000]
+    assert parser.errors == 1
+    assert parser.collisions == 1
+
+
+def test_is_reply():
+    read = civ_codec.parse_frame(civ_codec.encode_frame(0x94, 0x27, 0x11))
+    scope_on = civ_codec.parse_frame(civ_codec.encode_frame(0x94, 0x27, 0x11, b'\x01'))
+    power_off = civ_codec.parse_frame(civ_codec.encode_frame(0x94, 0x18, 0x00))
+    ok = civ_codec.Frame(0x00, 0x94, civ_codec.OK, None, b'')
+    scope_data = civ_codec.Frame(0x00, 0x94, 0x27, 0x00, b'\x00\x01\x11')
+    assert civ_codec.is_reply(scope_on, ok)
+    assert civ_codec.is_reply(power_off, ok)
+    assert not civ_codec.is_reply(read, ok)
+    assert not civ_codec.is_reply(scope_on, scope_data)
+    assert civ_codec.is_reply(read, civ_codec.Frame(0x00, 0x94, 0x27, 0x11, b'\x01'))
@@ -0,0 +1,88 @@
+''' civ_connect: ConnectionManager on simulated ports '''
+import pytest
+
+import civ_connect
+import civ_sim
+from test_rig import wait_until
+
+
+class SimPorts():
+    ''' open_serial() for ConnectionManager, port 'sim' has an IC-7300 while is_plugged '''
+    def __init__(self, is_plugged=True) -> None:
+        self.is_plugged = is_plugged
+        self.opened = []
+
+    def __call__(self, port, baudrate, timeout):
+        if port != 'sim' or not self.is_plugged:
+            raise OSError(f'could not open port {port}')
+        # short read timeout, stop_reader() waits for the reader blocked in read()
+        ser = civ_sim.SimulatedRig('IC-7300', timeout=min(timeout, 0.2))
+        self.opened.append(ser)
+        return ser
+
+    def close(self):
+        for ser in self.opened:
+            ser.close()
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    monkeypatch.setattr(civ_connect, 'RECONNECT_MIN', 0.05)
+    sim_ports = SimPorts()
+    yield sim_ports
+    sim_ports.close()
+
+
+def make_manager(ports, changes):
+    return civ_connect.ConnectionManager('IC-7300', port='sim', cache_path=None,
+                                         open_serial=ports, on_change=changes.append)
+
+
+def test_probe(ports):
+    result = civ_connect.probe('sim', 'IC-7300', open_serial=ports)
+    assert result == civ_connect.ProbeResult('sim', 115200, 0x94, 'IC-7300')
+    assert civ_connect.probe('COM99', 'IC-7300', open_serial=ports) is None
+
+
+def test_stop_reader_is_not_link_loss(ports):
+    changes = []
+    manager = make_manager(ports, changes)
+    rig = manager.connect()
+    try:
+        rig.stop_reader()
+        assert not wait_until(lambda: changes != [True], 0.3)
+        assert len(ports.opened) == 2 and ports.opened[-1].is_open
+        rig.start_reader()
+        assert rig.read_freq() == 14_074_000
+    finally:
+        manager.close()
+    assert changes == [True, False]
+
+
+def test_reconnect_after_unplug(ports):
+    changes = []
+    manager = make_manager(ports, changes)
+    rig = manager.connect()
+    try:
+        ports.opened[-1].unplug()
+        assert wait_until(lambda: changes == [True, False, True])
+        assert manager.rig is rig
+        assert rig.read_freq() == 14_074_000
+    finally:
+        manager.close()
+
+
+def test_start_without_rig(ports):
+    ports.is_plugged = False
+    changes = []
+    manager = make_manager(ports, changes)
+    with pytest.raises(ConnectionError):
+        manager.connect()
+    manager.start()
+    try:
+        assert not wait_until(lambda: changes, 0.2)
+        ports.is_plugged = True
+        assert wait_until(lambda: changes == [True])
+        assert manager.rig.read_freq() == 14_074_000
+    finally:
+        manager.close()
@@ -0,0 +1,68 @@
+''' civ_detect: Detector on synthetic and simulated sweeps '''
+import numpy as np
+
+import civ_detect
+import civ_sim
+
+POINTS = 475
+
+
+def sweep(carriers=(), floor=25):
+    ''' flat floor and carriers, (bin, level) pairs '''
+    data = np.full(POINTS, floor, dtype=np.uint8)
+    for center, level in carriers:
+        data[center - 1:center + 2] = level - 10
+        data[center] = level
+    return data
+
+
+def test_estimate_floor():
+    data = sweep([(100, 120), (300, 90)])
+    data[400:] = 40
+    floor = civ_detect.estimate_floor(data)
+    assert floor.shape == (POINTS,)
+    assert floor.dtype == np.float32
+    # carriers are not in the floor, a broad step is
+    assert floor[100] == 25 and floor[300] == 25
+    assert floor[460] == 40
+
+
+def test_carriers_from_first_sweep():
+    sim = civ_sim.SimulatedRig('IC-7300', seed=1)
+    sim.close()
+    detector = civ_detect.Detector()
+    events = []
+    for i in range(60):
+        data = np.frombuffer(sim.sweep_data(), dtype=np.uint8)
+        events += [(i, event) for event in detector.process(data, 14_074_000, 25000, float(i))]
+    # the simulator's three constant carriers are found in sweep 0 and never stop
+    first = [event for i, event in events if i == 0]
+    assert [event.kind for event in first] == ['start'] * 3
+    assert [event.bin for event in first] == [142, 261, 380]
+    assert 14_074_000 - 25000 < first[0].freq < first[1].freq < first[2].freq < 14_099_000
+    stopped = {event.bin for _, event in events if event.kind == 'stop'}
+    assert not stopped & {142, 261, 380}
+
+
+def test_start_stop_hold():
+    detector = civ_detect.Detector(threshold=20, hold=2)
+    assert detector.process(sweep(), 7_074_000, 25000, 0.0) == []
+    events = detector.process(sweep([(200, 100)]), 7_074_000, 25000, 1.0)
+    assert [(event.kind, event.bin, event.level) for event in events] == [('start', 200, 100)]
+    for t in (2.0, 3.0):
+        assert detector.process(sweep([(200, 100)]), 7_074_000, 25000, t) == []
+    # missing for hold sweeps, then stopped
+    assert detector.process(sweep(), 7_074_000, 25000, 4.0) == []
+    assert detector.process(sweep(), 7_074_000, 25000, 5.0) == []
+    events = detector.process(sweep(), 7_074_000, 25000, 6.0)
+    assert [(event.kind, event.bin, event.duration) for event in events] == [('stop', 200, 2.0)]
+
+
+def test_retune():
+    detector = civ_detect.Detector()
+    events = detector.process(sweep([(200, 100)]), 7_074_000, 25000, 0.0)
+    assert [event.kind for event in events] == ['start']
+    # carrier already on the new band is found in its first sweep
+    events = detector.process(sweep([(50, 100)]), 14_074_000, 25000, 1.0)
+    assert [(event.kind, event.bin) for event in events] == [('stop', 200), ('start', 50)]
+    assert events[1].freq < 14_074_000
@@ -0,0 +1,93 @@
+''' civ_dsp: stages on single sweeps and on blocks give the same result '''
+import numpy as np
+import pytest
+
+import civ_dsp
+from civ_scope import Sweep
+
+POINTS = 475
+
+
+def make_block(count=20, seed=1):
+    ''' (count, POINTS) uint8 sweeps, noise and one carrier '''
+    rng = np.random.default_rng(seed)
+    block = rng.normal(25, 4, (count, POINTS))
+    block[:, 200:204] += 100
+    return np.clip(block, 0, 160).astype(np.uint8)
+
+
+STAGES = {
+    'db': lambda: civ_dsp.DbScale(),
+    'exp_average': lambda: civ_dsp.ExpAverage(0.3),
+    'moving_average': lambda: civ_dsp.MovingAverage(4),
+    'max_hold': lambda: civ_dsp.PeakHold('max'),
+    'min_hold': lambda: civ_dsp.PeakHold('min'),
+    'max_hold_decay': lambda: civ_dsp.PeakHold('max', decay=0.5),
+    'decimate_max': lambda: civ_dsp.Resample(100, 'max'),
+    'decimate_mean': lambda: civ_dsp.Resample(100, 'mean'),
+    'interpolate': lambda: civ_dsp.Resample(600),
+    'pipeline': lambda: civ_dsp.Pipeline(civ_dsp.DbScale(), civ_dsp.ExpAverage(0.3),
+                                         civ_dsp.PeakHold(decay=0.5), civ_dsp.Resample(400)),
+}
+# output points and dtype of each stage for uint8 input
+OUTPUTS = {
+    'db': (POINTS, np.float32),
+    'exp_average': (POINTS, np.float32),
+    'moving_average': (POINTS, np.float32),
+    'max_hold': (POINTS, np.float32),
+    'min_hold': (POINTS, np.float32),
+    'max_hold_decay': (POINTS, np.float32),
+    'decimate_max': (100, np.uint8),
+    'decimate_mean': (100, np.float32),
+    'interpolate': (600, np.float32),
+    'pipeline': (400, np.float32),
+}
+
+
+@pytest.mark.parametrize('name', STAGES)
+def test_process_equals_process_block(name):
+    block = make_block()
+    stage = STAGES[name]()
+    # copy, stateful stages return their own buffer
+    one_by_one = np.stack([np.array(stage.process(row)) for row in block])
+
+    stage = STAGES[name]()
+    # state is carried over between blocks
+    blocks = np.concatenate([stage.process_block(block[:7]), stage.process_block(block[7:])])
+    assert np.allclose(one_by_one, blocks, atol=1e-4)
+
+
+@pytest.mark.parametrize('name', STAGES)
+def test_output_shape_dtype(name):
+    block = make_block(5)
+    points, dtype = OUTPUTS[name]
+    out = STAGES[name]().process(block[0])
+    assert out.shape == (points,)
+    assert out.dtype == dtype
+    out = STAGES[name]().process_block(block)
+    assert out.shape == (5, points)
+    assert out.dtype == dtype
+
+
+def test_stage_values():
+    block = make_block(3)
+    assert civ_dsp.DbScale().process(np.array([0, 160], dtype=np.uint8)).tolist() == [-130, -50]
+    assert np.array_equal(civ_dsp.PeakHold('max').process_block(block)[-1], block.max(axis=0))
+    average = civ_dsp.MovingAverage(2).process_block(block)
+    assert np.allclose(average[-1], block[1:].mean(axis=0))
+    decimated = civ_dsp.Resample(5).process(np.arange(10, dtype=np.uint8))
+    assert decimated.tolist() == [1, 3, 5, 7, 9]
+
+
+def test_reset_and_stream():
+    pipeline = civ_dsp.Pipeline(civ_dsp.PeakHold('max'))
+    block = make_block(2)
+    pipeline.process(block[0])
+    pipeline.reset()
+    assert np.array_equal(pipeline.process(block[1]), block[1])
+
+    sweeps = [Sweep(block[0], 7_074_000, 25000, 0, 0.0), Sweep(block[1], 14_074_000, 25000, 1, 0.0)]
+    out = list(civ_dsp.Pipeline(civ_dsp.PeakHold('max')).stream(sweeps))
+    # band changed, hold starts again
+    assert np.array_equal(out[1].data, block[1])
+    assert out[1].center_freq == 14_074_000
@@ -0,0 +1,96 @@
+''' civ_metrics: counters, latency histograms and dumps '''
+import json
+
+import civ_codec
+import civ_metrics
+
+
+def test_histogram_quantile():
+    histogram = civ_metrics.Histogram()
+    assert histogram.quantile(0.5) == 0.0
+    for sec in [0.003] * 90 + [0.03] * 9 + [3.0]:
+        histogram.observe(sec)
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.9) == 0.005
+    assert histogram.quantile(0.99) == 0.05
+    assert histogram.quantile(1.0) == 3.0
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 100
+    assert snapshot['max'] == 3.0
+    assert (snapshot['p50'], snapshot['p99']) == (0.005, 0.05)
+    # cumulative, the last bucket is +Inf
+    assert snapshot['buckets'][2] == (0.005, 90)
+    assert snapshot['buckets'][-1][1] == 100
+
+
+def test_snapshot_counters():
+    metrics = civ_metrics.Metrics()
+    metrics.names[(0x03,)] = 'freq'
+    read_freq = bytes([0xFE, 0xFE, 0x94, 0x00, 0x03, 0xFD])
+    metrics.count('bytes_out', 6)
+    metrics.transaction(read_freq, 0.0, civ_codec.Frame(0x00, 0x94, 0x03, None, b''))
+    metrics.transaction(read_freq, 0.0, None)
+    metrics.count('retries', command='freq')
+    parser = civ_codec.FrameParser()
+    parser.feed(b'\xfe\xfe\x00\x94\x03\x00\x40\x07\x14\x00\xfd\x12\xfd')
+    metrics.add_source(parser)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['bytes_out'] == 6
+    assert snapshot['counters']['frames'] == 1
+    assert snapshot['counters']['framing_errors'] == parser.errors
+    assert snapshot['command_counters'] == {'requests': {'freq': 2}, 'timeouts': {'freq': 1},
+                                            'retries': {'freq': 1}}
+    assert snapshot['latency']['freq']['count'] == 1
+
+    metrics.reset()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['frames'] == 0
+    assert snapshot['latency'] == {}
+    json.loads(metrics.to_json())
+
+
+def test_to_prometheus():
+    metrics = civ_metrics.Metrics()
+    metrics.observe('freq', 0.004)
+    metrics.observe('freq', 0.3)
+    metrics.count('requests', 2, command='freq')
+    lines = metrics.to_prometheus().splitlines()
+    assert '# TYPE civ_bytes_in_total counter' in lines
+    assert 'civ_bytes_in_total 0' in lines
+    assert 'civ_requests_total{command="freq"} 2' in lines
+    assert '# TYPE civ_latency_seconds histogram' in lines
+    assert 'civ_latency_seconds_bucket{command="freq",le="0.005"} 1' in lines
+    assert 'civ_latency_seconds_bucket{command="freq",le="0.2"} 1' in lines
+    assert 'civ_latency_seconds_bucket{command="freq",le="+Inf"} 2' in lines
+    assert 'civ_latency_seconds_sum{command="freq"} 0.304000' in lines
+    assert 'civ_latency_seconds_count{command="freq"} 2' in lines
+    assert lines[-1] == 'civ_sweep_rate 0.000'
+    for line in lines:
+        assert line.startswith('# TYPE ') or len(line.split()) == 2
+
+
+def test_enable_disable_metrics(make_rig):
+    for reader in (False, True):
+        rig = make_rig(reader=reader)
+        metrics = rig.enable_metrics()
+        traces = []
+        metrics.add_tracer(traces.append)
+        assert rig.read_freq() == 14_074_000
+        assert rig.read_opmode() == 'USB'
+        snapshot = metrics.snapshot()
+        assert snapshot['command_counters']['requests'] == {'freq': 1, 'opmode': 1}
+        assert snapshot['counters']['bytes_out'] == 12
+        assert snapshot['counters']['bytes_in'] > 0
+        assert snapshot['counters']['frames'] >= 2
+        assert set(snapshot['latency']) == {'freq', 'opmode'}
+        assert [trace.command for trace in traces] == ['freq', 'opmode']
+        assert traces[0].reply.cmd == 0x03
+
+        rig.disable_metrics()
+        assert rig.metrics is None
+        if reader:
+            assert rig.dispatcher.metrics is None
+        assert rig.read_freq() == 14_074_000
+        assert metrics.snapshot()['command_counters']['requests'] == {'freq': 1, 'opmode': 1}
+        assert len(traces) == 2
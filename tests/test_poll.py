@@ -0,0 +1,33 @@
+''' civ_poll: PollScheduler on the simulator '''
+import threading
+
+import civ_poll
+
+
+def test_default_items(make_rig):
+    names = [item.name for item in civ_poll.PollScheduler(make_rig()).items.values()]
+    assert names == ['freq', 'opmode', 'vd']
+    rig = make_rig(rig_pn='IC-705')
+    assert 'gps_position' in civ_poll.PollScheduler(rig).items
+    assert 'vd' not in civ_poll.PollScheduler(rig).items
+
+
+def test_poll(make_rig):
+    rig = make_rig(reader=True)
+    polled = {}
+    is_done = threading.Event()
+
+    def callback(values):
+        polled.update(values)
+        if {'freq', 'opmode', 'vd'} <= set(polled):
+            is_done.set()
+
+    poller = civ_poll.PollScheduler(rig, callback=callback)
+    poller.start()
+    try:
+        assert is_done.wait(2)
+    finally:
+        poller.stop()
+    assert polled['freq'] == 14_074_000
+    assert poller.get('opmode') == 'USB'
+    assert poller.age('freq') < 2
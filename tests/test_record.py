@@ -0,0 +1,120 @@
+''' civ_record: Recorder and Capture round trip, civ_replay: capture and replay of the link '''
+import time
+
+import numpy as np
+import pytest
+
+import civ
+import civ_record
+import civ_replay
+import civ_sim
+from civ_scope import Sweep
+
+
+def make_sweeps(count, points=475, t0=1_700_000_000.0):
+    ''' count sweeps with distinct data, center 7 MHz + 1 kHz * n '''
+    rng = np.random.default_rng(1)
+    return [Sweep(rng.integers(0, 160, points, dtype=np.uint8), 7_000_000 + 1000 * n, 25000,
+                  n, t0 + n) for n in range(count)]
+
+
+def test_recorder_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'scope.civrec')
+    sweeps = make_sweeps(10)
+    with civ_record.Recorder(path, 'IC-7300', 0x94, chunk_sweeps=4) as recorder:
+        for sweep in sweeps:
+            recorder.write_sweep(sweep)
+        recorder.write_telemetry(freq=7_074_000, opmode='USB', vd=13.8,
+                                 timestamp=sweeps[0].timestamp)
+        recorder.write_telemetry(freq=0, opmode='N/A', timestamp=sweeps[-1].timestamp)
+
+    with civ_record.Capture(path) as capture:
+        assert len(capture) == 10
+        assert capture.time_range() == (sweeps[0].timestamp, sweeps[-1].timestamp)
+        recorded = capture.sweeps()
+        assert np.array_equal(recorded.data, np.stack([sweep.data for sweep in sweeps]))
+        assert list(recorded.center_freq) == [sweep.center_freq for sweep in sweeps]
+
+        # time slice across chunks
+        part = capture.sweeps(t0=sweeps[3].timestamp, t1=sweeps[6].timestamp)
+        assert list(part.timestamp) == [sweep.timestamp for sweep in sweeps[3:7]]
+        assert np.array_equal(capture.max_hold(),
+                              np.max([sweep.data for sweep in sweeps], axis=0))
+
+        telemetry = capture.telemetry()
+        assert list(telemetry['freq']) == [7_074_000, 0]
+        assert list(telemetry['opmode']) == [b'USB', b'N/A']
+        assert np.isnan(telemetry['vd'][1])
+
+
+def test_recorder_appends(tmp_path):
+    path = str(tmp_path / 'scope.civrec')
+    sweeps = make_sweeps(6)
+    for part in (sweeps[:3], sweeps[3:]):
+        with civ_record.Recorder(path, 'IC-7300', 0x94) as recorder:
+            for sweep in part:
+                recorder.write_sweep(sweep)
+    with civ_record.Capture(path) as capture:
+        assert len(capture) == 6
+        assert list(capture.sweeps().center_freq) == [sweep.center_freq for sweep in sweeps]
+
+
+def test_views_after_close(tmp_path):
+    path = str(tmp_path / 'scope.civrec')
+    sweeps = make_sweeps(3)
+    with civ_record.Recorder(path, 'IC-7300', 0x94) as recorder:
+        for sweep in sweeps:
+            recorder.write_sweep(sweep)
+    with civ_record.Capture(path) as capture:
+        recorded = capture.sweeps()
+        records = capture.records(capture.chunks[0])
+    assert capture.mm is None
+    # views outlive the capture, the mapping goes with the last of them
+    assert np.array_equal(recorded.data, np.stack([sweep.data for sweep in sweeps]))
+    assert len(records) == 3
+
+
+def test_replay_serial(tmp_path):
+    path = str(tmp_path / 'link.civraw')
+    tap = civ_replay.SerialTap(civ_sim.SimulatedRig('IC-7300', echo=True), path)
+    rig = civ.CIV('sim', 'IC-7300', ser=tap)
+    live = (rig.read_freq(), rig.read_opmode(), rig.set_freq(7_074_000), rig.read_freq())
+    tap.close()
+    assert live == (14_074_000, 'USB', True, 7_074_000)
+
+    records = list(civ_replay.iter_records(path))
+    assert {direction for _, direction, _ in records} == {civ_replay.DIR_RX, civ_replay.DIR_TX}
+
+    replay = civ_replay.ReplaySerial(path, speed=None, timeout=0.5)
+    rig = civ.CIV('replay', 'IC-7300', ser=replay)
+    assert (rig.read_freq(), rig.read_opmode(), rig.set_freq(7_074_000),
+            rig.read_freq()) == live
+    replay.close()
+    assert replay.is_done
+
+
+def capture_link(path):
+    ''' capture read_freq and one scope sweep on the simulator '''
+    tap = civ_replay.SerialTap(civ_sim.SimulatedRig('IC-7300', echo=True, latency=0.02), path)
+    rig = civ.CIV('sim', 'IC-7300', ser=tap)
+    live = (rig.read_freq(), rig.read_spectrum(True)[1:])
+    rig.stop_scope_readout()
+    tap.close()
+    return live
+
+
+@pytest.mark.parametrize('speed', [1.0, 5.0])
+def test_replay_serial_timed(tmp_path, speed):
+    path = str(tmp_path / 'link.civraw')
+    live = capture_link(path)
+
+    replay = civ_replay.ReplaySerial(path, speed=speed, timeout=0.5)
+    rig = civ.CIV('replay', 'IC-7300', ser=replay)
+    rig.start_reader()
+    try:
+        # the host starts later than the capture did, replies wait for its queries
+        time.sleep(0.3)
+        assert (rig.read_freq(), rig.read_spectrum(True)[1:]) == live
+    finally:
+        rig.stop_reader()
+        replay.close()
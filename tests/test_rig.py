@@ -0,0 +1,135 @@
+''' civ.CIV against the simulator, with and without the reader thread '''
+import time
+
+import civ
+import civ_codec
+import civ_sim
+
+
+def wait_until(condition, timeout=2.0):
+    ''' True when condition() becomes true within timeout '''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_read_values(rig):
+    assert rig.read_freq() == 14_074_000
+    assert rig.read_opmode() == 'USB'
+    assert 12.0 < rig.read_vd() < 14.0
+    assert 37 <= rig.read_smeter() <= 43
+    assert rig.read_gps_position() == ('3541234001', '013945678001')
+
+
+def test_set_freq(rig):
+    assert rig.set_freq(7_074_000)
+    assert rig.ser.freq == 7_074_000
+    assert rig.read_freq() == 7_074_000
+
+
+def test_query_many(rig):
+    values = rig.query_many(['freq', 'opmode', 'vd', 'smeter', 'freq'])
+    assert list(values) == ['freq', 'opmode', 'vd', 'smeter']
+    assert values['freq'] == 14_074_000
+    assert values['opmode'] == 'USB'
+
+
+def test_send_many_matches_ok_to_set_command(rig):
+    read_freq = bytes(civ.PREA + rig.addr_rig + civ.ADHOST + civ.cmd_read_freq + civ.POSA)
+    frames = rig.send_many([read_freq, rig.set_freq_msg(3_573_000), read_freq])
+    assert [frame.cmd for frame in frames] == [0x03, civ_codec.OK, 0x03]
+    assert civ.CIV.parse_freq(frames[0]) == 14_074_000
+    assert civ.CIV.parse_freq(frames[2]) == 3_573_000
+
+
+def test_stray_ack_does_not_answer_read(make_rig):
+    for reader in (False, True):
+        rig = make_rig(reader=reader, latency=0.05)
+        rig.ser.push(rig.ser.frame(civ_codec.OK), 0.01)
+        assert rig.read_freq() == 14_074_000
+
+
+def test_no_reply(make_rig):
+    rig = make_rig(timeout=0.2)
+    rig.addr_rig = [0x42]
+    assert rig.read_freq() == 0
+    assert rig.read_opmode() == 'N/A'
+
+
+def test_read_spectrum(rig):
+    # scope on/readout on again while the stream is running
+    for is_1st in (True, True, False, True):
+        data, center_freq, span = rig.read_spectrum(is_1st)
+        assert len(data) == rig.scope_points
+        assert center_freq == 14_074_000
+        assert span == 25000
+    rig.stop_scope_readout()
+    # no OK left over from scope commands answers the next read
+    assert rig.read_freq() == 14_074_000
+
+
+def test_read_freq_after_scope_stop(make_rig):
+    rig = make_rig(echo=False)
+    assert rig.read_spectrum(True)[0]
+    rig.stop_scope_readout()
+    rig.start_reader()
+    assert rig.read_freq() == 14_074_000
+
+
+def test_iter_spectrum(rig):
+    sweeps = rig.iter_spectrum()
+    received = [sweep for sweep, _ in zip(sweeps, range(3))]
+    sweeps.close()
+    assert [sweep.seq for sweep in received] == [0, 1, 2]
+    for sweep in received:
+        assert sweep.data.shape == (rig.scope_points,)
+        assert sweep.center_freq == 14_074_000
+        assert sweep.data.max() > 100
+    assert not rig.ser.is_readout_on
+
+
+def test_state_cache(rig):
+    rig.enable_state_cache()
+    assert rig.read_freq() == 14_074_000
+    # changed on the rig without broadcast, the cached value is used while fresh
+    rig.ser.freq = 21_074_000
+    assert rig.read_freq() == 14_074_000
+    rig.state.invalidate('freq')
+    assert rig.read_freq() == 21_074_000
+    assert rig.set_freq(28_074_000)
+    assert rig.state.get('freq') == 28_074_000
+    rig.disable_state_cache()
+    assert rig.state is None
+
+
+def test_state_cache_transceive(make_rig):
+    rig = make_rig(reader=True)
+    state = rig.enable_state_cache({'freq': None})
+    rig.ser.push(rig.ser.broadcast(0x00, civ_codec.encode_freq(10_136_000)))
+    assert wait_until(lambda: state.get('freq') == 10_136_000)
+    assert rig.read_freq() == 10_136_000
+
+
+def test_listener_error_keeps_reader(make_rig):
+    rig = make_rig(reader=True)
+
+    def broken(frame):
+        raise ValueError('broken listener')
+
+    rig.dispatcher.add_listener(broken)
+    assert rig.read_freq() == 14_074_000
+    assert rig.dispatcher.is_running()
+
+
+def test_unknown_rig_logged_once(caplog):
+    sim = civ_sim.SimulatedRig('IC-7300', timeout=0.2)
+    try:
+        rig = civ.CIV('sim', 'IC-9999', ser=sim)
+    finally:
+        sim.close()
+    assert rig.profile is None
+    assert rig.addr_rig == [0x00]
+    assert sum('IC-9999' in r.getMessage() for r in caplog.records if r.levelname == 'ERROR') == 1
@@ -0,0 +1,65 @@
+''' civ_scan: scanner on the simulator '''
+import pytest
+
+import civ
+import civ_codec
+import civ_scan
+import civ_sim
+
+
+class RejectingRig(civ_sim.SimulatedRig):
+    ''' answers NG to set frequency of the frequencies in rejected '''
+    def __init__(self, rejected, **options) -> None:
+        super().__init__(**options)
+        self.rejected = set(rejected)
+        self.set_freqs = []
+
+    def answer(self, frame):
+        if frame.cmd == 0x05 and frame.payload:
+            freq = civ_codec.decode_freq(frame.payload)
+            self.set_freqs.append(freq)
+            if freq in self.rejected:
+                return self.frame(civ_codec.NG, dst=frame.src)
+        return super().answer(frame)
+
+
+def test_frange():
+    freqs = civ_scan.frange(7_000_000, 7_003_000, 1000)
+    assert list(freqs) == [7_000_000, 7_001_000, 7_002_000, 7_003_000]
+    with pytest.raises(ValueError):
+        civ_scan.frange(7_000_000, 7_003_000, 0)
+
+
+def test_scan_range_order_and_restore(rig):
+    results = list(civ_scan.scan_range(rig, 7_000_000, 7_009_000, 1000, settle=0))
+    assert [result.freq for result in results] == list(range(7_000_000, 7_010_000, 1000))
+    assert all(37 <= result.level <= 43 for result in results)
+    timestamps = [result.timestamp for result in results]
+    assert timestamps == sorted(timestamps)
+    # frequency before the scan is set back
+    assert rig.ser.freq == 14_074_000
+    assert rig.read_freq() == 14_074_000
+
+
+def test_scan_restore_on_close(rig):
+    results = civ_scan.scan(rig, [7_000_000, 7_001_000, 7_002_000], settle=0)
+    assert next(results).freq == 7_000_000
+    assert rig.ser.freq == 7_001_000
+    results.close()
+    assert rig.ser.freq == 14_074_000
+
+
+def test_scan_set_freq_failed():
+    for reader in (False, True):
+        rig = civ.CIV('sim', 'IC-7300', ser=RejectingRig([7_001_000, 7_003_000], timeout=0.5))
+        if reader:
+            rig.start_reader()
+        try:
+            results = list(civ_scan.scan(rig, range(7_000_000, 7_005_000, 1000), settle=0))
+            # S-meter of a step the rig did not tune to is not reported
+            assert [result.freq for result in results] == list(range(7_000_000, 7_005_000, 1000))
+            assert [result.level >= 0 for result in results] == [True, False, True, False, True]
+            assert rig.ser.set_freqs[-1] == 14_074_000
+        finally:
+            rig.ser.close()
+            rig.stop_reader()
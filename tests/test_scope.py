@@ -0,0 +1,51 @@
+''' civ_scope: SweepRing history '''
+import numpy as np
+
+from civ_scope import SweepRing
+
+
+def sweep(value, points=8):
+    return np.full(points, value, dtype=np.uint8)
+
+
+def test_ring_order():
+    ring = SweepRing(4, points=8)
+    assert ring.latest(2).shape == (0, 8)
+    for value in (1, 2, 3):
+        ring.push(sweep(value))
+    # rows not written yet are zero, oldest first
+    assert list(ring.view()[:, 0]) == [0, 1, 2, 3]
+    assert list(ring.latest(2)[:, 0]) == [2, 3]
+    assert list(ring.latest(10)[:, 0]) == [1, 2, 3]
+    assert ring.dropped == 0
+
+
+def test_ring_overrun():
+    ring = SweepRing(4, points=8)
+    for value in range(1, 11):
+        ring.push(sweep(value))
+    assert list(ring.view()[:, 0]) == [7, 8, 9, 10]
+    assert ring.count == 4
+    assert ring.pushed == 10
+    assert ring.dropped == 6
+    ring.clear()
+    assert (ring.pushed, ring.dropped, ring.count) == (0, 0, 0)
+    assert not ring.view().any()
+
+
+def test_ring_wrap_under_reader():
+    ring = SweepRing(4, points=8)
+    for value in range(1, 5):
+        ring.push(sweep(value))
+    held = ring.latest(2)
+    kept = held.copy()
+    seen = ring.pushed
+    assert list(held[:, 0]) == [3, 4]
+    # reader blocked while the ring wraps once
+    for value in range(5, 9):
+        ring.push(sweep(value))
+    # the held view is live: its rows now hold the newest sweeps, not 3, 4
+    assert list(held[:, 0]) == [7, 8]
+    assert list(kept[:, 0]) == [3, 4]
+    # the reader detects that its rows were overwritten from pushed
+    assert ring.pushed - seen >= ring.depth - len(held)
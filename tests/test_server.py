@@ -0,0 +1,96 @@
+''' civ_server: commands and scope subscription over TCP '''
+import socket
+
+import pytest
+
+import civ_server
+from test_rig import wait_until
+
+
+@pytest.fixture
+def server(make_rig):
+    ''' RigServer on a free local port '''
+    rig_server = civ_server.RigServer(make_rig(), port=0)
+    rig_server.start()
+    yield rig_server
+    rig_server.stop()
+
+
+def test_execute(server):
+    assert server.execute(['f']) == '14074000\n'
+    assert server.execute(['F', '7074000']) == 'RPRT 0\n'
+    assert server.execute(['\\get_freq']) == '7074000\n'
+    assert server.execute(['m']) == 'USB\n0\n'
+    assert server.execute(['l', 'STRENGTH']).endswith('\n')
+
+
+def test_execute_errors(server):
+    assert server.execute(['F']) == f'RPRT -{civ_server.RIG_EINVAL}\n'
+    assert server.execute(['f', '1']) == f'RPRT -{civ_server.RIG_EINVAL}\n'
+    assert server.execute(['F', 'abc']) == f'RPRT -{civ_server.RIG_EINVAL}\n'
+    assert server.execute(['l', 'RFPOWER']) == f'RPRT -{civ_server.RIG_ENIMPL}\n'
+    assert server.execute(['\\dump_caps']) == f'RPRT -{civ_server.RIG_ENIMPL}\n'
+
+
+def read_dump_state(f):
+    ''' read \\dump_state reply in the order of hamlib netrigctl_open(), protocol version 0 '''
+    def line():
+        return f.readline().decode('ascii').rstrip('\n')
+
+    assert int(line()) == 0
+    model, region = int(line()), int(line())
+    for _ in range(2):
+        # rx ranges, then tx ranges
+        while True:
+            fields = line().split()
+            assert len(fields) == 7
+            if all(float(field) == 0 for field in fields[:2]):
+                break
+    for _ in range(2):
+        # tuning steps, then filters
+        while True:
+            modes, value = line().split()
+            if int(modes, 16) == 0 and int(value) == 0:
+                break
+    # max RIT, XIT, IF shift, announces
+    for _ in range(4):
+        int(line())
+    # preamps, attenuators in dB
+    for _ in range(2):
+        [int(db) for db in line().split()]
+    masks = [int(line(), 16) for _ in range(6)]
+    return model, region, masks
+
+
+def test_hamlib_open_sequence(server):
+    ''' commands hamlib NET rigctl sends when it opens, then a frequency read '''
+    with socket.create_connection(server.address, timeout=2) as sock:
+        sock.sendall(b'\\chk_vfo\n\\dump_state\nf\nm\n')
+        with sock.makefile('rb') as f:
+            assert f.readline() == b'0\n'
+            model, _, masks = read_dump_state(f)
+            assert model == 2
+            # get_level STRENGTH
+            assert masks[2] == 0x40000000
+            # nothing left over from dump_state
+            assert f.readline() == b'14074000\n'
+            assert f.readline() == b'USB\n'
+
+
+def read_sweep_line(server):
+    ''' subscribe, read one sweep line and disconnect '''
+    with socket.create_connection(server.address, timeout=2) as sock:
+        sock.sendall(b'\\subscribe_scope\n')
+        with sock.makefile('rb') as f:
+            return f.readline().split()
+
+
+def test_subscribe_scope_again(server):
+    sim = server.rig.ser
+    for _ in range(2):
+        fields = read_sweep_line(server)
+        assert fields[0] == b'SWEEP'
+        assert int(fields[2]) == 14_074_000
+        assert len(bytes.fromhex(fields[4].decode())) == server.rig.scope_points
+        # the stream stops when the last client has gone
+        assert wait_until(lambda: server.scope_thread is None and not sim.is_readout_on)
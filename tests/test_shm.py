@@ -0,0 +1,140 @@
+''' civ_shm: sweep ring in shared memory '''
+import gc
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import civ_shm
+
+POINTS = 8
+
+
+def publish(publisher, n):
+    ''' sweep n: data n, n + 1, ..., center 7 MHz + n kHz '''
+    data = (np.arange(POINTS) + n).astype(np.uint8)
+    publisher.publish(data, 7_000_000 + 1000 * n, 25000, 1000.0 + n)
+
+
+@pytest.fixture
+def publisher():
+    with civ_shm.SweepPublisher(slots=4, points=POINTS) as sweep_publisher:
+        yield sweep_publisher
+
+
+def test_round_trip(publisher):
+    with civ_shm.SweepReader(publisher.name, latest=False) as reader:
+        assert (reader.slots, reader.points) == (4, POINTS)
+        assert reader.read_new() == []
+        for n in range(3):
+            publish(publisher, n)
+        sweeps = reader.read_new()
+        assert [sweep.seq for sweep in sweeps] == [0, 1, 2]
+        for n, sweep in enumerate(sweeps):
+            assert list(sweep.data) == list(range(n, n + POINTS))
+            assert sweep.center_freq == 7_000_000 + 1000 * n
+            assert sweep.span == 25000
+            assert sweep.timestamp == 1000.0 + n
+        assert reader.read_new() == []
+        assert reader.overruns == 0
+
+
+def read_in_child(name, out):
+    ''' reader in another process, puts (seq, center_freq, data sum) of sweeps read '''
+    with civ_shm.SweepReader(name, latest=False) as reader:
+        out.put([(sweep.seq, sweep.center_freq, int(sweep.data.sum()))
+                 for sweep in reader.read_new(copy=True)])
+
+
+def test_round_trip_other_process(publisher):
+    for n in range(3):
+        publish(publisher, n)
+    context = multiprocessing.get_context('spawn')
+    out = context.Queue()
+    process = context.Process(target=read_in_child, args=(publisher.name, out))
+    process.start()
+    try:
+        received = out.get(timeout=30)
+    finally:
+        process.join(30)
+    assert process.exitcode == 0
+    assert received == [(n, 7_000_000 + 1000 * n, sum(range(n, n + POINTS)))
+                        for n in range(3)]
+
+
+def test_overrun(publisher):
+    reader = civ_shm.SweepReader(publisher.name, latest=False)
+    try:
+        for n in range(10):
+            publish(publisher, n)
+        # the slot after the newest may be being written, 3 of 4 slots are readable
+        assert [sweep.seq for sweep in reader.read_new()] == [7, 8, 9]
+        assert reader.overruns == 7
+    finally:
+        reader.close()
+
+
+def test_torn_read(publisher):
+    reader = civ_shm.SweepReader(publisher.name, latest=False)
+    try:
+        for n in range(4):
+            publish(publisher, n)
+        # writer has started sweep 5 in the slot of sweep 1: begin is set, end is not
+        publisher.meta[1]['begin'] = 6
+        assert reader.get(1) is None
+        assert not reader.is_valid(1)
+        publisher.meta[1]['begin'] = 2
+        assert reader.get(1).seq == 1
+
+        # overwritten while the reader copies it out
+        get = reader.get
+
+        def get_and_overwrite(n):
+            sweep = get(n)
+            if n == 1:
+                publish(publisher, 4)
+                publish(publisher, 5)
+            return sweep
+
+        reader.get = get_and_overwrite
+        # sweep 0 is skipped as the slot may be being written, sweep 1 fails the check after copy
+        assert [sweep.seq for sweep in reader.read_new(copy=True)] == [2, 3]
+        assert reader.overruns == 2
+    finally:
+        reader.close()
+
+
+def test_close(publisher):
+    publish(publisher, 0)
+    reader = civ_shm.SweepReader(publisher.name, latest=False)
+    sweeps = reader.read_new(copy=False)
+    finalizer = reader.finalizer
+    reader.close()
+    # the reader does not remove the shared memory
+    with civ_shm.SweepReader(publisher.name) as other:
+        assert other.written == 1
+    # a view read without copy outlives close(), the mapping goes with it
+    assert list(sweeps[0].data) == list(range(POINTS))
+    assert finalizer.alive
+    del sweeps
+    gc.collect()
+    assert not finalizer.alive
+
+
+def test_unlink_on_close():
+    publisher = civ_shm.SweepPublisher(slots=2, points=POINTS)
+    name = publisher.name
+    publisher.close()
+    with pytest.raises(FileNotFoundError):
+        civ_shm.SweepReader(name)
+
+
+def test_not_a_sweep_ring():
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(create=True, size=civ_shm.shm_size(2, POINTS))
+    try:
+        with pytest.raises(ValueError):
+            civ_shm.SweepReader(shm.name)
+    finally:
+        shm.close()
+        shm.unlink()